@@ -5,6 +5,8 @@ from .endpoints.authentication import router as auth_router
 from .endpoints.home import router as home_router
 from .endpoints.location import router as location_router
 from .endpoints.survey import router as survey_router
+from .endpoints.job import router as job_router
+from .endpoints.metrics import router as metrics_router
 
 router = APIRouter()
 router.include_router(auth_router)
@@ -12,3 +14,5 @@ router.include_router(user_router)
 router.include_router(home_router)
 router.include_router(location_router)
 router.include_router(survey_router)
+router.include_router(job_router)
+router.include_router(metrics_router)
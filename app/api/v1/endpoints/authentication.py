@@ -1,17 +1,23 @@
-from fastapi import APIRouter, Depends, status, HTTPException
-from pymongo import MongoClient
+from fastapi import APIRouter, status, HTTPException
 
-from ....core.config import ACCESS_TOKEN_EXPIRE_MINUTES
+from ....core.config import ACCESS_TOKEN_EXPIRE_MINUTES, PASSWORD_HASH_RETRY_AFTER
 from ....core.jwt import generate_token
-from ....db.mongodb import get_database
+from ....core.security import PasswordPoolFullError
 from ....models.user import User, UserInLogin
 from ....crud.user import authenticate_user
 
 router = APIRouter()
 
 @router.post("/login", tags=["Authentication"])
-def login(user_login: UserInLogin, db: MongoClient = Depends(get_database)):
-    user = authenticate_user(user_login, db)
+async def login(user_login: UserInLogin):
+    try:
+        user = await authenticate_user(user_login)
+    except PasswordPoolFullError:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many logins at the moment, please try again later",
+            headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER)},
+        )
     print(user)
     if(not user):
         raise HTTPException(
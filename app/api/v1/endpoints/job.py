@@ -0,0 +1,31 @@
+from fastapi import APIRouter, Depends, HTTPException
+from pymongo import MongoClient
+
+from ....core.jwt import validate_token
+from ....crud.job import get_job_by_id
+from ....db.mongodb import get_database
+from ....models.auth import AuthToken
+
+router = APIRouter()
+
+
+@router.get("/jobs/{job_id}", tags=["Job"])
+def get_job_status(
+    job_id: str,
+    db: MongoClient = Depends(get_database),
+    auth: AuthToken = Depends(validate_token)
+):
+    """Get status, progress, result and error of a background job"""
+    job = get_job_by_id(job_id, db)
+    if(not job or job["owner"] != auth.username):
+        raise HTTPException(
+            status_code=404,
+            detail="Job not found"
+        )
+
+    return {
+        "success": True,
+        "messages": {
+            "data": job
+        }
+    }
@@ -1,17 +1,32 @@
-from fastapi import APIRouter, Depends, status, HTTPException
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, Query, Request, Response, status, HTTPException
 from pymongo import MongoClient
+from starlette.concurrency import run_in_threadpool
 
-from ....models.location import LocationInUpdateCode, LocationInCreate
+from ....models.location import LocationInUpdateCode, LocationInCreate, LocationListInResolve, LocationInBulk
 from ....models.auth import AuthToken
 from ....db.mongodb import get_database
-from ....core.jwt import validate_token
-from ....core.authorization import validate_user_authorization_on_update_location
+from ....core.config import (LOCATION_RESOLVE_MAX_CODES,
+                             LOCATION_BULK_MAX_UNITS,
+                             CACHE_CONTROL_LOCATION_CHILDS,
+                             CACHE_CONTROL_LOCATION_COORDINATES)
+from ....core.http_cache import make_etag, conditional_response
+from ....core.jwt import validate_token, get_current_user
+from ....core.authorization import (validate_user_authorization_on_update_location,
+                                    validate_user_authorization_on_location_code)
 from ....crud.location import (update_code_of_location,
                                is_location_exists,
                                create_new_location,
                                get_all_childs_from_code,
-                               retrieve_coordinates_of_childs_loc)
-from ....crud.user import get_user_by_username
+                               retrieve_coordinates_of_childs_loc,
+                               resolve_location_codes)
+from ....crud.location_import import upsert_locations
+from ....crud.location_geo import parse_bbox, retrieve_locations_within
+from ....crud.location_tree import location_levels
+from ....crud.reference_snapshot import reference_snapshot
+from ....crud.user import manage_location_cache
+from ....models.user import User
 
 router = APIRouter()
 
@@ -20,10 +35,9 @@ router = APIRouter()
 def update_location_code(
     location: LocationInUpdateCode,
     db: MongoClient = Depends(get_database),
-    auth: AuthToken = Depends(validate_token)
+    user: User = Depends(get_current_user)
 ):
     return_msg = ""
-    user = get_user_by_username(auth.username, db)
 
     if(validate_user_authorization_on_update_location(user, location, db)):
         is_success = update_code_of_location(user, location, db)
@@ -49,10 +63,8 @@ def update_location_code(
 def create_location(
     location: LocationInCreate,
     db: MongoClient = Depends(get_database),
-    auth: AuthToken = Depends(validate_token)
+    user: User = Depends(get_current_user)
 ):
-
-    user = get_user_by_username(auth.username, db)
     if(not is_location_exists(user.manage_location, location, db)):
         # location not exists
         create_new_location(user, location, db)
@@ -65,13 +77,45 @@ def create_location(
         "messages": {},
         "success": True
     }
+
+
+@router.post("/location/bulk", tags=["Location"])
+def bulk_upsert_locations(
+    locations: List[LocationInBulk],
+    db: MongoClient = Depends(get_database),
+    user: User = Depends(get_current_user)
+):
+    """Create or update many locations below the managed location, matched by code"""
+    if(len(locations) > LOCATION_BULK_MAX_UNITS):
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {LOCATION_BULK_MAX_UNITS} locations can be written at once"
+        )
+    for location in locations:
+        if(not validate_user_authorization_on_location_code(user, location.code)):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail=f"User is not authorized to access location {location.code}",
+            )
+    data = upsert_locations(locations, db)
+
+    return {
+        "messages": data,
+        "success": data["failed"] == 0
+    }
     
 @router.get("/location/{loc_code}/childs", tags=["Location"])
 def get_childs_info_of_loc(
     loc_code: str,
+    request: Request,
+    response: Response,
     db: MongoClient = Depends(get_database),
     auth: AuthToken = Depends(validate_token)
     ):
+    etag = get_subtree_etag("childs", loc_code)
+    not_modified = conditional_response(request, response, etag, CACHE_CONTROL_LOCATION_CHILDS)
+    if(not_modified):
+        return not_modified
     data = get_all_childs_from_code(loc_code, db)
     
     return {
@@ -82,13 +126,23 @@ def get_childs_info_of_loc(
     }
 
 @router.get("/location/childs/coordinates", tags=["Location"])
-def get_coordinates_of_childs_loc(
+async def get_coordinates_of_childs_loc(
+    request: Request,
+    response: Response,
     db: MongoClient = Depends(get_database),
     auth: AuthToken = Depends(validate_token)
     ):
     """Get coordinates lat lng of location that user manage"""
-    user = get_user_by_username(auth.username, db)
-    data = retrieve_coordinates_of_childs_loc(user.manage_location, db)
+    # the managed location of a user never changes, a 304 does not need to look the user up
+    manage_location = manage_location_cache.get(auth.username)
+    if(manage_location is None):
+        manage_location = (await get_current_user(auth)).manage_location
+    # same listing and ETag as /location/{manage_location}/childs/coordinates
+    etag = get_subtree_etag("coordinates", manage_location)
+    not_modified = conditional_response(request, response, etag, CACHE_CONTROL_LOCATION_COORDINATES)
+    if(not_modified):
+        return not_modified
+    data = await run_in_threadpool(retrieve_coordinates_of_childs_loc, manage_location, db)
     
     return {
         "messages": {
@@ -100,10 +154,16 @@ def get_coordinates_of_childs_loc(
 @router.get("/location/{loc_code}/childs/coordinates", tags=["Location"])
 def get_coordinates_childs_of_loc(
     loc_code: str,
+    request: Request,
+    response: Response,
     db: MongoClient = Depends(get_database),
     auth: AuthToken = Depends(validate_token)
     ):
     """Get coordinate of loc's childs"""
+    etag = get_subtree_etag("coordinates", loc_code)
+    not_modified = conditional_response(request, response, etag, CACHE_CONTROL_LOCATION_COORDINATES)
+    if(not_modified):
+        return not_modified
     data = retrieve_coordinates_of_childs_loc(loc_code, db)
     
     return {
@@ -111,4 +171,57 @@ def get_coordinates_childs_of_loc(
             "data": data
         },
         "success": True
-    }
\ No newline at end of file
+    }
+
+
+def get_subtree_etag(route: str, loc_code: str) -> Optional[str]:
+    """ETag of a listing below `loc_code`, None when the location is not in the snapshot"""
+    version = reference_snapshot.get_version(loc_code)
+    if(version is None):
+        return None
+    return make_etag(route, loc_code, version)
+
+
+@router.post("/location/resolve", tags=["Location"])
+def resolve_locations(
+    location: LocationListInResolve,
+    db: MongoClient = Depends(get_database),
+    auth: AuthToken = Depends(validate_token)
+    ):
+    """Get name, level and ancestors of location codes of any level"""
+    if(len(location.codes) > LOCATION_RESOLVE_MAX_CODES):
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {LOCATION_RESOLVE_MAX_CODES} codes can be resolved at once"
+        )
+    data, not_found = resolve_location_codes(location.codes, db)
+
+    return {
+        "messages": {
+            "data": data,
+            "not_found": not_found
+        },
+        "success": True
+    }
+
+
+@router.get("/location/within", tags=["Location"])
+def get_locations_within(
+    bbox: str = Query(..., description="min_lng,min_lat,max_lng,max_lat"),
+    zoom: int = Query(..., ge=0, le=22),
+    level: str = "ward",
+    db: MongoClient = Depends(get_database),
+    auth: AuthToken = Depends(validate_token)
+    ):
+    """Get locations inside a map viewport, grid clusters with survey totals at low zoom"""
+    if(level not in location_levels):
+        raise HTTPException(
+            status_code=400,
+            detail=f"level must be one of {', '.join(location_levels)}"
+        )
+    data = retrieve_locations_within(parse_bbox(bbox), zoom, level, db)
+
+    return {
+        "messages": data,
+        "success": True
+    }
@@ -0,0 +1,20 @@
+from fastapi import APIRouter, Depends
+
+from ....core.jwt import validate_token
+from ....core.metrics import collect_metrics
+from ....models.auth import AuthToken
+
+router = APIRouter()
+
+
+@router.get("/metrics", tags=["Metrics"])
+def get_metrics(
+    auth: AuthToken = Depends(validate_token)
+):
+    """Runtime metrics of this worker process"""
+    return {
+        "success": True,
+        "messages": {
+            "data": collect_metrics()
+        }
+    }
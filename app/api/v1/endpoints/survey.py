@@ -4,37 +4,50 @@ from fastapi.datastructures import UploadFile
 from fastapi.responses import FileResponse
 from fastapi.exceptions import HTTPException
 from pymongo import MongoClient
-from app.crud.user import get_user_by_username
-import xlrd
+from typing import List
+from uuid import uuid4
+import os
 import shutil
 
 from app.models.survey import SurveyDeleteCitizen, SurveyForm
 from ....models.auth import AuthToken
+from ....models.user import User
 
-from ....db.mongodb import get_database
-from ....core.jwt import validate_token
+from ....core.config import SURVEY_UPLOAD_DIR, SURVEY_IMPORT_CHUNK_SIZE, SURVEY_IMPORT_MAX_ERRORS
+from ....core.jobs import job_runner, JobQueueFullError
+from ....db.mongodb import get_database, run_query
+from ....core.jwt import validate_token, get_current_user
 from ....crud.location import get_location_unit_from_location_code
 from ....crud.survey import (check_user_has_permission_to_delete, get_citizen_by_identidy_number, get_citizen_by_username,
                              get_citizens_from_survey_col,
                              retrieve_number_of_people_per_occupation,
                              retrieve_age_dist_per_gender,
                              insert_data_into_col,
+                             insert_many_data_into_col,
                              retrieve_doc_in_survey,
-                             count_number_survey_of_loc)
-from ....models.location import LocationListInSurvey
+                             count_number_survey_of_loc,
+                             retrieve_location_dashboard,
+                             DASHBOARD_OPTIONAL_FACETS,
+                             SURVEY_ROW_INSERTED)
+from ....crud import survey_async
+from ....crud.survey_import import (get_file_extension,
+                                    import_uploaded_survey_file,
+                                    SURVEY_FILE_EXTENSIONS)
+from ....models.location import LocationListInSurvey, LocationDashboardInSurvey
 
 router = APIRouter()
 
 
 @router.get('/survey/location/citizens', tags=["Survey"])
-def get_citizens_from_location_code(
+async def get_citizens_from_location_code(
     code: str,
-    db: MongoClient = Depends(get_database),
     auth: AuthToken = Depends(validate_token)
 ):
     """List all citizens of a given location code"""
     location_unit = get_location_unit_from_location_code(code)
-    data = get_citizens_from_survey_col(code, location_unit, db)
+    data = await run_query(get_citizens_from_survey_col,
+                           survey_async.get_citizens_from_survey_col,
+                           code, location_unit)
 
     if len(data) != 0:
         return {
@@ -51,15 +64,16 @@ def get_citizens_from_location_code(
 
 
 @router.get('/survey/citizens', tags=['Survey'])
-def get_citizen_managed_by_username(
-    db: MongoClient = Depends(get_database),
+async def get_citizen_managed_by_username(
     auth: AuthToken = Depends(validate_token)
 ):
 
     username = auth.username
     location_unit = get_location_unit_from_location_code(username)
     if location_unit == 'ward' or location_unit == 'civil_group':
-        data = get_citizen_by_username(username, location_unit, db)
+        data = await run_query(get_citizen_by_username,
+                               survey_async.get_citizen_by_username,
+                               username, location_unit)
 
         if len(data) != 0:
             return {
@@ -78,13 +92,14 @@ def get_citizen_managed_by_username(
 
 
 @router.get('/survey/citizen/{id_number}', tags=["Survey"])
-def get_citizen_by_id_number(
+async def get_citizen_by_id_number(
     id_number: str,
-    db: MongoClient = Depends(get_database),
     auth: AuthToken = Depends(validate_token)
 ):
     """Get one citizen by a given identity number"""
-    data = get_citizen_by_identidy_number(id_number, db)
+    data = await run_query(get_citizen_by_identidy_number,
+                           survey_async.get_citizen_by_identidy_number,
+                           id_number)
 
     if data != None:
         return {
@@ -101,13 +116,14 @@ def get_citizen_by_id_number(
 
 
 @router.post('/survey/location/occupation', tags=["Survey"])
-def get_number_of_peole_per_occupation(
+async def get_number_of_peole_per_occupation(
     location: LocationListInSurvey,
-    db: MongoClient = Depends(get_database),
     auth: AuthToken = Depends(validate_token)
 ):
     """Get number of people in each occupation"""
-    data = retrieve_number_of_people_per_occupation(location, db)
+    data = await run_query(retrieve_number_of_people_per_occupation,
+                           survey_async.retrieve_number_of_people_per_occupation,
+                           location)
 
     return {
         "success": True,
@@ -118,15 +134,16 @@ def get_number_of_peole_per_occupation(
 
 
 @router.post('/survey/location/age-dist', tags=["Survey"])
-def get_age_gender_dist_in_loc(
+async def get_age_gender_dist_in_loc(
     location: LocationListInSurvey,
     gender: str,
-    db: MongoClient = Depends(get_database),
     auth: AuthToken = Depends(validate_token)
 ):
     """Get number of oeople in each age range (per gender)"""
     if(gender in ["Nam", "Nữ"]):
-        data = retrieve_age_dist_per_gender(location, gender, db)
+        data = await run_query(retrieve_age_dist_per_gender,
+                               survey_async.retrieve_age_dist_per_gender,
+                               location, gender)
 
         return {
             "success": True,
@@ -141,13 +158,37 @@ def get_age_gender_dist_in_loc(
         )
 
 
+@router.post('/survey/location/dashboard', tags=["Survey"])
+async def get_location_dashboard(
+    location: LocationDashboardInSurvey,
+    auth: AuthToken = Depends(validate_token)
+):
+    """Get count, occupation and age distribution per gender (plus optional series) in one query"""
+    invalid_facets = [f for f in location.facets if f not in DASHBOARD_OPTIONAL_FACETS]
+    if(invalid_facets):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Facets not existed: {', '.join(invalid_facets)}"
+        )
+
+    data = await run_query(retrieve_location_dashboard,
+                           survey_async.retrieve_location_dashboard,
+                           location)
+
+    return {
+        "success": True,
+        "messages": {
+            "data": data
+        }
+    }
+
+
 @router.post('/survey/insert', tags=['Survey'])
 def insert_data(
     data: SurveyForm,
     db: MongoClient = Depends(get_database),
-    auth: AuthToken = Depends(validate_token)
+    user: User = Depends(get_current_user)
 ):
-    user = get_user_by_username(auth.username, db)
     if not user.active:
         return {
             "success": False,
@@ -172,14 +213,38 @@ def insert_data(
         }
 
 
+@router.post('/survey/insert/batch', tags=['Survey'])
+def insert_batch_data(
+    data: List[SurveyForm],
+    db: MongoClient = Depends(get_database),
+    user: User = Depends(get_current_user)
+):
+    """Insert many survey forms at once, the result of each form is reported by its index"""
+    if not user.active:
+        return {
+            "success": False,
+            "messages": 'user is not active'
+        }
+
+    results = insert_many_data_into_col(data, db)
+    inserted = len([row for row in results if row["status"] == SURVEY_ROW_INSERTED])
+    return {
+        "success": True,
+        "messages": {
+            "inserted": inserted,
+            "failed": len(results) - inserted,
+            "data": results
+        }
+    }
+
+
 @router.post('/survey/citizen/delete', tags=['Survey'])
 def delete_one_citizen(
     citizen: SurveyDeleteCitizen,
     db: MongoClient = Depends(get_database),
-    auth: AuthToken = Depends(validate_token)
+    user: User = Depends(get_current_user)
 ):
     id_num = citizen.identity_number
-    user = get_user_by_username(auth.username, db)
     if not user.active:
         return {
             "success": False,
@@ -208,13 +273,13 @@ def delete_one_citizen(
 
 
 @router.get('/survey/search/{keyword}', tags=['Survey'])
-def search_in_survey_by_keyword(
+async def search_in_survey_by_keyword(
     keyword: str,
-    db: MongoClient = Depends(get_database),
-    auth: AuthToken = Depends(validate_token)
+    user: User = Depends(get_current_user)
 ):
-    user = get_user_by_username(auth.username, db)
-    data = retrieve_doc_in_survey(keyword, user.manage_location, db)
+    data = await run_query(retrieve_doc_in_survey,
+                           survey_async.retrieve_doc_in_survey,
+                           keyword, user.manage_location)
     return {
         "success": True,
         "messages": {
@@ -224,24 +289,48 @@ def search_in_survey_by_keyword(
 
 
 @router.post('/survey/upload_file', tags=['Survey'])
-async def upload_file_survey(
+def upload_file_survey(
     file: UploadFile = File(...),
     db: MongoClient = Depends(get_database),
-    auth: AuthToken = Depends(validate_token)
+    user: User = Depends(get_current_user)
 ):
-    user = get_user_by_username(auth.username, db)
+    """Import survey forms from an uploaded csv/xls/xlsx file in the background, poll /jobs/{job_id} for the report"""
     if not user.active:
         return {
             "success": False,
             "messages": 'user is not active'
         }
 
-    with open(f'survey_upload/{file.filename}', 'wb') as buffer:
+    extension = get_file_extension(file.filename)
+    if extension not in SURVEY_FILE_EXTENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Only {', '.join(SURVEY_FILE_EXTENSIONS)} files are supported",
+        )
+
+    os.makedirs(SURVEY_UPLOAD_DIR, exist_ok=True)
+    file_path = os.path.join(SURVEY_UPLOAD_DIR, f'{uuid4().hex}.{extension}')
+    with open(file_path, 'wb') as buffer:
         shutil.copyfileobj(file.file, buffer)
 
-    # content = await file.read()
-    # print(content)
-    return file.filename
+    try:
+        job_id = job_runner.submit(
+            'survey_import', user.username, import_uploaded_survey_file,
+            file_path, extension, SURVEY_IMPORT_CHUNK_SIZE, SURVEY_IMPORT_MAX_ERRORS, db,
+            db=db)
+    except JobQueueFullError:
+        os.remove(file_path)
+        raise HTTPException(
+            status_code=503,
+            detail="Too many imports are running, please try again later",
+            headers={"Retry-After": "30"},
+        )
+    return {
+        "success": True,
+        "messages": {
+            "job_id": job_id
+        }
+    }
 
 
 @router.get('/survey/template/download', response_class=FileResponse, tags=['Survey'])
@@ -254,13 +343,14 @@ def get_template(
     # return file_path
     
 @router.post('/survey/location/count', tags=["Survey"])
-def get_number_of_survey_of_location(
+async def get_number_of_survey_of_location(
     locs: LocationListInSurvey,
-    db: MongoClient = Depends(get_database),
     auth: AuthToken = Depends(validate_token)
 ):
     """Count number of people do survey in location"""
-    data = count_number_survey_of_loc(locs, db)
+    data = await run_query(count_number_survey_of_loc,
+                           survey_async.count_number_survey_of_loc,
+                           locs)
 
     if len(data) != 0:
         return {
@@ -1,32 +1,49 @@
-from fastapi import APIRouter, Body, Depends, Request, HTTPException
+from typing import List
+
+from fastapi import APIRouter, Body, Depends, Query, Request, Response, HTTPException
 from pydantic.networks import EmailStr
 from pymongo import MongoClient, message
+from starlette.concurrency import run_in_threadpool
 from uuid import uuid4
 
-from ....core.jwt import validate_token
+from ....core.config import CACHE_CONTROL_CHILD_ROLES, PASSWORD_HASH_RETRY_AFTER, USER_BATCH_MAX_USERS
+from ....core.http_cache import make_etag, conditional_response
+from ....core.jwt import validate_token, get_current_user
+from ....core.security import password_hasher, PasswordPoolFullError
 from ....core.authorization import (validate_role_authorization_on_create,
                                     validate_user_authorization_on_crud_others)
 from ....db.mongodb import get_database
-from ....models.user import UserInCreate, UserInAuthorize, UserInDelete, UserState
+from ....models.user import User, UserInCreate, UserInAuthorize, UserInDelete, UserState
 from ....models.auth import AuthToken
-from ....crud.user import (create_new_user, delete_user_by_username, get_child_role, get_child_user_survey_time_from_user_id,
-                           get_management_info_by_username,
-                           get_user_by_username,
+from ....crud.user import (create_new_user, create_new_users, USER_ROW_INSERTED,
+                           delete_user_by_username, get_child_role, get_child_user_survey_time_from_user_id,
+                           get_descendant_users,
+                           get_subtree_progress,
+                           get_management_info_of_user,
                            get_child_user_from_user_id, update_is_finish,
                            update_user_state,
                            update_valid_declare_time)
+from ....crud.reference_snapshot import reference_snapshot
 
 router = APIRouter()
 
 
 @router.post("/user/create", tags=["User"])
-def create_user(
+async def create_user(
     user: UserInCreate,
     db: MongoClient = Depends(get_database),
-    auth: AuthToken = Depends(validate_token)
+    current_user: User = Depends(get_current_user)
 ):
-    if(validate_role_authorization_on_create(auth.role, user.role, db)):
-        valid = create_new_user(user, auth.username, db)
+    if(validate_role_authorization_on_create(current_user.role, user.role, db)):
+        try:
+            user.password = await password_hasher.hash(user.password)
+        except PasswordPoolFullError:
+            raise HTTPException(
+                status_code=503,
+                detail="Too many password operations at the moment, please try again later",
+                headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER)},
+            )
+        valid = await run_in_threadpool(create_new_user, user, current_user, db)
         if(not valid):
             raise HTTPException(
                 status_code=409,
@@ -43,14 +60,54 @@ def create_user(
     }
 
 
+@router.post("/user/create/batch", tags=["User"])
+async def create_users(
+    users: List[UserInCreate],
+    db: MongoClient = Depends(get_database),
+    current_user: User = Depends(get_current_user)
+):
+    """Create many child users at once, the result of each user is reported by its index"""
+    if(len(users) > USER_BATCH_MAX_USERS):
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {USER_BATCH_MAX_USERS} users can be created at once",
+        )
+    for role in sorted({user.role for user in users}):
+        if(not validate_role_authorization_on_create(current_user.role, role, db)):
+            raise HTTPException(
+                status_code=401,
+                detail=f"User is not authorized to create a new user with role {role}",
+            )
+    try:
+        passwords = await password_hasher.hash_many([user.password for user in users])
+    except PasswordPoolFullError:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many password operations at the moment, please try again later",
+            headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER)},
+        )
+    for user, password in zip(users, passwords):
+        user.password = password
+    results = await run_in_threadpool(create_new_users, users, current_user, db)
+    inserted = len([row for row in results if row["status"] == USER_ROW_INSERTED])
+    return {
+        "success": True,
+        "messages": {
+            "inserted": inserted,
+            "failed": len(results) - inserted,
+            "data": results
+        }
+    }
+
+
 @router.post("/user/delete", tags=["User"])
 def delete_user(
     user: UserInDelete,
     db: MongoClient = Depends(get_database),
-    auth: AuthToken = Depends(validate_token)
+    current_user: User = Depends(get_current_user)
 
 ):
-    if(validate_user_authorization_on_crud_others(auth.username, user.username, db)):
+    if(validate_user_authorization_on_crud_others(current_user, user.username, db)):
         is_success = delete_user_by_username(user, db)
         message = 'Delete user ' + user.username + ' successfully'
     else:
@@ -67,10 +124,10 @@ def delete_user(
 @router.get("/user/childs/all", tags=["User"])
 def get_all_management_childs_all(
     db: MongoClient = Depends(get_database),
-    auth: AuthToken = Depends(validate_token)
+    user: User = Depends(get_current_user)
 ):
     """List all childs (locations and users) of a given user"""
-    data = get_management_info_by_username(auth.username, db)
+    data = get_management_info_of_user(user, db)
 
     return {
         "success": True,
@@ -83,10 +140,9 @@ def get_all_management_childs_all(
 @router.get("/user/childs/user", tags=["User"])
 def get_all_management_childs_user(
     db: MongoClient = Depends(get_database),
-    auth: AuthToken = Depends(validate_token)
+    user: User = Depends(get_current_user)
 ):
     """List all childs (users) of a given user"""
-    user = get_user_by_username(auth.username, db)
     data = get_child_user_from_user_id(user.id, db)
 
     return {
@@ -97,12 +153,37 @@ def get_all_management_childs_user(
     }
 
 
+@router.get("/user/childs/descendants", tags=["User"])
+def get_all_descendant_users(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=10000),
+    db: MongoClient = Depends(get_database),
+    user: User = Depends(get_current_user)
+):
+    """List the users at any depth below the current user"""
+    data = get_descendant_users(user, skip, limit, db)
+
+    return {
+        "success": True,
+        "messages": {
+            "data": data
+        }
+    }
+
+
 @router.get('/user/childs/role', tags=['User'])
 def get_child_role_name(
+    request: Request,
+    response: Response,
     db: MongoClient = Depends(get_database),
     auth: AuthToken = Depends(validate_token)
 ):
     role = auth.role
+    version = reference_snapshot.get_roles_version()
+    etag = make_etag("child_roles", role, version) if version is not None else None
+    not_modified = conditional_response(request, response, etag, CACHE_CONTROL_CHILD_ROLES)
+    if(not_modified):
+        return not_modified
     child_role_name = get_child_role(role, db)
 
     if child_role_name:
@@ -122,9 +203,8 @@ def get_child_role_name(
 @router.get('/user/childs/survey_time', tags=['User'])
 def get_child_survey_time(
     db: MongoClient = Depends(get_database),
-    auth: AuthToken = Depends(validate_token)
+    user: User = Depends(get_current_user)
 ):
-    user = get_user_by_username(auth.username, db)
     child_users = get_child_user_survey_time_from_user_id(user.id, db)
 
     if child_users:
@@ -155,9 +235,8 @@ def get_child_survey_time(
 @router.post('/user/finish_task', tags=['User'])
 def remark_finishing_task(
     db: MongoClient = Depends(get_database),
-    auth: AuthToken = Depends(validate_token)
+    user: User = Depends(get_current_user)
 ):
-    user = get_user_by_username(auth.username, db)
     res = update_is_finish(user, db)
 
     if isinstance(res, str):
@@ -172,14 +251,30 @@ def remark_finishing_task(
         }
 
 
+@router.get('/user/progress', tags=['User'])
+def get_progress_of_subtree(
+    db: MongoClient = Depends(get_database),
+    user: User = Depends(get_current_user)
+):
+    """Completion ratio of the tasks of all users below the current user, per direct child"""
+    data = get_subtree_progress(user, db)
+
+    return {
+        "success": True,
+        "messages": {
+            "data": data
+        }
+    }
+
+
 @router.post("/user/childs/authorize/time", tags=["User"])
 def authorize_child_user_declare_time(
     user: UserInAuthorize,
     db: MongoClient = Depends(get_database),
-    auth: AuthToken = Depends(validate_token)
+    current_user: User = Depends(get_current_user)
 ):
     """Set the start and end time of the right of declaration"""
-    if(validate_user_authorization_on_crud_others(auth.username, user.username, db)):
+    if(validate_user_authorization_on_crud_others(current_user, user.username, db)):
         is_success = update_valid_declare_time(user, db)
         if(is_success):
             return {
@@ -202,13 +297,13 @@ def authorize_child_user_declare_time(
 def set_child_user_state(
     user: UserState,
     db: MongoClient = Depends(get_database),
-    auth: AuthToken = Depends(validate_token)
+    current_user: User = Depends(get_current_user)
 ):
     """
     Activate/deactivate the authorization of child user to create, update, delete survey data.
     If a child user is active/inactive, all their children will be active/inactive too.
     """
-    if(validate_user_authorization_on_crud_others(auth.username, user.username, db)):
+    if(validate_user_authorization_on_crud_others(current_user, user.username, db)):
         is_success = update_user_state(user, db)
         if(is_success):
             return {
@@ -1,22 +1,16 @@
 from pymongo import MongoClient
 
-from ..crud.user import get_child_role, get_user_by_username, get_user_id_by_username
+from ..crud.role import get_role_hierarchy
 from ..crud.location import get_collection_name_from_location_code
 from ..core.config import (database_name,
-                           user_collection_name,
-                           role_collection_name,
-                           country_collection_name,
-                           city_collection_name,
-                           district_collection_name,
-                           ward_collection_name)
+                           user_collection_name)
 from ..models.location import LocationInUpdateCode
 from ..models.user import User
 
 
 def validate_role_authorization_on_create(user_role: str, created_role: str,  db: MongoClient):
     """Check if current user is authorized to create new user with specified role"""
-    valid_roles = get_child_role(user_role, db)
-    return (created_role in valid_roles)
+    return get_role_hierarchy(db).is_child(user_role, created_role)
 
 def validate_user_authorization_on_update_location(user: User, location: LocationInUpdateCode, db: MongoClient):
     query_collection = get_collection_name_from_location_code(location.code)
@@ -28,11 +22,22 @@ def validate_user_authorization_on_update_location(user: User, location: Locatio
             return True
     return False
 
-def validate_user_authorization_on_crud_others(username: str, child_username: str, db: MongoClient):
-    """Check user have CRUD authorization on other users"""
-    child_user = get_user_by_username(child_username, db)
-    if not child_user:
-        return False
-    user_id = get_user_id_by_username(username, db)
+def validate_user_authorization_on_location_code(user: User, code: str):
+    """Check the location is below the location managed by the user"""
+    if(len(user.manage_location) == 1):
+        # country codes are not a prefix of the city codes
+        return len(code) > 1
+    return len(code) > len(user.manage_location) and code.startswith(user.manage_location)
 
-    return (child_user.manager_id == user_id)
+def validate_user_authorization_on_crud_others(user: User, child_username: str, db: MongoClient):
+    """
+    Check user have CRUD authorization on other users, i.e. the other user is in the subtree
+    of `user` and has a role below the role of `user`
+    """
+    # manager_id also matches direct children created before the ancestors were backfilled
+    child_user = db[database_name][user_collection_name].find_one(
+        {"username": child_username, "$or": [{"ancestors": user.id}, {"manager_id": user.id}]},
+        {"role": 1})
+    if(child_user is None):
+        return False
+    return get_role_hierarchy(db).is_descendant(user.role, child_user.get("role"))
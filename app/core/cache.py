@@ -0,0 +1,160 @@
+import asyncio
+import functools
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+_missing = object()
+
+
+class TTLCache:
+    """
+    Thread safe LRU cache whose entries expire after `ttl` seconds
+    (or at their own `expires_at`), entries can be tagged and invalidated by tag.
+    Every invalidation of a tag bumps its generation, a value computed before the
+    invalidation is not stored when set() is given the generation read before computing it.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # key -> (expires_at, tags, value), oldest first
+        self.entries: "OrderedDict[Hashable, Tuple[float, Tuple[str, ...], Any]]" = OrderedDict()
+        self.tags: Dict[str, Set[Hashable]] = {}
+        self.generations: Dict[str, int] = {}
+        # bumped by clear(), which invalidates every tag
+        self.clears = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, default=None):
+        with self.lock:
+            entry = self.entries.get(key, _missing)
+            if(entry is _missing or entry[0] <= time.monotonic()):
+                if(entry is not _missing):
+                    self._remove(key)
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def get_generation(self, tags: Iterable[str]) -> tuple:
+        """Read before computing a value to set with these tags"""
+        with self.lock:
+            return self._generation(tuple(tags))
+
+    def set(self, key: Hashable, value, tags: Iterable[str] = (), expires_at: Optional[float] = None,
+            generation: Optional[tuple] = None):
+        """
+        `expires_at` is a time.monotonic() value, it defaults to now + ttl.
+        The value is dropped when one of the tags was invalidated since `generation` was read.
+        """
+        if(expires_at is None):
+            expires_at = time.monotonic() + self.ttl
+        tags = tuple(tags)
+        with self.lock:
+            if(generation is not None and generation != self._generation(tags)):
+                return
+            if(key in self.entries):
+                self._remove(key)
+            self.entries[key] = (expires_at, tags, value)
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+            while(len(self.entries) > self.max_size):
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        with self.lock:
+            if(key in self.entries):
+                self._remove(key)
+                self.invalidations += 1
+
+    def invalidate_tags(self, tags: Iterable[str]):
+        """Drop every entry tagged with one of `tags`"""
+        with self.lock:
+            for tag in tags:
+                self.generations[tag] = self.generations.get(tag, 0) + 1
+                for key in list(self.tags.get(tag, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+            self.tags.clear()
+            self.clears += 1
+
+    def _generation(self, tags: Tuple[str, ...]) -> tuple:
+        return (self.clears, tuple(self.generations.get(tag, 0) for tag in tags))
+
+    def _remove(self, key: Hashable):
+        _, tags, _ = self.entries.pop(key)
+        for tag in tags:
+            keys = self.tags.get(tag)
+            if(keys is not None):
+                keys.discard(key)
+                if(not keys):
+                    del self.tags[tag]
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
+
+
+def make_location_key(fn_name: str, location, params: tuple) -> tuple:
+    """Cache key of a query on a list of location codes: function, sorted codes and params"""
+    fields = tuple(
+        (name, tuple(value) if isinstance(value, list) else value)
+        for name, value in sorted(location.dict(exclude={"codes"}).items())
+    )
+    return (fn_name, tuple(sorted(location.codes)), fields, params)
+
+
+def cached_by_location(cache: TTLCache) -> Callable:
+    """
+    Cache a `fn(location, *params, db)` query (sync or async) in `cache`,
+    entries are tagged with the location codes so writes can invalidate them
+    """
+    def decorator(fn: Callable) -> Callable:
+        name = fn.__name__
+
+        if(asyncio.iscoroutinefunction(fn)):
+            @functools.wraps(fn)
+            async def async_wrapper(location, *args):
+                key = make_location_key(name, location, args[:-1])
+                value = cache.get(key, _missing)
+                if(value is _missing):
+                    generation = cache.get_generation(location.codes)
+                    value = await fn(location, *args)
+                    cache.set(key, value, tags=location.codes, generation=generation)
+                return value
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(location, *args):
+            key = make_location_key(name, location, args[:-1])
+            value = cache.get(key, _missing)
+            if(value is _missing):
+                generation = cache.get_generation(location.codes)
+                value = fn(location, *args)
+                cache.set(key, value, tags=location.codes, generation=generation)
+            return value
+        return wrapper
+
+    return decorator
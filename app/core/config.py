@@ -1,3 +1,5 @@
+import os
+import tempfile
 from decouple import config
 
 API_V1_STR = "/api/v1"
@@ -7,9 +9,94 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # one week
 
 PROJECT_NAME = config("PROJECT_NAME")
 MONGODB_URI = config("MONGODB_URI")
+# connection pool, applied to both the sync and async clients
+MONGODB_MAX_POOL_SIZE = config("MONGODB_MAX_POOL_SIZE", default=100, cast=int)
+MONGODB_MIN_POOL_SIZE = config("MONGODB_MIN_POOL_SIZE", default=0, cast=int)
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = config("MONGODB_WAIT_QUEUE_TIMEOUT_MS", default=10000, cast=int)
+MONGODB_SOCKET_TIMEOUT_MS = config("MONGODB_SOCKET_TIMEOUT_MS", default=30000, cast=int)
+# server side time limit of the analytics queries and of the subtree writes
+MONGODB_MAX_TIME_MS = config("MONGODB_MAX_TIME_MS", default=20000, cast=int)
+# serve the read endpoints with the async (motor) driver instead of the threadpool
+MONGODB_ASYNC = config("MONGODB_ASYNC", default=False, cast=bool)
+MONGODB_CHECK_QUERY_PLANS = config("MONGODB_CHECK_QUERY_PLANS", default=True, cast=bool)
 SECRET_KEY = config("SECRET_KEY")
 ALGORITHM = config("ALGORITHM")
 
+SURVEY_UPLOAD_DIR = config("SURVEY_UPLOAD_DIR", default="survey_upload")
+SURVEY_IMPORT_CHUNK_SIZE = config("SURVEY_IMPORT_CHUNK_SIZE", default=1000, cast=int)
+SURVEY_IMPORT_MAX_ERRORS = config("SURVEY_IMPORT_MAX_ERRORS", default=1000, cast=int)
+
+# survey analytics results, invalidated by writes of the same worker
+ANALYTICS_CACHE_SIZE = config("ANALYTICS_CACHE_SIZE", default=1024, cast=int)
+ANALYTICS_CACHE_TTL = config("ANALYTICS_CACHE_TTL", default=60, cast=int)
+
+# users resolved by get_current_user, invalidated by writes of the same worker
+USER_CACHE_SIZE = config("USER_CACHE_SIZE", default=1024, cast=int)
+USER_CACHE_TTL = config("USER_CACHE_TTL", default=5, cast=int)
+# managed location of the users, it never changes, the entry only outlives a deleted user
+MANAGE_LOCATION_CACHE_TTL = config("MANAGE_LOCATION_CACHE_TTL", default=3600, cast=int)
+
+# verified tokens of validate_token, an entry expires with its token
+TOKEN_CACHE_SIZE = config("TOKEN_CACHE_SIZE", default=4096, cast=int)
+
+# how the subtree of a user is resolved by update_user_state:
+# "ancestors" one update on the indexed ancestors (run app.scripts.backfill_user_ancestors first),
+# "graph_lookup" $graphLookup over manager_id written back with $merge
+USER_SUBTREE_MODE = config("USER_SUBTREE_MODE", default="ancestors")
+USER_SUBTREE_MAX_DEPTH = config("USER_SUBTREE_MAX_DEPTH", default=8, cast=int)
+
+# memory mapped location/role snapshot shared by the workers of a host
+REFERENCE_SNAPSHOT_PATH = config(
+    "REFERENCE_SNAPSHOT_PATH",
+    default=os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+                         f"{PROJECT_NAME}-reference.snapshot"))
+# an older snapshot is rebuilt when a worker starts, and in the background while it runs
+REFERENCE_SNAPSHOT_MAX_AGE = config("REFERENCE_SNAPSHOT_MAX_AGE", default=600, cast=int)
+# how often a worker looks for a snapshot swapped by another worker
+REFERENCE_SNAPSHOT_CHECK_INTERVAL = config("REFERENCE_SNAPSHOT_CHECK_INTERVAL", default=1.0, cast=float)
+# location/role writes rebuild the snapshot in the background after this delay,
+# the writes made in the meantime share the rebuild
+REFERENCE_SNAPSHOT_REBUILD_DELAY = config("REFERENCE_SNAPSHOT_REBUILD_DELAY", default=1.0, cast=float)
+
+# how child locations are listed:
+# "parents_code" one indexed find on the parents_code of the children,
+# "array" the legacy ObjectId arrays of the parent joined with $lookup, new locations are appended to them.
+# "array" is the default since locations seeded without parents_code are only reachable through
+# the arrays, run `python -m app.scripts.migrate_location_parents_code` before switching to "parents_code"
+LOCATION_CHILD_QUERY_MODE = config("LOCATION_CHILD_QUERY_MODE", default="array")
+# codes accepted by one POST /location/resolve
+LOCATION_RESOLVE_MAX_CODES = config("LOCATION_RESOLVE_MAX_CODES", default=1000, cast=int)
+
+# units accepted by one POST /location/bulk
+LOCATION_BULK_MAX_UNITS = config("LOCATION_BULK_MAX_UNITS", default=20000, cast=int)
+
+# GET /location/within: below this zoom, or above LOCATION_WITHIN_MAX_POINTS locations,
+# the viewport is answered with grid clusters of LOCATION_CLUSTER_GRID cells per map tile side
+LOCATION_CLUSTER_MAX_ZOOM = config("LOCATION_CLUSTER_MAX_ZOOM", default=12, cast=int)
+LOCATION_CLUSTER_GRID = config("LOCATION_CLUSTER_GRID", default=8, cast=int)
+LOCATION_WITHIN_MAX_POINTS = config("LOCATION_WITHIN_MAX_POINTS", default=2000, cast=int)
+
+# Cache-Control of the reference data routes answering If-None-Match with 304,
+# "no-cache" lets clients keep a copy but revalidate it on every use
+CACHE_CONTROL_LOCATION_CHILDS = config("CACHE_CONTROL_LOCATION_CHILDS", default="private, no-cache")
+CACHE_CONTROL_LOCATION_COORDINATES = config("CACHE_CONTROL_LOCATION_COORDINATES", default="private, no-cache")
+CACHE_CONTROL_CHILD_ROLES = config("CACHE_CONTROL_CHILD_ROLES", default="private, no-cache")
+
+# bcrypt process pool of every gunicorn worker, calls above workers + queue size get a 503
+PASSWORD_HASH_WORKERS = config("PASSWORD_HASH_WORKERS", default=2, cast=int)
+PASSWORD_HASH_QUEUE_SIZE = config("PASSWORD_HASH_QUEUE_SIZE", default=32, cast=int)
+PASSWORD_HASH_RETRY_AFTER = config("PASSWORD_HASH_RETRY_AFTER", default=2, cast=int)
+
+# users accepted by one POST /user/create/batch, every password is hashed in the request
+# (about 0.25s per password over PASSWORD_HASH_WORKERS processes)
+USER_BATCH_MAX_USERS = config("USER_BATCH_MAX_USERS", default=50, cast=int)
+
+# background jobs, every gunicorn worker runs its own pool
+JOB_WORKERS = config("JOB_WORKERS", default=2, cast=int)
+JOB_QUEUE_SIZE = config("JOB_QUEUE_SIZE", default=8, cast=int)
+# seconds between two recounts of the children counters of the users by one worker of the host, 0 disables
+CHILDREN_COUNTERS_BACKFILL_INTERVAL = config("CHILDREN_COUNTERS_BACKFILL_INTERVAL", default=3600, cast=float)
+
 database_name = PROJECT_NAME
 user_collection_name = "user"
 role_collection_name = "role"
@@ -19,3 +106,5 @@ district_collection_name = "district"
 ward_collection_name = "ward"
 civil_group_collection_name = 'civil_group'
 survey_collection_name = 'survey'
+job_collection_name = 'job'
+survey_count_collection_name = 'survey_count'
@@ -0,0 +1,44 @@
+"""
+Conditional GET: ETag / If-None-Match validators and a Cache-Control policy per route
+"""
+import hashlib
+from typing import Optional
+
+from fastapi import Request, Response
+
+NOT_MODIFIED = 304
+
+
+def make_etag(*parts) -> str:
+    """Strong ETag of the parts the representation depends on (route, params, data version)"""
+    digest = hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=12)
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses the weak comparison, the header may list several tags or *"""
+    if(not if_none_match):
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if(tag == "*" or tag.replace("W/", "", 1) == etag):
+            return True
+    return False
+
+
+def conditional_response(
+        request: Request,
+        response: Response,
+        etag: Optional[str],
+        cache_control: str) -> Optional[Response]:
+    """
+    Set the validators of a GET response, return the 304 response to send
+    when the copy of the client is still current. Without etag only Cache-Control is set.
+    """
+    headers = {"Cache-Control": cache_control}
+    if(etag is not None):
+        headers["ETag"] = etag
+        if(etag_matches(request.headers.get("if-none-match"), etag)):
+            return Response(status_code=NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return None
@@ -0,0 +1,178 @@
+import fcntl
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from pymongo import MongoClient
+
+from .config import PROJECT_NAME, JOB_WORKERS, JOB_QUEUE_SIZE, CHILDREN_COUNTERS_BACKFILL_INTERVAL
+from ..crud.job import (create_job,
+                        update_job_status,
+                        update_job_progress,
+                        fail_jobs_of_dead_processes,
+                        get_pids_of_unfinished_jobs,
+                        JOB_RUNNING,
+                        JOB_DONE,
+                        JOB_FAILED)
+from ..crud.user import backfill_children_counters
+from ..db.mongodb import db as database
+
+
+class JobQueueFullError(Exception):
+    """Raised when the job pool of this worker can not accept more jobs"""
+
+
+class JobRunner:
+    """
+    Bounded in-process pool for long running work.
+    Job state lives in mongo so any gunicorn worker can answer the status of a job.
+    """
+
+    def __init__(self, max_workers: int, queue_size: int):
+        self.max_workers = max_workers
+        self.hostname = socket.gethostname()
+        self.executor: Optional[ThreadPoolExecutor] = None
+        # running + queued jobs
+        self.slots = threading.BoundedSemaphore(max_workers + queue_size)
+
+    def start(self):
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="job")
+
+    def stop(self):
+        if(self.executor):
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def submit(self, job_type: str, owner: str, fn: Callable, *args, db: MongoClient) -> str:
+        """
+        Run `fn(*args, progress=callback)` in the background and return the job id right away.
+        The value returned by `fn` is stored as the job result.
+        """
+        if(not self.slots.acquire(blocking=False)):
+            raise JobQueueFullError()
+        try:
+            job_id = create_job(job_type, owner, self.hostname, os.getpid(), db)
+            self.executor.submit(self._run, job_id, fn, args, db)
+        except Exception:
+            self.slots.release()
+            raise
+        return job_id
+
+    def _run(self, job_id: str, fn: Callable, args: tuple, db: MongoClient):
+        def progress(done: int, total: Optional[int] = None):
+            update_job_progress(job_id, done, total, db)
+
+        try:
+            update_job_status(job_id, JOB_RUNNING, db)
+            result = fn(*args, progress=progress)
+            update_job_status(job_id, JOB_DONE, db, result=result)
+        except Exception as e:
+            logging.exception(f"Job {job_id} failed")
+            update_job_status(job_id, JOB_FAILED, db, error=str(e))
+        finally:
+            self.slots.release()
+
+
+class PeriodicTask:
+    """
+    Run `fn(db)` every `interval` seconds on a daemon thread of every worker. The workers of
+    a host share a stamp file holding the time of the last run, the first one due runs it
+    under a file lock and the others skip their round.
+    """
+
+    def __init__(self, name: str, fn: Callable, interval: float, stamp_path: str):
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.stamp_path = stamp_path
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self, db: MongoClient):
+        if(self.interval <= 0 or self.thread is not None):
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._loop, args=(db,), name=self.name, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread = None
+
+    def _loop(self, db: MongoClient):
+        while(not self.stopped.wait(self.interval)):
+            try:
+                self.run_if_due(db)
+            except Exception:
+                logging.exception(f"Periodic task {self.name} failed")
+
+    def run_if_due(self, db: MongoClient) -> bool:
+        with open(self.stamp_path, "a+") as stamp_file:
+            try:
+                fcntl.flock(stamp_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # another worker is running it
+                return False
+            try:
+                stamp_file.seek(0)
+                last_run = float(stamp_file.read() or 0)
+                if(time.time() - last_run < self.interval):
+                    return False
+                start = time.perf_counter()
+                result = self.fn(db)
+                stamp_file.truncate(0)
+                stamp_file.write(str(time.time()))
+                stamp_file.flush()
+                logging.info(f"Periodic task {self.name}: {result} in {time.perf_counter() - start:.2f}s")
+                return True
+            finally:
+                fcntl.flock(stamp_file, fcntl.LOCK_UN)
+
+
+def is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+job_runner = JobRunner(JOB_WORKERS, JOB_QUEUE_SIZE)
+
+periodic_tasks = [
+    # the child write and the $inc of its manager are not atomic, fixes the drift
+    PeriodicTask("backfill_children_counters", backfill_children_counters, CHILDREN_COUNTERS_BACKFILL_INTERVAL,
+                 os.path.join(tempfile.gettempdir(), f"{PROJECT_NAME}.backfill_children_counters.stamp")),
+]
+
+
+def start_job_runner():
+    job_runner.start()
+    # jobs left unfinished by a killed worker of this host will never complete
+    pids = get_pids_of_unfinished_jobs(job_runner.hostname, database.client)
+    alive_pids = [pid for pid in pids if is_process_alive(pid)]
+    failed = fail_jobs_of_dead_processes(job_runner.hostname, alive_pids, database.client)
+    if(failed > 0):
+        logging.warning(f"Marked {failed} jobs of exited workers as failed")
+
+
+def stop_job_runner():
+    job_runner.stop()
+
+
+def start_periodic_tasks():
+    for task in periodic_tasks:
+        task.start(database.client)
+
+
+def stop_periodic_tasks():
+    for task in periodic_tasks:
+        task.stop()
@@ -4,12 +4,24 @@ from datetime import datetime, timedelta
 from pydantic import ValidationError
 from typing import Optional
 import jwt
+import time
 
-from .config import SECRET_KEY, ALGORITHM
+from .cache import TTLCache
+from .config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, TOKEN_CACHE_SIZE
+from .metrics import LatencyStats, register_metrics
+from ..crud import user_async
+from ..crud.user import get_user_by_username, manage_location_cache, user_cache
+from ..db.mongodb import run_query
 from ..models.auth import AuthToken
+from ..models.user import User
 
 access_token_jwt_subject = "access"
 
+# verified tokens, a hit skips the signature check and the payload validation
+token_cache = TTLCache(TOKEN_CACHE_SIZE, ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+decode_stats = LatencyStats()
+register_metrics("token_cache", lambda: dict(token_cache.stats(), decode=decode_stats.to_dict()))
+
 auth_method = HTTPBearer(scheme_name="Authentication")
 
 def generate_token(username: str, role: str, expires_delta: Optional[timedelta] = None) -> str:
@@ -25,15 +37,46 @@ def generate_token(username: str, role: str, expires_delta: Optional[timedelta]
     return encoded_jwt
 
 
-def validate_token(http_authorization_credentials=Depends(auth_method)) -> AuthToken:
+async def validate_token(http_authorization_credentials=Depends(auth_method)) -> AuthToken:
+    token = http_authorization_credentials.credentials
+    auth = token_cache.get(token)
+    if(auth is not None):
+        return auth
     try:
-        payload = jwt.decode(http_authorization_credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        start = time.perf_counter()
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         exp = payload.get('token_expire') 
         if datetime.fromtimestamp(exp) < datetime.now():
             raise HTTPException(status_code=403, detail="Token expired")
-        return AuthToken(**payload) 
+        auth = AuthToken(**payload)
+        decode_stats.add((time.perf_counter() - start) * 1000)
+        # the entry expires with the token
+        token_cache.set(token, auth, expires_at=time.monotonic() + exp - time.time())
+        return auth
     except(jwt.PyJWTError, ValidationError):
         raise HTTPException(
             status_code=403,
             detail=f"Could not validate credentials",
         )
+
+
+async def get_current_user(auth: AuthToken = Depends(validate_token)) -> User:
+    """
+    User of the token, resolved once per request (dependencies are cached per request)
+    and kept in user_cache across requests, the returned user is shared: do not modify it
+    """
+    user = user_cache.get(auth.username)
+    if(user is None):
+        user = await run_query(get_user_by_username,
+                               user_async.get_user_by_username,
+                               auth.username)
+        if(user is None):
+            raise HTTPException(
+                status_code=401,
+                detail="User not found",
+            )
+        # tagged with the user and its managers, a subtree write invalidates it
+        tags = {str(user.id), str(user.manager_id)} | {str(ancestor_id) for ancestor_id in user.ancestors}
+        user_cache.set(auth.username, user, tags=tags)
+        manage_location_cache.set(auth.username, user.manage_location)
+    return user
@@ -0,0 +1,54 @@
+import threading
+from typing import Callable, Dict
+
+
+class LatencyStats:
+    """Count, total and max of a latency in milliseconds"""
+
+    __slots__ = ("count", "total_ms", "max_ms")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, duration_ms: float):
+        self.count += 1
+        self.total_ms += duration_ms
+        if(duration_ms > self.max_ms):
+            self.max_ms = duration_ms
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3)
+        }
+
+
+class Counters:
+    """Thread safe named counters"""
+
+    def __init__(self, *names: str):
+        self.lock = threading.Lock()
+        self.values = {name: 0 for name in names}
+
+    def incr(self, name: str, value: int = 1):
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + value
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return dict(self.values)
+
+
+metrics_sources: Dict[str, Callable[[], dict]] = {}
+
+
+def register_metrics(name: str, source: Callable[[], dict]):
+    """Expose the dict returned by `source` under `name` in GET /metrics"""
+    metrics_sources[name] = source
+
+
+def collect_metrics() -> dict:
+    return {name: source() for name, source in metrics_sources.items()}
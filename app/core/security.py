@@ -1,6 +1,17 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, List, Optional
+
 import bcrypt
 from passlib.context import CryptContext
 
+from .config import PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_SIZE
+from .metrics import Counters, LatencyStats, register_metrics
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def generate_salt():
@@ -13,3 +24,132 @@ def verify_password(plain_password, hashed_password):
 
 def get_password_hash(password):
     return pwd_context.hash(password)
+
+
+class PasswordPoolFullError(Exception):
+    """Raised when the password pool of this worker can not accept more work"""
+
+
+class PasswordPoolBrokenError(PasswordPoolFullError):
+    """Raised when a pool process died during the call, the next calls get a new pool"""
+
+
+class PasswordHasher:
+    """
+    Bounded process pool running bcrypt out of the event loop and the request threadpool,
+    at most `max_workers + queue_size` calls are admitted at a time.
+    """
+
+    def __init__(self, max_workers: int, queue_size: int):
+        self.max_workers = max_workers
+        self.max_in_flight = max_workers + queue_size
+        self.executor: Optional[ProcessPoolExecutor] = None
+        # only touched from the event loop
+        self.in_flight = 0
+        self.latency = {"hash": LatencyStats(), "verify": LatencyStats()}
+        self.counters = Counters("rejected", "restarts")
+
+    def start(self):
+        if(self.executor is None):
+            # forking a worker that already runs threads (mongo monitors, jobs, threadpool)
+            # can leave the children deadlocked on inherited locks, the fork server is single threaded
+            context = multiprocessing.get_context("forkserver")
+            # instead of __main__, which is not ours to import again
+            context.set_forkserver_preload([__name__])
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+
+    def warm_up(self):
+        """Start the pool processes now instead of at the first login"""
+        self.start()
+        self.executor.submit(os.getpid).result()
+
+    def stop(self):
+        if(self.executor):
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def restart(self, executor: ProcessPoolExecutor):
+        """Replace a broken pool, once for all the calls that failed with it"""
+        if(self.executor is not executor):
+            return
+        self.counters.incr("restarts")
+        executor.shutdown(wait=False)
+        self.executor = None
+        self.start()
+
+    def admit(self, slots: int):
+        if(self.in_flight + slots > self.max_in_flight):
+            self.counters.incr("rejected")
+            raise PasswordPoolFullError()
+        self.start()
+        self.in_flight += slots
+
+    async def execute(self, name: str, fn: Callable, *args):
+        start = time.perf_counter()
+        executor = self.executor
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+        except BrokenProcessPool:
+            # a pool process was killed (OOM killer, segfault), every pending call fails with it
+            self.restart(executor)
+            raise PasswordPoolBrokenError()
+        finally:
+            self.latency[name].add((time.perf_counter() - start) * 1000)
+
+    async def run(self, name: str, fn: Callable, *args):
+        self.admit(1)
+        try:
+            return await self.execute(name, fn, *args)
+        finally:
+            self.in_flight -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self.run("hash", get_password_hash, password)
+
+    async def hash_many(self, passwords: List[str]) -> List[str]:
+        """
+        Hash a batch max_workers passwords at a time. Its slots are reserved up front,
+        a full pool rejects the batch before anything is hashed, never half way.
+        """
+        if(len(passwords) == 0):
+            return []
+        slots = min(len(passwords), self.max_workers)
+        self.admit(slots)
+        try:
+            hashed = []
+            for idx in range(0, len(passwords), slots):
+                chunk = passwords[idx:idx + slots]
+                results = await asyncio.gather(
+                    *(self.execute("hash", get_password_hash, password) for password in chunk),
+                    return_exceptions=True)
+                for result in results:
+                    if(isinstance(result, BaseException)):
+                        raise result
+                hashed.extend(results)
+            return hashed
+        finally:
+            self.in_flight -= slots
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self.run("verify", verify_password, plain_password, hashed_password)
+
+    def stats(self) -> dict:
+        return dict(
+            self.counters.to_dict(),
+            in_flight=self.in_flight,
+            queue_depth=max(self.in_flight - self.max_workers, 0),
+            # includes the wait in the queue
+            hash=self.latency["hash"].to_dict(),
+            verify=self.latency["verify"].to_dict())
+
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_SIZE)
+register_metrics("password_hash", password_hasher.stats)
+
+
+def start_password_hasher():
+    password_hasher.warm_up()
+
+
+def stop_password_hasher():
+    password_hasher.stop()
@@ -0,0 +1,78 @@
+from datetime import datetime
+from pymongo import MongoClient
+from typing import List, Optional
+from uuid import uuid4
+
+from ..core.config import database_name, job_collection_name
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+UNFINISHED_JOB_STATUS = [JOB_PENDING, JOB_RUNNING]
+
+
+def create_job(job_type: str, owner: str, hostname: str, pid: int, db: MongoClient) -> str:
+    """Insert a pending job and return its id"""
+    job_id = uuid4().hex
+    now = datetime.utcnow()
+    db[database_name][job_collection_name].insert_one({
+        "_id": job_id,
+        "type": job_type,
+        "owner": owner,
+        "status": JOB_PENDING,
+        "progress": {},
+        "result": None,
+        "error": None,
+        "hostname": hostname,
+        "pid": pid,
+        "createAt": now,
+        "updateAt": now
+    })
+    return job_id
+
+
+def get_job_by_id(job_id: str, db: MongoClient) -> Optional[dict]:
+    data = db[database_name][job_collection_name].find_one(
+        {"_id": job_id}, {"hostname": 0, "pid": 0})
+    if(data):
+        data["id"] = data.pop("_id")
+    return data
+
+
+def update_job(job_id: str, fields: dict, db: MongoClient):
+    fields["updateAt"] = datetime.utcnow()
+    db[database_name][job_collection_name].update_one(
+        {"_id": job_id}, {"$set": fields})
+
+
+def update_job_status(job_id: str, status: str, db: MongoClient, result=None, error: str = None):
+    update_job(job_id, {"status": status, "result": result, "error": error}, db)
+
+
+def update_job_progress(job_id: str, done: int, total: Optional[int], db: MongoClient):
+    update_job(job_id, {"progress": {"done": done, "total": total}}, db)
+
+
+def fail_jobs_of_dead_processes(hostname: str, alive_pids: List[int], db: MongoClient) -> int:
+    """Mark unfinished jobs of this host whose worker process is gone as failed"""
+    update_results = db[database_name][job_collection_name].update_many(
+        {
+            "hostname": hostname,
+            "pid": {"$nin": alive_pids},
+            "status": {"$in": UNFINISHED_JOB_STATUS}
+        },
+        {
+            "$set": {
+                "status": JOB_FAILED,
+                "error": "worker process exited before the job finished",
+                "updateAt": datetime.utcnow()
+            }
+        })
+    return update_results.modified_count
+
+
+def get_pids_of_unfinished_jobs(hostname: str, db: MongoClient) -> List[int]:
+    return db[database_name][job_collection_name].distinct(
+        "pid", {"hostname": hostname, "status": {"$in": UNFINISHED_JOB_STATUS}})
@@ -1,6 +1,7 @@
 from fastapi.exceptions import HTTPException
 from pymongo import MongoClient
-from typing import List
+from pymongo.database import Database
+from typing import Dict, List, Tuple
 from odmantic import ObjectId
 
 from ..core.config import (database_name,
@@ -8,14 +9,20 @@ from ..core.config import (database_name,
                            city_collection_name,
                            district_collection_name,
                            ward_collection_name,
-                           civil_group_collection_name)
+                           civil_group_collection_name,
+                           LOCATION_CHILD_QUERY_MODE)
 
 from ..models.location import LocationInUpdateCode, LocationInCreate
 from ..models.user import User
+from .location_tree import CHILD_QUERY_ARRAY, CHILD_QUERY_PARENTS_CODE, location_levels
+from .reference_snapshot import reference_snapshot, refresh_reference_snapshot
 
 
 def get_all_city(db: MongoClient) -> List[dict]:
     """Get all cities name and code from city collection"""
+    if(reference_snapshot.loaded):
+        return [{"name": node.name, "code": node.code}
+                for node in reference_snapshot.get_level(city_collection_name)]
     data = db[database_name][city_collection_name].find(
         {}, {"name": 1, "code": 1, "_id": 0})
     return list(data)
@@ -23,6 +30,15 @@ def get_all_city(db: MongoClient) -> List[dict]:
 
 def retrieve_location_info_by_code(code: str, collection_name: str, db: MongoClient) -> dict:
     """Get location info by CODE from collection name"""
+    node = reference_snapshot.get(code)
+    if(node is not None and node.level == collection_name):
+        return {
+            "name": node.name,
+            "code": node.code,
+            "parents_code": node.parents_code,
+            "lat": node.lat,
+            "lng": node.lng
+        }
     data = db[database_name][collection_name].find({"code": code})
     data = list(data)
     if(len(data) > 0):
@@ -35,43 +51,9 @@ def get_all_childs_of_location(
         sub_collection: str,
         db: MongoClient):
     """Get all locations which is a child of the given location code"""
-    pipeline = [
-        {
-            '$match': {
-                'code': location_code
-            }
-        }, {
-            '$unwind': {
-                'path': f'${sub_collection}'
-            }
-        }, {
-            '$lookup': {
-                'from': sub_collection,
-                'localField': sub_collection,
-                'foreignField': '_id',
-                'as': 'info'
-            }
-        }, {
-            '$project': {
-                'info': {
-                    '$first': '$info'
-                },
-                '_id': 0
-            }
-        }, {
-            '$project': {
-                'code': '$info.code',
-                'name': '$info.name'
-            }
-        }
-    ]
+    return query_childs_of_location(
+        db[database_name], location_code, query_collection, sub_collection, LOCATION_CHILD_QUERY_MODE)
 
-    data = db[database_name][query_collection].aggregate(pipeline)
-    data = list(data)
-    print(len(data))
-    if(len(data[0].keys()) > 0):
-        return data
-    return []
 
 def get_all_childs_from_code(
         loc_code: str,
@@ -84,8 +66,37 @@ def get_all_childs_from_code(
             status_code=400,
             detail="Invalid code",
         )
-    
-    pipeline = [
+
+    children = reference_snapshot.get_children(loc_code)
+    if(children is not None):
+        return [{"code": node.code, "name": node.name} for node in children]
+    return get_all_childs_of_location(loc_code, query_collection, sub_collection, db)
+
+
+def query_childs_of_location(
+        database: Database,
+        loc_code: str,
+        query_collection: str,
+        sub_collection: str,
+        mode: str) -> List[dict]:
+    """Code and name of the children of a location, with the given LOCATION_CHILD_QUERY_MODE"""
+    if(mode == CHILD_QUERY_PARENTS_CODE):
+        data = database[sub_collection].find(
+            {"parents_code": loc_code}, {"code": 1, "name": 1, "_id": 0})
+        return list(data)
+
+    data = database[query_collection].aggregate(
+        build_childs_lookup_pipeline(loc_code, sub_collection))
+    data = list(data)
+    if(len(data) > 0):
+        if(len(data[0].keys()) > 0):
+            return data
+    return []
+
+
+def build_childs_lookup_pipeline(loc_code: str, sub_collection: str) -> List[dict]:
+    """Join the ObjectId array of the children stored in the parent location"""
+    return [
         {
             '$match': {
                 'code': loc_code
@@ -116,12 +127,6 @@ def get_all_childs_from_code(
         }
     ]
 
-    data = db[database_name][query_collection].aggregate(pipeline)
-    data = list(data)
-    if(len(data) > 0):
-        if(len(data[0].keys()) > 0):
-            return data
-    return []
 
 def is_location_exists(parents_code: str, location: LocationInCreate, db: MongoClient):
     """True if exists else False"""
@@ -148,8 +153,10 @@ def create_new_location(user: User, location: LocationInCreate, db: MongoClient)
     }
 
     results = db[database_name][query_collection].insert_one(insert_dict)
-    # append new location to parent location list childs
-    append_child_location(user.manage_location, results.inserted_id, db)
+    if(LOCATION_CHILD_QUERY_MODE == CHILD_QUERY_ARRAY):
+        # append new location to parent location list childs
+        append_child_location(user.manage_location, results.inserted_id, db)
+    refresh_reference_snapshot(db)
 
 
 def update_code_of_location(user: User, location: LocationInUpdateCode, db: MongoClient):
@@ -163,6 +170,7 @@ def update_code_of_location(user: User, location: LocationInUpdateCode, db: Mong
             {
             "$set": {"code": location.code}
         })
+        refresh_reference_snapshot(db)
         return True
     return False
 
@@ -178,6 +186,12 @@ def append_child_location(loc_code: str, object_id: str, db: MongoClient):
 
 def retrieve_coordinates_of_childs_loc(loc_code: str, db: MongoClient):
     query_collection = get_loc_name_from_parent_code(loc_code, db)
+    children = reference_snapshot.get_children(loc_code)
+    if(query_collection != "" and children is not None):
+        return [
+            {"name": node.name, "lat": node.lat, "lng": node.lng, "code": node.code}
+            for node in children if node.lat is not None and node.lng is not None
+        ]
     pipeline = [
         {
             '$match': {
@@ -208,6 +222,65 @@ def retrieve_coordinates_of_childs_loc(loc_code: str, db: MongoClient):
     data = db[database_name][query_collection].aggregate(pipeline)
     return list(data)
 
+def resolve_location_codes(codes: List[str], db: MongoClient) -> Tuple[List[dict], List[str]]:
+    """
+    Name, level and ancestors (root first) of location codes of any level,
+    return the resolved locations in the order of `codes` and the unknown codes
+    """
+    codes = list(dict.fromkeys(codes))
+    lineages = {}
+    for code in codes:
+        lineage = reference_snapshot.get_lineage(code)
+        if(lineage is not None):
+            lineages[code] = [
+                {"code": node.code, "name": node.name, "level": node.level} for node in lineage
+            ]
+
+    unresolved = [code for code in codes if code not in lineages]
+    if(len(unresolved) > 0):
+        lineages.update(read_lineages_of_codes(unresolved, db))
+
+    resolved = []
+    for code in codes:
+        if(code in lineages):
+            *ancestors, location = lineages[code]
+            resolved.append(dict(location, ancestors=ancestors))
+    return resolved, [code for code in codes if code not in lineages]
+
+
+def read_lineages_of_codes(codes: List[str], db: MongoClient) -> Dict[str, List[dict]]:
+    """Mongo fallback of resolve_location_codes, one find per level and round of parents"""
+    locations = {}
+    pending = set(codes)
+    while(len(pending) > 0):
+        by_collection: Dict[str, List[str]] = {}
+        for code in pending:
+            collection_name = get_collection_name_from_location_code(code)
+            if(collection_name != ""):
+                by_collection.setdefault(collection_name, []).append(code)
+        for collection_name, level_codes in by_collection.items():
+            data = db[database_name][collection_name].find(
+                {"code": {"$in": level_codes}}, {"code": 1, "name": 1, "parents_code": 1, "_id": 0})
+            for doc in data:
+                doc["level"] = collection_name
+                locations[doc["code"]] = doc
+        pending = {
+            locations[code].get("parents_code") for code in pending if code in locations
+        } - set(locations) - {None}
+
+    lineages = {}
+    for code in codes:
+        lineage = []
+        location = locations.get(code)
+        while(location is not None and len(lineage) < len(location_levels)):
+            lineage.append({"code": location["code"], "name": location["name"], "level": location["level"]})
+            location = locations.get(location.get("parents_code"))
+        if(len(lineage) > 0):
+            lineage.reverse()
+            lineages[code] = lineage
+    return lineages
+
+
 """
 Utils for location
 """
@@ -0,0 +1,158 @@
+"""
+Map viewport queries on the GeoJSON `point` of the locations (2dsphere index),
+dense viewports are answered with grid clusters instead of every location.
+"""
+import math
+from typing import List, Optional, Tuple
+
+from fastapi.exceptions import HTTPException
+from pymongo import MongoClient
+
+from ..core.config import (database_name,
+                           LOCATION_CLUSTER_MAX_ZOOM,
+                           LOCATION_CLUSTER_GRID,
+                           LOCATION_WITHIN_MAX_POINTS)
+from .survey_count import get_survey_counts
+
+BBox = Tuple[float, float, float, float]
+
+# web mercator maps stop there, a polygon can not have a pole as corner
+MAX_LATITUDE = 85.05112878
+# mongo takes the smaller side of a polygon, a viewport is split in pieces far below a hemisphere
+VIEWPORT_PIECE_WIDTH = 90
+# polygon edges are great circles, the parallels of the viewport get a vertex every degree
+VIEWPORT_EDGE_STEP = 1
+
+
+def make_point(lat: Optional[float], lng: Optional[float]) -> Optional[dict]:
+    """GeoJSON point of a location, GeoJSON orders coordinates as [lng, lat]"""
+    if(lat is None or lng is None):
+        return None
+    return {"type": "Point", "coordinates": [float(lng), float(lat)]}
+
+
+def parse_bbox(bbox: str) -> BBox:
+    """`min_lng,min_lat,max_lng,max_lat` to floats"""
+    try:
+        min_lng, min_lat, max_lng, max_lat = (float(value) for value in bbox.split(","))
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail="bbox must be min_lng,min_lat,max_lng,max_lat"
+        )
+    if(not (-180 <= min_lng < max_lng <= 180 and -90 <= min_lat < max_lat <= 90)):
+        raise HTTPException(
+            status_code=400,
+            detail="bbox is out of range"
+        )
+    min_lat, max_lat = max(min_lat, -MAX_LATITUDE), min(max_lat, MAX_LATITUDE)
+    if(min_lat >= max_lat):
+        raise HTTPException(
+            status_code=400,
+            detail="bbox is outside of the map"
+        )
+    return min_lng, min_lat, max_lng, max_lat
+
+
+def build_viewport_polygons(bbox: BBox) -> List[list]:
+    """Counter clockwise rings of the pieces of the viewport, west to east"""
+    min_lng, min_lat, max_lng, max_lat = bbox
+    count = math.ceil((max_lng - min_lng) / VIEWPORT_PIECE_WIDTH)
+    width = (max_lng - min_lng) / count
+    rings = []
+    for piece in range(count):
+        west = min_lng + piece * width
+        east = max_lng if piece == count - 1 else west + width
+        steps = math.ceil((east - west) / VIEWPORT_EDGE_STEP)
+        south = [[west + (east - west) * step / steps, min_lat] for step in range(steps + 1)]
+        north = [[lng, max_lat] for lng, _ in reversed(south)]
+        rings.append(south + north + [south[0]])
+    return rings
+
+
+def build_viewport_match(bbox: BBox) -> dict:
+    matches = [
+        {
+            'point': {
+                '$geoWithin': {
+                    '$geometry': {
+                        'type': 'Polygon',
+                        'coordinates': [ring]
+                    }
+                }
+            }
+        }
+        for ring in build_viewport_polygons(bbox)
+    ]
+    if(len(matches) == 1):
+        return matches[0]
+    return {'$or': matches}
+
+
+def get_cluster_cell_size(zoom: int) -> float:
+    """Side of a grid cell in degrees, LOCATION_CLUSTER_GRID cells per map tile side"""
+    return 360 / (2 ** zoom) / LOCATION_CLUSTER_GRID
+
+
+def build_cluster_pipeline(bbox: BBox, cell_size: float) -> List[dict]:
+    min_lng, min_lat = bbox[0], bbox[1]
+    lng = {'$arrayElemAt': ['$point.coordinates', 0]}
+    lat = {'$arrayElemAt': ['$point.coordinates', 1]}
+    return [
+        {
+            '$match': build_viewport_match(bbox)
+        }, {
+            '$group': {
+                '_id': {
+                    'x': {'$floor': {'$divide': [{'$subtract': [lng, min_lng]}, cell_size]}},
+                    'y': {'$floor': {'$divide': [{'$subtract': [lat, min_lat]}, cell_size]}}
+                },
+                'lng': {'$avg': lng},
+                'lat': {'$avg': lat},
+                'count': {'$sum': 1},
+                'codes': {'$push': '$code'}
+            }
+        }
+    ]
+
+
+def retrieve_locations_within(bbox: BBox, zoom: int, level: str, db: MongoClient) -> dict:
+    """
+    Locations of `level` inside the viewport, clustered on a grid (with survey totals)
+    below LOCATION_CLUSTER_MAX_ZOOM or when there are more than LOCATION_WITHIN_MAX_POINTS
+    """
+    collection = db[database_name][level]
+    if(zoom >= LOCATION_CLUSTER_MAX_ZOOM):
+        data = collection.find(
+            build_viewport_match(bbox), {"code": 1, "name": 1, "point": 1, "_id": 0}
+        ).limit(LOCATION_WITHIN_MAX_POINTS + 1)
+        data = list(data)
+        if(len(data) <= LOCATION_WITHIN_MAX_POINTS):
+            return {
+                "clustered": False,
+                "data": [
+                    {
+                        "code": doc.get("code"),
+                        "name": doc.get("name"),
+                        "lng": doc["point"]["coordinates"][0],
+                        "lat": doc["point"]["coordinates"][1]
+                    }
+                    for doc in data
+                ]
+            }
+
+    clusters = list(collection.aggregate(build_cluster_pipeline(bbox, get_cluster_cell_size(zoom))))
+    codes = [code for cluster in clusters for code in cluster["codes"] if code is not None]
+    survey_counts = {doc["_id"]: doc["count"] for doc in get_survey_counts(codes, db)}
+    return {
+        "clustered": True,
+        "data": [
+            {
+                "lng": cluster["lng"],
+                "lat": cluster["lat"],
+                "count": cluster["count"],
+                "survey_count": sum(survey_counts.get(code, 0) for code in cluster["codes"])
+            }
+            for cluster in clusters
+        ]
+    }
@@ -0,0 +1,188 @@
+"""
+Bulk upsert of administrative units, used by POST /location/bulk and app.scripts.import_locations.
+Units are matched by code so an import can be re-run.
+"""
+import json
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+from pymongo import MongoClient, UpdateOne
+
+from ..core.config import database_name, country_collection_name, city_collection_name, LOCATION_CHILD_QUERY_MODE
+from ..models.location import LocationInBulk
+from .location import get_collection_name_from_location_code
+from .location_geo import make_point
+from .location_tree import CHILD_QUERY_ARRAY, location_levels, is_sub_level
+from .reference_snapshot import refresh_reference_snapshot
+from .survey_import import iter_survey_rows, format_validation_error
+
+LOCATION_FILE_EXTENSIONS = ['csv', 'json']
+
+
+def get_parents_code_from_code(code: str) -> Optional[str]:
+    """Parent code given by the code length scheme, cities belong to a country code that is not their prefix"""
+    if(len(code) > 2):
+        return code[:-2]
+    return None
+
+
+def validate_location(location: LocationInBulk, country_code: Optional[str] = None) -> Optional[str]:
+    """
+    Check the code and parents_code against the code length scheme, fill parents_code, return the error.
+    A city without parents_code belongs to `country_code`, the only country when there is one.
+    """
+    collection_name = get_collection_name_from_location_code(location.code)
+    if(collection_name == "" or not location.code.isdigit()):
+        return "code must be 1, 2, 4, 6 or 8 digits"
+    if(collection_name == location_levels[0]):
+        if(location.parents_code is not None):
+            return "a country has no parent"
+        return None
+    expected = get_parents_code_from_code(location.code)
+    if(location.parents_code is None):
+        location.parents_code = expected if expected is not None else country_code
+    elif(expected is not None and location.parents_code != expected):
+        return f"parents_code must be {expected}"
+    if(location.parents_code is None):
+        return "parents_code of a city is required when there is not exactly one country"
+    parent_collection = get_collection_name_from_location_code(location.parents_code)
+    if(parent_collection == "" or not is_sub_level(parent_collection, collection_name)):
+        return "parents_code is not of the parent level"
+    return None
+
+
+def upsert_locations(locations: List[LocationInBulk], db: MongoClient) -> dict:
+    """
+    Validate and upsert units by code, parent levels first.
+    Errors refer to the index of the unit in `locations`.
+    """
+    errors: List[dict] = []
+    by_level: Dict[str, List[Tuple[int, LocationInBulk]]] = defaultdict(list)
+    seen = set()
+    country_code = None
+    cities = [location for location in locations
+              if get_collection_name_from_location_code(location.code) == city_collection_name]
+    if(any(location.parents_code is None for location in cities)):
+        country_code = get_only_country_code(locations, db)
+    for idx, location in enumerate(locations):
+        error = validate_location(location, country_code)
+        if(error is None and location.code in seen):
+            error = "duplicate code"
+        if(error is not None):
+            errors.append({"index": idx, "code": location.code, "error": error})
+            continue
+        seen.add(location.code)
+        by_level[get_collection_name_from_location_code(location.code)].append((idx, location))
+
+    inserted = 0
+    updated = 0
+    # codes of the previous level which exist once it is written
+    known_parents = set()
+    for parent_level, level in zip([None] + location_levels, location_levels):
+        rows = by_level.get(level, [])
+        if(parent_level is not None and len(rows) > 0):
+            missing = list({location.parents_code for _, location in rows} - known_parents - {None})
+            if(len(missing) > 0):
+                data = db[database_name][parent_level].find({"code": {"$in": missing}}, {"code": 1})
+                known_parents.update(doc["code"] for doc in data)
+            valid_rows = []
+            for idx, location in rows:
+                if(location.parents_code is None or location.parents_code in known_parents):
+                    valid_rows.append((idx, location))
+                else:
+                    errors.append({"index": idx, "code": location.code, "error": "unknown parent"})
+            rows = valid_rows
+
+        known_parents = {location.code for _, location in rows}
+        if(len(rows) == 0):
+            continue
+        operations = []
+        for _, location in rows:
+            fields = location.dict(exclude_none=True)
+            point = make_point(location.lat, location.lng)
+            if(point is not None):
+                fields["point"] = point
+            operations.append(UpdateOne({"code": location.code}, {"$set": fields}, upsert=True))
+        result = db[database_name][level].bulk_write(operations, ordered=False)
+        inserted += result.upserted_count
+        updated += result.modified_count
+        if(LOCATION_CHILD_QUERY_MODE == CHILD_QUERY_ARRAY and parent_level is not None):
+            append_child_locations(
+                parent_level, level, [location.code for _, location in rows if location.parents_code], db)
+
+    if(inserted + updated > 0):
+        refresh_reference_snapshot(db)
+    errors.sort(key=lambda error: error["index"])
+    return {
+        "total": len(locations),
+        "inserted": inserted,
+        "updated": updated,
+        "failed": len(errors),
+        "errors": errors
+    }
+
+
+def get_only_country_code(locations: List[LocationInBulk], db: MongoClient) -> Optional[str]:
+    """Code of the country when the database and the batch know exactly one, as create_new_location does"""
+    codes = set(db[database_name][country_collection_name].distinct("code"))
+    codes.update(location.code for location in locations
+                 if get_collection_name_from_location_code(location.code) == country_collection_name)
+    codes.discard(None)
+    if(len(codes) == 1):
+        return codes.pop()
+    return None
+
+
+def append_child_locations(parent_level: str, level: str, codes: List[str], db: MongoClient):
+    """Batched form of append_child_location, $addToSet keeps re-runs idempotent"""
+    child_ids = defaultdict(list)
+    data = db[database_name][level].find({"code": {"$in": codes}}, {"parents_code": 1})
+    for doc in data:
+        child_ids[doc["parents_code"]].append(doc["_id"])
+    operations = [
+        UpdateOne({"code": parents_code}, {"$addToSet": {level: {"$each": ids}}})
+        for parents_code, ids in child_ids.items()
+    ]
+    if(len(operations) > 0):
+        db[database_name][parent_level].bulk_write(operations, ordered=False)
+
+
+def iter_location_rows(path: str, extension: str) -> Iterator[Tuple[int, dict]]:
+    """Yield (row number, unit) of a csv file with a header row or of a json list of units"""
+    if(extension == 'csv'):
+        for row_number, row in iter_survey_rows(path, extension):
+            # empty cells are missing values, not empty strings
+            yield row_number, {key: value for key, value in row.items() if key and value != ''}
+    elif(extension == 'json'):
+        with open(path, encoding='utf-8') as f:
+            for row_number, row in enumerate(json.load(f), start=1):
+                yield row_number, row
+    else:
+        raise ValueError(f"Unsupported file extension: {extension}")
+
+
+def import_location_file(path: str, extension: str, db: MongoClient) -> dict:
+    """Upsert the units of a csv or json file, errors refer to the row of the file"""
+    locations = []
+    location_rows = []
+    errors = []
+    for row_number, row in iter_location_rows(path, extension):
+        if(not isinstance(row, dict)):
+            errors.append({"row": row_number, "error": "a unit must be an object"})
+            continue
+        try:
+            locations.append(LocationInBulk(**row))
+            location_rows.append(row_number)
+        except ValidationError as e:
+            errors.append({"row": row_number, "error": format_validation_error(e)})
+
+    invalid_rows = len(errors)
+    result = upsert_locations(locations, db)
+    for error in result["errors"]:
+        errors.append({"row": location_rows[error.pop("index")], **error})
+    errors.sort(key=lambda error: error["row"])
+    result["total"] += invalid_rows
+    result["failed"] += invalid_rows
+    result["errors"] = errors
+    return result
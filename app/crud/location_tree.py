@@ -0,0 +1,91 @@
+"""
+Administrative location tree (country -> city -> district -> ward -> civil_group)
+read from the location collections, it is served to the workers by reference_snapshot.
+"""
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import MongoClient
+
+from ..core.config import (database_name,
+                           country_collection_name,
+                           city_collection_name,
+                           district_collection_name,
+                           ward_collection_name,
+                           civil_group_collection_name,
+                           LOCATION_CHILD_QUERY_MODE)
+
+# parent level first
+location_levels = [
+    country_collection_name,
+    city_collection_name,
+    district_collection_name,
+    ward_collection_name,
+    civil_group_collection_name
+]
+
+# values of LOCATION_CHILD_QUERY_MODE
+CHILD_QUERY_PARENTS_CODE = "parents_code"
+CHILD_QUERY_ARRAY = "array"
+
+
+class LocationNode:
+    __slots__ = ("code", "name", "level", "parents_code", "lat", "lng", "children")
+
+    def __init__(self, code: Optional[str], name: str, level: str,
+                 parents_code: Optional[str] = None, lat: float = None, lng: float = None):
+        self.code = code
+        self.name = name
+        self.level = level
+        self.parents_code = parents_code
+        self.lat = lat
+        self.lng = lng
+        self.children: List["LocationNode"] = []
+
+
+def read_location_tree(db: MongoClient) -> Tuple[Dict[str, List[LocationNode]], int]:
+    """
+    Read every location collection and link the children of each node.
+    Return the nodes that have no parent in the tree, per level, and the number of nodes.
+    """
+    nodes: Dict[str, LocationNode] = {}
+    nodes_by_id = {}
+    child_ids = {}
+    for level, sub_level in zip(location_levels, location_levels[1:] + [None]):
+        projection = {"code": 1, "name": 1, "parents_code": 1, "lat": 1, "lng": 1}
+        if(sub_level and LOCATION_CHILD_QUERY_MODE == CHILD_QUERY_ARRAY):
+            # children are also linked by an array of ObjectId named after their level
+            projection[sub_level] = 1
+        for doc in db[database_name][level].find({}, projection):
+            node = LocationNode(doc.get("code"), doc.get("name"), level,
+                                doc.get("parents_code"), doc.get("lat"), doc.get("lng"))
+            nodes_by_id[doc["_id"]] = node
+            if(node.code is not None):
+                nodes[node.code] = node
+            if(sub_level and isinstance(doc.get(sub_level), list)):
+                child_ids[doc["_id"]] = doc[sub_level]
+
+    linked = set()
+    for parent_id, ids in child_ids.items():
+        parent = nodes_by_id[parent_id]
+        for child_id in ids:
+            child = nodes_by_id.get(child_id)
+            if(child is not None and id(child) not in linked):
+                parent.children.append(child)
+                linked.add(id(child))
+    for child in nodes_by_id.values():
+        parent = nodes.get(child.parents_code) if child.parents_code else None
+        if(parent is not None and id(child) not in linked
+                and is_sub_level(parent.level, child.level)):
+            parent.children.append(child)
+            linked.add(id(child))
+
+    roots = {level: [] for level in location_levels}
+    for node in nodes_by_id.values():
+        if(id(node) not in linked):
+            roots[node.level].append(node)
+    return roots, len(nodes_by_id)
+
+
+def is_sub_level(parent_level: str, child_level: str) -> bool:
+    idx = location_levels.index(parent_level)
+    return idx + 1 < len(location_levels) and location_levels[idx + 1] == child_level
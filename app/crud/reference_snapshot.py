@@ -0,0 +1,488 @@
+"""
+Memory mapped snapshot of the static reference data (location hierarchy and role graph).
+
+One worker builds the file from mongo under a file lock and swaps it in with an atomic
+rename, every gunicorn worker maps the same file read only and looks the locations up
+in place, the pages are shared through the page cache and a restarted worker is ready
+without querying mongo or decoding the file.
+
+Layout (little endian):
+    header
+    location records, level by level, the children of a node are contiguous
+    code index: open addressing hash table of record numbers, crc32 of the code,
+    linear probing, at most half full
+    versions: every record carries a digest of its subtree, it changes when a location
+    below it is written, it is the ETag of the child listings
+    string table: utf-8 codes and names
+    role graph: json {role_name: [child role names]}
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional
+
+from pymongo import MongoClient
+
+from ..core.config import (database_name,
+                           role_collection_name,
+                           REFERENCE_SNAPSHOT_PATH,
+                           REFERENCE_SNAPSHOT_MAX_AGE,
+                           REFERENCE_SNAPSHOT_CHECK_INTERVAL,
+                           REFERENCE_SNAPSHOT_REBUILD_DELAY)
+from ..db.mongodb import db as database
+from .location_tree import LocationNode, location_levels, read_location_tree
+
+MAGIC = b"REFSNAP\0"
+FORMAT_VERSION = 3
+
+# magic, format version, generation, record count, index slot count,
+# (first record, record count) per level, offsets of records, index, strings, roles, roles length
+HEADER = struct.Struct("<8sIQII" + "II" * len(location_levels) + "QQQQQ")
+# code offset, code length, name offset, name length, level, parent record,
+# first child record, child count, lat, lng, flags, subtree version
+RECORD = struct.Struct("<IHIHBiIIddBQ")
+# code offset, code length, the leading fields of a record
+RECORD_CODE = struct.Struct("<IH")
+# record number + 1, 0 marks an empty slot
+INDEX_ENTRY = struct.Struct("<I")
+
+NO_PARENT = -1
+HAS_CODE = 1
+HAS_COORDINATES = 2
+
+
+"""
+Builder
+"""
+
+
+def read_role_graph(db: MongoClient) -> Dict[str, List[str]]:
+    """Direct child role names of every role"""
+    roles = list(db[database_name][role_collection_name].find({}, {"role_name": 1, "subordinate": 1}))
+    names = {role["_id"]: role["role_name"] for role in roles}
+    return {
+        role["role_name"]: [names[child] for child in role.get("subordinate") or [] if child in names]
+        for role in roles
+    }
+
+
+def order_location_records(roots: Dict[str, List[LocationNode]]) -> List[List[LocationNode]]:
+    """
+    Order nodes level by level, the children of each node are laid out together
+    in the order of their parents, nodes without parent come last in their level
+    """
+    levels = []
+    parents: List[LocationNode] = []
+    for level in location_levels:
+        nodes = [child for parent in parents for child in parent.children] + roots[level]
+        levels.append(nodes)
+        parents = nodes
+    return levels
+
+
+def serialize_snapshot(roots: Dict[str, List[LocationNode]], roles: Dict[str, List[str]], generation: int) -> bytes:
+    levels = order_location_records(roots)
+    nodes = [node for level_nodes in levels for node in level_nodes]
+    position = {id(node): idx for idx, node in enumerate(nodes)}
+
+    strings = bytearray()
+    string_offsets: Dict[str, int] = {}
+
+    def add_string(value: Optional[str]):
+        data = (value or "").encode("utf-8")
+        if(value not in string_offsets):
+            string_offsets[value] = len(strings)
+            strings.extend(data)
+        return string_offsets[value], len(data)
+
+    parent_of = {}
+    for idx, node in enumerate(nodes):
+        for child in node.children:
+            parent_of[id(child)] = idx
+
+    # children are laid out after their parent, compute the versions bottom up
+    versions = [0] * len(nodes)
+    for idx in range(len(nodes) - 1, -1, -1):
+        node = nodes[idx]
+        versions[idx] = get_subtree_version(
+            node, [versions[position[id(child)]] for child in node.children])
+
+    records = bytearray()
+    for idx, node in enumerate(nodes):
+        code_off, code_len = add_string(node.code)
+        name_off, name_len = add_string(node.name)
+        first_child = position[id(node.children[0])] if node.children else 0
+        flags = 0
+        if(node.code is not None):
+            flags |= HAS_CODE
+        if(node.lat is not None and node.lng is not None):
+            flags |= HAS_COORDINATES
+        records.extend(RECORD.pack(
+            code_off, code_len, name_off, name_len, location_levels.index(node.level),
+            parent_of.get(id(node), NO_PARENT), first_child, len(node.children),
+            float(node.lat or 0), float(node.lng or 0), flags, versions[idx]))
+
+    coded = [idx for idx, node in enumerate(nodes) if node.code is not None]
+    index = build_code_index([nodes[idx].code.encode("utf-8") for idx in coded], coded)
+    roles_data = json.dumps(roles).encode("utf-8")
+
+    level_ranges = []
+    start = 0
+    for level_nodes in levels:
+        level_ranges += [start, len(level_nodes)]
+        start += len(level_nodes)
+
+    records_off = HEADER.size
+    index_off = records_off + len(records)
+    strings_off = index_off + len(index)
+    roles_off = strings_off + len(strings)
+    header = HEADER.pack(
+        MAGIC, FORMAT_VERSION, generation, len(nodes), len(index) // INDEX_ENTRY.size, *level_ranges,
+        records_off, index_off, strings_off, roles_off, len(roles_data))
+    return header + bytes(records) + index + bytes(strings) + roles_data
+
+
+def build_code_index(codes: List[bytes], records: List[int]) -> bytes:
+    slot_count = 1
+    while(slot_count < 2 * len(codes)):
+        slot_count *= 2
+    slots = [0] * slot_count
+    for code, idx in zip(codes, records):
+        slot = zlib.crc32(code) & (slot_count - 1)
+        while(slots[slot] != 0):
+            slot = (slot + 1) & (slot_count - 1)
+        slots[slot] = idx + 1
+    return b"".join(INDEX_ENTRY.pack(entry) for entry in slots)
+
+
+def get_subtree_version(node: LocationNode, child_versions: List[int]) -> int:
+    digest = hashlib.blake2b(
+        json.dumps([node.code, node.name, node.lat, node.lng, child_versions]).encode("utf-8"),
+        digest_size=8)
+    return int.from_bytes(digest.digest(), "little")
+
+
+def write_snapshot(path: str, data: bytes):
+    """Write to a temporary file and rename it over the snapshot, readers never see a partial file"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def build_snapshot(db: MongoClient, path: str):
+    start = time.perf_counter()
+    # taken before reading, the snapshot contains every write made before its generation
+    generation = time.time_ns()
+    roots, count = read_location_tree(db)
+    roles = read_role_graph(db)
+    write_snapshot(path, serialize_snapshot(roots, roles, generation))
+    logging.info(f"Built reference snapshot of {count} locations in {time.perf_counter() - start:.2f}s")
+
+
+"""
+Reader
+"""
+
+
+def unpack_header(path: str, data: bytes) -> tuple:
+    if(len(data) < HEADER.size):
+        raise ValueError(f"{path} is not a reference snapshot")
+    fields = HEADER.unpack_from(data, 0)
+    if(fields[0] != MAGIC or fields[1] != FORMAT_VERSION):
+        raise ValueError(f"{path} is not a reference snapshot of version {FORMAT_VERSION}")
+    return fields
+
+
+class SnapshotView:
+    """
+    One snapshot file mapped read only, the lookups read the records in place
+    and decode the nodes they return, nothing else is copied into the worker
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns)
+            # stays valid once the file is closed or replaced, unmapped with the view
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        fields = unpack_header(path, self.buffer)
+        self.generation, self.record_count, self.slot_count = fields[2:5]
+        ranges = fields[5:5 + 2 * len(location_levels)]
+        self.level_ranges = {
+            level: (ranges[2 * idx], ranges[2 * idx + 1]) for idx, level in enumerate(location_levels)
+        }
+        self.records_off, self.index_off, self.strings_off, roles_off, roles_len = \
+            fields[5 + 2 * len(location_levels):]
+        roles_data = self.buffer[roles_off:roles_off + roles_len]
+        self.roles: Dict[str, List[str]] = json.loads(roles_data.decode("utf-8"))
+        self.roles_version = int.from_bytes(hashlib.blake2b(roles_data, digest_size=8).digest(), "little")
+
+    def find(self, code: str) -> Optional[int]:
+        """Record number of a code, None if it is not in the snapshot"""
+        target = code.encode("utf-8")
+        mask = self.slot_count - 1
+        slot = zlib.crc32(target) & mask
+        while(True):
+            (entry,) = INDEX_ENTRY.unpack_from(self.buffer, self.index_off + slot * INDEX_ENTRY.size)
+            if(entry == 0):
+                return None
+            if(self.read_code(entry - 1) == target):
+                return entry - 1
+            slot = (slot + 1) & mask
+
+    def read_record(self, idx: int) -> tuple:
+        return RECORD.unpack_from(self.buffer, self.records_off + idx * RECORD.size)
+
+    def read_string(self, offset: int, length: int) -> bytes:
+        start = self.strings_off + offset
+        return self.buffer[start:start + length]
+
+    def read_code(self, idx: int) -> bytes:
+        return self.read_string(*RECORD_CODE.unpack_from(self.buffer, self.records_off + idx * RECORD.size))
+
+    def node(self, idx: int, parents_code: Optional[str] = None) -> LocationNode:
+        """The children of the returned node are not linked, see children()"""
+        (code_off, code_len, name_off, name_len, level, parent,
+         _, _, lat, lng, flags, _) = self.read_record(idx)
+        if(parents_code is None and parent != NO_PARENT):
+            parents_code = self.read_code(parent).decode("utf-8")
+        has_coordinates = flags & HAS_COORDINATES
+        return LocationNode(
+            self.read_string(code_off, code_len).decode("utf-8") if flags & HAS_CODE else None,
+            self.read_string(name_off, name_len).decode("utf-8"),
+            location_levels[level],
+            parents_code,
+            lat if has_coordinates else None,
+            lng if has_coordinates else None)
+
+    def children(self, idx: int) -> List[LocationNode]:
+        record = self.read_record(idx)
+        first_child, child_count = record[6:8]
+        code = self.read_string(*record[0:2]).decode("utf-8") if record[10] & HAS_CODE else None
+        return [self.node(child, code) for child in range(first_child, first_child + child_count)]
+
+    def parent(self, idx: int) -> int:
+        return self.read_record(idx)[5]
+
+    def version(self, idx: int) -> int:
+        return self.read_record(idx)[11]
+
+
+class ReferenceSnapshot:
+    """
+    Location tree and role graph of the current snapshot file,
+    the file is checked for a newer version at most every `check_interval` seconds
+    """
+
+    def __init__(self, path: str, max_age: float, check_interval: float, rebuild_delay: float):
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self.max_age = max_age
+        self.check_interval = check_interval
+        self.rebuild_delay = rebuild_delay
+        self.view: Optional[SnapshotView] = None
+        self.checked_at = 0.0
+        self.swap_lock = threading.Lock()
+        # client of the last load, used to rebuild a snapshot that got older than max_age
+        self.db: Optional[MongoClient] = None
+        # generation the background rebuild has to reach, time.time_ns() of the last write
+        self.rebuild_requested_at: Optional[int] = None
+        self.rebuild_scheduled = False
+        self.rebuild_lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self.current() is not None
+
+    def current(self) -> Optional[SnapshotView]:
+        view = self.view
+        if(view is None or time.monotonic() - self.checked_at < self.check_interval):
+            return view
+        with self.swap_lock:
+            self.checked_at = time.monotonic()
+            try:
+                stat = os.stat(self.path)
+                if((stat.st_ino, stat.st_mtime_ns) != self.view.identity):
+                    # the old view is released once no request uses it anymore
+                    self.view = SnapshotView(self.path)
+            except (OSError, ValueError):
+                logging.exception("Could not reload reference snapshot")
+            view = self.view
+        if(self.db is not None and time.time_ns() - view.generation > self.max_age * 10 ** 9):
+            # picks up locations and roles edited directly in the database
+            self.request_rebuild(self.db, built_after=view.generation + 1)
+        return view
+
+    def read_header(self) -> Optional[tuple]:
+        try:
+            with open(self.path, "rb") as f:
+                return unpack_header(self.path, f.read(HEADER.size))
+        except (OSError, ValueError):
+            return None
+
+    def is_fresh(self) -> bool:
+        try:
+            if(time.time() - os.stat(self.path).st_mtime > self.max_age):
+                return False
+        except OSError:
+            return False
+        return self.read_header() is not None
+
+    def load(self, db: MongoClient, rebuild: bool = False, built_after: Optional[int] = None):
+        """
+        Map the snapshot, building it first when it is missing, too old, older than the
+        `built_after` generation or `rebuild` is set.
+        Workers starting together wait for the first one to build it.
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if(rebuild or not self.is_fresh()
+                        or (built_after is not None and self.read_header()[2] < built_after)):
+                    build_snapshot(db, self.path)
+                view = SnapshotView(self.path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        with self.swap_lock:
+            self.view = view
+            self.checked_at = time.monotonic()
+            self.db = db
+
+    def request_rebuild(self, db: MongoClient, built_after: Optional[int] = None):
+        """
+        Rebuild the snapshot in the background `rebuild_delay` seconds after a write
+        (or when it is older than the `built_after` generation),
+        the other workers swap it in within `check_interval`
+        """
+        if(built_after is None):
+            built_after = time.time_ns()
+        with self.rebuild_lock:
+            self.rebuild_requested_at = max(built_after, self.rebuild_requested_at or 0)
+            if(self.rebuild_scheduled):
+                return
+            self.rebuild_scheduled = True
+        self.schedule_rebuild(db)
+
+    def schedule_rebuild(self, db: MongoClient):
+        timer = threading.Timer(self.rebuild_delay, self.run_rebuild, args=(db,))
+        timer.daemon = True
+        timer.start()
+
+    def run_rebuild(self, db: MongoClient):
+        with self.rebuild_lock:
+            requested_at = self.rebuild_requested_at
+        try:
+            # skipped when another worker built a snapshot after the write meanwhile
+            self.load(db, built_after=requested_at)
+        except Exception:
+            logging.exception("Could not rebuild reference snapshot")
+        with self.rebuild_lock:
+            if(self.rebuild_requested_at == requested_at):
+                self.rebuild_scheduled = False
+                return
+        # written during the rebuild
+        self.schedule_rebuild(db)
+
+    """
+    Location tree
+    """
+
+    def get(self, code: str) -> Optional[LocationNode]:
+        """The children of the node are not linked, use get_children"""
+        view = self.current()
+        if(view is None):
+            return None
+        idx = view.find(code)
+        return view.node(idx) if idx is not None else None
+
+    def get_children(self, code: str) -> Optional[List[LocationNode]]:
+        """None if the code is not in the snapshot"""
+        view = self.current()
+        if(view is None):
+            return None
+        idx = view.find(code)
+        return view.children(idx) if idx is not None else None
+
+    def get_lineage(self, code: str) -> Optional[List[LocationNode]]:
+        """The location and its ancestors, root first, None if the code is not in the snapshot"""
+        view = self.current()
+        if(view is None):
+            return None
+        idx = view.find(code)
+        if(idx is None):
+            return None
+        lineage = []
+        while(idx != NO_PARENT):
+            lineage.append(idx)
+            idx = view.parent(idx)
+        lineage.reverse()
+        nodes = []
+        for idx in lineage:
+            nodes.append(view.node(idx, nodes[-1].code if nodes else None))
+        return nodes
+
+    def get_generation(self) -> Optional[int]:
+        """Changes with every rebuild of the snapshot, None if no snapshot is loaded"""
+        view = self.current()
+        if(view is None):
+            return None
+        return view.generation
+
+    def get_version(self, code: str) -> Optional[int]:
+        """Version of the subtree of a location, None if the code is not in the snapshot"""
+        view = self.current()
+        if(view is None):
+            return None
+        idx = view.find(code)
+        return view.version(idx) if idx is not None else None
+
+    def get_level(self, level: str) -> List[LocationNode]:
+        view = self.current()
+        if(view is None):
+            return []
+        start, count = view.level_ranges[level]
+        return [view.node(idx) for idx in range(start, start + count)]
+
+    """
+    Role graph
+    """
+
+    def get_role_graph(self) -> Optional[Dict[str, List[str]]]:
+        view = self.current()
+        if(view is None):
+            return None
+        return view.roles
+
+    def get_roles_version(self) -> Optional[int]:
+        """Changes whenever the role graph changes, None if no snapshot is loaded"""
+        view = self.current()
+        if(view is None):
+            return None
+        return view.roles_version
+
+
+reference_snapshot = ReferenceSnapshot(
+    REFERENCE_SNAPSHOT_PATH,
+    REFERENCE_SNAPSHOT_MAX_AGE,
+    REFERENCE_SNAPSHOT_CHECK_INTERVAL,
+    REFERENCE_SNAPSHOT_REBUILD_DELAY)
+
+
+def load_reference_snapshot():
+    reference_snapshot.load(database.client)
+
+
+def refresh_reference_snapshot(db: MongoClient):
+    """Rebuild the snapshot in the background after a write of locations or roles"""
+    reference_snapshot.request_rebuild(db)
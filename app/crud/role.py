@@ -0,0 +1,87 @@
+"""
+Role hierarchy (A1 -> A2 -> A3 -> B1 -> B2) held in memory as an immutable structure,
+read from the reference snapshot when it is loaded, from mongo otherwise.
+"""
+import threading
+from types import MappingProxyType
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from pymongo import MongoClient
+
+from ..db.mongodb import db as database
+from .reference_snapshot import read_role_graph, reference_snapshot
+
+
+class RoleHierarchy:
+    """Direct child roles of every role and the transitive closure (every role below it)"""
+
+    __slots__ = ("children", "descendants")
+
+    def __init__(self, graph: Dict[str, List[str]]):
+        children = {role: tuple(child_roles) for role, child_roles in graph.items()}
+        descendants = {}
+        for role in children:
+            found = set()
+            stack = list(children[role])
+            while(stack):
+                child = stack.pop()
+                # a cyclic graph must not loop forever
+                if(child not in found and child != role):
+                    found.add(child)
+                    stack.extend(children.get(child, ()))
+            descendants[role] = frozenset(found)
+        self.children = MappingProxyType(children)
+        self.descendants = MappingProxyType(descendants)
+
+    def get_children(self, role: str) -> Tuple[str, ...]:
+        return self.children.get(role, ())
+
+    def get_descendants(self, role: str) -> FrozenSet[str]:
+        return self.descendants.get(role, frozenset())
+
+    def is_child(self, role: str, child_role: str) -> bool:
+        return child_role in self.get_children(role)
+
+    def is_descendant(self, role: str, other_role: str) -> bool:
+        return other_role in self.get_descendants(role)
+
+
+# (roles version of the snapshot it was built from, hierarchy), swapped as a whole
+_current: Tuple[Optional[int], Optional[RoleHierarchy]] = (None, None)
+_lock = threading.Lock()
+
+
+def get_role_hierarchy(db: MongoClient) -> RoleHierarchy:
+    """
+    Current hierarchy, rebuilt when another worker swapped in a snapshot with other roles.
+    Without snapshot it is read from mongo once and kept until reload_role_hierarchy.
+    """
+    global _current
+    version, hierarchy = _current
+    snapshot_version = reference_snapshot.get_roles_version()
+    if(hierarchy is not None and (snapshot_version is None or snapshot_version == version)):
+        return hierarchy
+    with _lock:
+        if(snapshot_version is not None):
+            hierarchy = RoleHierarchy(reference_snapshot.get_role_graph())
+        else:
+            hierarchy = RoleHierarchy(read_role_graph(db))
+        _current = (snapshot_version, hierarchy)
+    return hierarchy
+
+
+def load_role_hierarchy():
+    get_role_hierarchy(database.client)
+
+
+def reload_role_hierarchy(db: MongoClient) -> RoleHierarchy:
+    """
+    Call after a write of the role collection, the snapshot is rebuilt before returning,
+    the other workers swap it in within REFERENCE_SNAPSHOT_CHECK_INTERVAL
+    """
+    global _current
+    reference_snapshot.load(db, rebuild=True)
+    hierarchy = RoleHierarchy(reference_snapshot.get_role_graph())
+    with _lock:
+        _current = (reference_snapshot.get_roles_version(), hierarchy)
+    return hierarchy
@@ -3,8 +3,9 @@ import pymongo
 from pymongo import MongoClient
 import datetime
 import re
+from typing import List, Optional
 
-from ..models.location import LocationListInSurvey
+from ..models.location import LocationListInSurvey, LocationDashboardInSurvey
 from ..models.survey import SurveyForm
 from ..core.config import (database_name,
                            user_collection_name,
@@ -14,8 +15,31 @@ from ..core.config import (database_name,
                            district_collection_name,
                            ward_collection_name,
                            civil_group_collection_name,
-                           survey_collection_name)
+                           survey_collection_name,
+                           MONGODB_MAX_TIME_MS,
+                           ANALYTICS_CACHE_SIZE,
+                           ANALYTICS_CACHE_TTL)
+from ..core.cache import TTLCache, cached_by_location
+from ..core.metrics import register_metrics
 from .location import get_collection_name_from_location_code
+from .survey_count import increment_survey_counts, get_survey_counts, count_address_codes
+from ..db.mongodb import DUPLICATE_KEY_ERROR_CODE
+
+SURVEY_ROW_INSERTED = 'inserted'
+SURVEY_ROW_DUPLICATE = 'duplicate'
+SURVEY_ROW_INVALID_DOB = 'invalid dob'
+SURVEY_ROW_UNKNOWN_HOMETOWN = 'unknown hometown'
+SURVEY_ROW_FAILED = 'failed'
+
+# results of the analytics queries, tagged with their location codes
+analytics_cache = TTLCache(ANALYTICS_CACHE_SIZE, ANALYTICS_CACHE_TTL)
+register_metrics("analytics_cache", analytics_cache.stats)
+
+
+def invalidate_location_analytics(addresses: List[dict]):
+    """Drop cached analytics of every location of the given permanent addresses"""
+    analytics_cache.invalidate_tags(
+        {code for _, code in count_address_codes(addresses)})
 
 
 def get_citizens_from_survey_col(code: str, unit: str, db: MongoClient):
@@ -25,30 +49,14 @@ def get_citizens_from_survey_col(code: str, unit: str, db: MongoClient):
     return list(data)
 
 
+@cached_by_location(analytics_cache)
 def count_number_survey_of_loc(locs: LocationListInSurvey, db: MongoClient):
+    """Read the number of surveys of each location from the rollup"""
     if(len(locs.codes) > 0):
-        loc_code = locs.codes[0]
-        field_name = get_collection_name_from_location_code(loc_code)
-        pipeline = [
-            {
-                '$match': {
-                    f'permanent_address.{field_name}': {
-                        '$in': locs.codes
-                    }
-                }
-            }, {
-                '$group': {
-                    '_id': f'$permanent_address.{field_name}',
-                    'count': {
-                        '$sum': 1
-                    }
-                }
-            }
-        ]
-        data = db[database_name][survey_collection_name].aggregate(pipeline)
-        return list(data)
+        return get_survey_counts(locs.codes, db)
     return []
 
+
 def get_citizen_by_username(username: str, unit: str, db: MongoClient):
     query_field = 'permanent_address.' + unit
     data = db[database_name][survey_collection_name].find(
@@ -72,126 +80,344 @@ def check_user_has_permission_to_delete(username: str, unit: str, id_number: str
     elif citizen['permanent_address'][unit] != username:
         return 'user not have permission'
 
-    db[database_name][survey_collection_name].delete_one(
+    delete_results = db[database_name][survey_collection_name].delete_one(
         {'identity_number': id_number})
+    if(delete_results.deleted_count > 0):
+        increment_survey_counts([citizen['permanent_address']], -1, db)
+        invalidate_location_analytics([citizen['permanent_address']])
 
     return True
 
 
+@cached_by_location(analytics_cache)
 def retrieve_number_of_people_per_occupation(location: LocationListInSurvey, db: MongoClient):
     if(len(location.codes) > 0):
-        loc_code = location.codes[0]
-        field_name = get_collection_name_from_location_code(loc_code)
-
-        pipeline = [
-            {
-                '$match': {
-                    f'permanent_address.{field_name}': {
-                        '$in': location.codes
-                    }
-                }
-            }, {
-                '$group': {
-                    '_id': {
-                        'code': f'$permanent_address.{field_name}',
-                        'job': '$job'
-                    },
-                    'count': {
-                        '$sum': 1
-                    }
-                }
-            }, {
-                '$group': {
-                    '_id': '$_id.code',
-                    'jobs': {
-                        '$push': {
-                            'job': '$_id.job',
-                            'count': '$count'
-                        }
-                    }
-                }
-            }, {
-                '$project': {
-                    'code': '$_id',
-                    '_id': 0,
-                    'jobs': 1
-                }
-            }
-        ]
-        data = db[database_name][survey_collection_name].aggregate(pipeline)
+        pipeline = build_occupation_pipeline(location.codes)
+        data = db[database_name][survey_collection_name].aggregate(
+            pipeline, maxTimeMS=MONGODB_MAX_TIME_MS)
 
         return list(data)
     return []
 
 
+@cached_by_location(analytics_cache)
 def retrieve_age_dist_per_gender(location: LocationListInSurvey, gender: str, db: MongoClient):
-    age_bins = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100]
+    if(len(location.codes) > 0):
+        pipeline = build_age_dist_pipeline(location.codes, gender)
+        data = db[database_name][survey_collection_name].aggregate(
+            pipeline, maxTimeMS=MONGODB_MAX_TIME_MS)
+
+        return format_age_dist(list(data))
+    return []
+
 
+@cached_by_location(analytics_cache)
+def retrieve_location_dashboard(location: LocationDashboardInSurvey, db: MongoClient):
     if(len(location.codes) > 0):
-        loc_code = location.codes[0]
-        field_name = get_collection_name_from_location_code(loc_code)
-        pipeline = [
-            {
-                '$match': {
-                    f'permanent_address.{field_name}': {
-                        '$in': location.codes
-                    },
-                    'gender': gender
-                }
-            }, {
-                '$project': {
-                    'birthday': {
-                        '$dateFromString': {
-                            'dateString': '$birthday',
-                            'format': '%d/%m/%Y'
-                        }
-                    }
+        pipeline = build_dashboard_pipeline(location.codes, location.facets)
+        data = db[database_name][survey_collection_name].aggregate(
+            pipeline, maxTimeMS=MONGODB_MAX_TIME_MS)
+        return format_dashboard(list(data)[0], location.facets)
+    return {}
+
+
+def retrieve_doc_in_survey(keyword: str, loc_code: str, db: MongoClient):
+    """Get people in survey by name (keyword)"""
+    pipeline = build_search_pipeline(keyword, loc_code)
+    data = db[database_name][survey_collection_name].aggregate(
+        pipeline, maxTimeMS=MONGODB_MAX_TIME_MS)
+    data = [d["identity_number"] for d in list(data)]
+    return list(data)
+
+
+DOB_PATTERN = re.compile(r"^([1-9]|0[1-9]|1[0-9]|2[0-9]|3[0-1])(\.|-|/)([1-9]|0[1-9]|1[0-2])(\.|-|/)([0-9][0-9]|19[0-9][0-9]|20[0-9][0-9])$|^([0-9][0-9]|19[0-9][0-9]|20[0-9][0-9])(\.|-|/)([1-9]|0[1-9]|1[0-2])(\.|-|/)([1-9]|0[1-9]|1[0-9]|2[0-9]|3[0-1])$")
+
+
+def parse_dob(dob: str) -> Optional[datetime.datetime]:
+    """Parse every accepted format of date of birth, None if the date is not valid"""
+    match = DOB_PATTERN.search(dob)
+    if match is None:
+        return None
+    if match.group(1):
+        day, month, year = match.group(1), match.group(3), match.group(5)
+    else:
+        year, month, day = match.group(6), match.group(8), match.group(10)
+
+    year = int(year)
+    if year < 100:
+        # two digits year, e.g 01/02/95
+        current_year = datetime.datetime.now().year
+        year += 2000 if year <= current_year % 100 else 1900
+    try:
+        return datetime.datetime(year, int(month), int(day))
+    except ValueError:
+        return None
+
+
+def set_birth_date(data_json: dict, birth_date: datetime.datetime):
+    """Store the parsed date of birth so analytics never parse dob strings"""
+    data_json['birth_date'] = birth_date
+    data_json['birth_year'] = birth_date.year
+
+
+def insert_data_into_col(data: SurveyForm, db: MongoClient):
+    data_json = jsonable_encoder(data)
+    id_num = db[database_name][survey_collection_name].find_one(
+        {'identity_number': data_json['identity_number']})
+    if id_num:
+        return 'id number has already existed'
+
+    birth_date = parse_dob(data_json['dob'])
+    if birth_date is None:
+        return 'invalid date of birth'
+    set_birth_date(data_json, birth_date)
+
+    hometown = db[database_name][city_collection_name].find_one(
+        {'code': data_json['hometown']})
+    if hometown is None:
+        return 'hometown not exist'
+
+    try:
+        db[database_name][survey_collection_name].insert_one(data_json)
+    except pymongo.errors.DuplicateKeyError:
+        return False
+    increment_survey_counts([data_json['permanent_address']], 1, db)
+    invalidate_location_analytics([data_json['permanent_address']])
+    return True
+
+
+def insert_many_data_into_col(forms: List[SurveyForm], db: MongoClient) -> List[dict]:
+    """
+    Validate survey forms in memory and insert all valid ones with a single unordered insert_many.
+    Duplicated identity numbers are reported from the unique index instead of being pre-queried.
+    """
+    results = [
+        {"index": idx, "identity_number": form.identity_number, "status": SURVEY_ROW_INSERTED}
+        for idx, form in enumerate(forms)
+    ]
+
+    # one query for every hometown referenced in the batch
+    hometowns = {form.hometown for form in forms}
+    known_hometowns = set()
+    if(len(hometowns) > 0):
+        cities = db[database_name][city_collection_name].find(
+            {'code': {'$in': list(hometowns)}}, {'code': 1, '_id': 0})
+        known_hometowns = {city['code'] for city in cities}
+
+    docs = []
+    doc_rows = []
+    for idx, form in enumerate(forms):
+        birth_date = parse_dob(form.dob)
+        if birth_date is None:
+            results[idx]["status"] = SURVEY_ROW_INVALID_DOB
+        elif form.hometown not in known_hometowns:
+            results[idx]["status"] = SURVEY_ROW_UNKNOWN_HOMETOWN
+        else:
+            doc = jsonable_encoder(form)
+            set_birth_date(doc, birth_date)
+            docs.append(doc)
+            doc_rows.append(idx)
+
+    if(len(docs) == 0):
+        return results
+
+    failed_docs = set()
+    try:
+        db[database_name][survey_collection_name].insert_many(docs, ordered=False)
+    except pymongo.errors.BulkWriteError as e:
+        for error in e.details.get('writeErrors', []):
+            failed_docs.add(error['index'])
+            row = results[doc_rows[error['index']]]
+            if error.get('code') == DUPLICATE_KEY_ERROR_CODE:
+                row["status"] = SURVEY_ROW_DUPLICATE
+            else:
+                row["status"] = SURVEY_ROW_FAILED
+
+    addresses = [doc['permanent_address'] for idx, doc in enumerate(docs) if idx not in failed_docs]
+    increment_survey_counts(addresses, 1, db)
+    invalidate_location_analytics(addresses)
+    return results
+
+
+"""
+Aggregation pipelines, shared by the sync and async data paths
+"""
+
+AGE_BINS = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100]
+
+GENDERS = ["Nam", "Nữ"]
+
+# optional dashboard facet -> name of its list in each location
+DASHBOARD_OPTIONAL_FACETS = {
+    'edu_level': 'edu_levels',
+    'religion': 'religions',
+    'hometown': 'hometowns'
+}
+
+
+def build_location_match(codes: List[str]) -> dict:
+    field_name = get_collection_name_from_location_code(codes[0])
+    return {
+        f'permanent_address.{field_name}': {
+            '$in': codes
+        }
+    }
+
+
+def build_count_stages(codes: List[str]) -> List[dict]:
+    field_name = get_collection_name_from_location_code(codes[0])
+    return [
+        {
+            '$group': {
+                '_id': f'$permanent_address.{field_name}',
+                'count': {
+                    '$sum': 1
                 }
-            }, {
-                '$project': {
-                    'age': {
-                        '$divide': [
-                            {
-                                '$subtract': [
-                                    datetime.datetime.now(), '$birthday'
-                                ]
-                            }, 31536000000  # year
-                        ]
-                    },
-                    'gender': 1
+            }
+        }
+    ]
+
+
+def build_field_dist_stages(codes: List[str], field: str, output: str) -> List[dict]:
+    """Number of people per value of `field` in each location, e.g jobs of each location"""
+    field_name = get_collection_name_from_location_code(codes[0])
+    return [
+        {
+            '$group': {
+                '_id': {
+                    'code': f'$permanent_address.{field_name}',
+                    field: f'${field}'
+                },
+                'count': {
+                    '$sum': 1
                 }
-            }, {
-                '$bucket': {
-                    'groupBy': '$age',
-                    'boundaries': age_bins,
-                    'default': 'other',
-                    'output': {
-                        'count': {
-                            '$sum': 1
-                        }
+            }
+        }, {
+            '$group': {
+                '_id': '$_id.code',
+                output: {
+                    '$push': {
+                        field: f'$_id.{field}',
+                        'count': '$count'
                     }
                 }
             }
-        ]
+        }, {
+            '$project': {
+                'code': '$_id',
+                '_id': 0,
+                output: 1
+            }
+        }
+    ]
 
-        data = db[database_name][survey_collection_name].aggregate(pipeline)
-        data = list(data)
 
-        # post process
-        data_formatted = []
-        for bins in data:
-            bins_idx = bins["_id"] // 10
-            bins_range = f"{age_bins[bins_idx - 1]} - {age_bins[bins_idx]}"
-            data_formatted.append({
-                bins_range: bins["count"]
-            })
+def build_occupation_pipeline(codes: List[str]) -> List[dict]:
+    return [
+        {
+            '$match': build_location_match(codes)
+        }
+    ] + build_field_dist_stages(codes, 'job', 'jobs')
+
+
+def get_birth_year_boundaries(current_year: int) -> List[int]:
+    """
+    Age range [a, b) is birth year range [current_year - b + 1, current_year - a + 1),
+    boundaries are returned ascending as $bucket needs
+    """
+    return [current_year - age + 1 for age in reversed(AGE_BINS)]
+
+
+def build_age_bucket_stage() -> dict:
+    current_year = datetime.datetime.now().year
+    return {
+        '$bucket': {
+            'groupBy': '$birth_year',
+            'boundaries': get_birth_year_boundaries(current_year),
+            'default': 'other',
+            'output': {
+                'count': {
+                    '$sum': 1
+                }
+            }
+        }
+    }
+
+
+def build_age_dist_pipeline(codes: List[str], gender: str) -> List[dict]:
+    match = build_location_match(codes)
+    match['gender'] = gender
+    match['birth_year'] = {'$type': 'number'}
+    # the match and the group key are all in the location/gender/birth_year index
+    return [
+        {
+            '$match': match
+        },
+        build_age_bucket_stage()
+    ]
 
-        return data_formatted
-    return []
 
+def build_dashboard_pipeline(codes: List[str], optional_facets: List[str]) -> List[dict]:
+    """All the series of the location dashboard in one pass over the matched surveys"""
+    facets = {
+        'count': build_count_stages(codes),
+        'occupation': build_field_dist_stages(codes, 'job', 'jobs'),
+    }
+    for idx, gender in enumerate(GENDERS):
+        facets[f'age_dist_{idx}'] = [
+            {
+                '$match': {
+                    'gender': gender,
+                    'birth_year': {'$type': 'number'}
+                }
+            },
+            build_age_bucket_stage()
+        ]
+    for field in optional_facets:
+        facets[field] = build_field_dist_stages(codes, field, DASHBOARD_OPTIONAL_FACETS[field])
 
-def retrieve_doc_in_survey(keyword: str, loc_code: str, db: MongoClient):
-    """Get people in survey by name (keyword)"""
+    return [
+        {
+            '$match': build_location_match(codes)
+        }, {
+            '$facet': facets
+        }
+    ]
+
+
+def format_dashboard(data: dict, optional_facets: List[str]) -> dict:
+    dashboard = {
+        'count': data['count'],
+        'occupation': data['occupation'],
+        'age_dist': {
+            gender: format_age_dist(data[f'age_dist_{idx}']) for idx, gender in enumerate(GENDERS)
+        }
+    }
+    for field in optional_facets:
+        dashboard[field] = data[field]
+    return dashboard
+
+
+def format_age_dist(data: List[dict]) -> List[dict]:
+    current_year = datetime.datetime.now().year
+    boundaries = get_birth_year_boundaries(current_year)
+    data_formatted = []
+    # youngest first, as the age bins
+    for bins in sorted(data, key=lambda bins: -bins["_id"] if bins["_id"] != 'other' else 0):
+        if bins["_id"] == 'other':
+            bins_range = 'other'
+        else:
+            idx = boundaries.index(bins["_id"])
+            age_start = current_year - boundaries[idx + 1] + 1
+            age_end = current_year - bins["_id"] + 1
+            bins_range = f"{age_start} - {age_end}"
+        data_formatted.append({
+            bins_range: bins["count"]
+        })
+    return data_formatted
+
+
+def build_search_pipeline(keyword: str, loc_code: str) -> List[dict]:
     field_name = get_collection_name_from_location_code(loc_code)
     match_phase = None
     keyword_len = len(keyword.split(" "))
@@ -214,7 +440,7 @@ def retrieve_doc_in_survey(keyword: str, loc_code: str, db: MongoClient):
             }
         }
 
-    pipeline = [
+    return [
         match_phase, {
             '$project': {
                 'identity_number': 1,
@@ -238,31 +464,3 @@ def retrieve_doc_in_survey(keyword: str, loc_code: str, db: MongoClient):
             }
         }
     ]
-
-    data = db[database_name][survey_collection_name].aggregate(pipeline)
-    data = [d["identity_number"] for d in list(data)]
-    return list(data)
-
-
-def insert_data_into_col(data: SurveyForm, db: MongoClient):
-    data_json = jsonable_encoder(data)
-    id_num = db[database_name][survey_collection_name].find_one(
-        {'identity_number': data_json['identity_number']})
-    if id_num:
-        return 'id number has already existed'
-
-    dob = data_json['dob']
-    check_dob = re.search("^([1-9]|0[1-9]|1[0-9]|2[0-9]|3[0-1])(\.|-|/)([1-9]|0[1-9]|1[0-2])(\.|-|/)([0-9][0-9]|19[0-9][0-9]|20[0-9][0-9])$|^([0-9][0-9]|19[0-9][0-9]|20[0-9][0-9])(\.|-|/)([1-9]|0[1-9]|1[0-2])(\.|-|/)([1-9]|0[1-9]|1[0-9]|2[0-9]|3[0-1])$", dob)
-    if check_dob is None:
-        return 'invalid date of birth'
-
-    hometown = db[database_name][city_collection_name].find_one(
-        {'code': data_json['hometown']})
-    if hometown is None:
-        return 'hometown not exist'
-
-    try:
-        db[database_name][survey_collection_name].insert_one(data_json)
-    except pymongo.errors.DuplicateKeyError:
-        return False
-    return True
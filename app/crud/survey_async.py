@@ -0,0 +1,83 @@
+"""
+Async (motor) versions of the survey read queries, selected with MONGODB_ASYNC
+"""
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from ..models.location import LocationListInSurvey, LocationDashboardInSurvey
+from ..core.config import (database_name,
+                           survey_collection_name,
+                           survey_count_collection_name,
+                           MONGODB_MAX_TIME_MS)
+from ..core.cache import cached_by_location
+from .survey import (analytics_cache,
+                     build_occupation_pipeline,
+                     build_age_dist_pipeline,
+                     build_search_pipeline,
+                     build_dashboard_pipeline,
+                     format_age_dist,
+                     format_dashboard)
+
+
+async def get_citizens_from_survey_col(code: str, unit: str, db: AsyncIOMotorClient):
+    query_field = 'permanent_address.' + unit
+    cursor = db[database_name][survey_collection_name].find(
+        {query_field: code}, {'_id': 0})
+    return await cursor.to_list(length=None)
+
+
+@cached_by_location(analytics_cache)
+async def count_number_survey_of_loc(locs: LocationListInSurvey, db: AsyncIOMotorClient):
+    """Read the number of surveys of each location from the rollup"""
+    if(len(locs.codes) > 0):
+        cursor = db[database_name][survey_count_collection_name].find(
+            {'_id': {'$in': locs.codes}, 'count': {'$gt': 0}}, {'count': 1})
+        return await cursor.to_list(length=None)
+    return []
+
+
+async def get_citizen_by_username(username: str, unit: str, db: AsyncIOMotorClient):
+    return await get_citizens_from_survey_col(username, unit, db)
+
+
+async def get_citizen_by_identidy_number(id_number: str, db: AsyncIOMotorClient):
+    return await db[database_name][survey_collection_name].find_one(
+        {"identity_number": id_number}, {'_id': 0})
+
+
+@cached_by_location(analytics_cache)
+async def retrieve_number_of_people_per_occupation(location: LocationListInSurvey, db: AsyncIOMotorClient):
+    if(len(location.codes) > 0):
+        pipeline = build_occupation_pipeline(location.codes)
+        cursor = db[database_name][survey_collection_name].aggregate(
+            pipeline, maxTimeMS=MONGODB_MAX_TIME_MS)
+        return await cursor.to_list(length=None)
+    return []
+
+
+@cached_by_location(analytics_cache)
+async def retrieve_age_dist_per_gender(location: LocationListInSurvey, gender: str, db: AsyncIOMotorClient):
+    if(len(location.codes) > 0):
+        pipeline = build_age_dist_pipeline(location.codes, gender)
+        cursor = db[database_name][survey_collection_name].aggregate(
+            pipeline, maxTimeMS=MONGODB_MAX_TIME_MS)
+        return format_age_dist(await cursor.to_list(length=None))
+    return []
+
+
+@cached_by_location(analytics_cache)
+async def retrieve_location_dashboard(location: LocationDashboardInSurvey, db: AsyncIOMotorClient):
+    if(len(location.codes) > 0):
+        pipeline = build_dashboard_pipeline(location.codes, location.facets)
+        cursor = db[database_name][survey_collection_name].aggregate(
+            pipeline, maxTimeMS=MONGODB_MAX_TIME_MS)
+        data = await cursor.to_list(length=None)
+        return format_dashboard(data[0], location.facets)
+    return {}
+
+
+async def retrieve_doc_in_survey(keyword: str, loc_code: str, db: AsyncIOMotorClient):
+    """Get people in survey by name (keyword)"""
+    pipeline = build_search_pipeline(keyword, loc_code)
+    cursor = db[database_name][survey_collection_name].aggregate(
+        pipeline, maxTimeMS=MONGODB_MAX_TIME_MS)
+    return [d["identity_number"] for d in await cursor.to_list(length=None)]
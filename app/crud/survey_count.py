@@ -0,0 +1,92 @@
+"""
+Survey count rollup: number of surveys per location code at every level,
+kept up to date with $inc by the insert and delete paths of crud/survey.py
+"""
+from collections import Counter
+from typing import List
+
+from pymongo import MongoClient, UpdateOne
+
+from ..core.config import (database_name,
+                           survey_collection_name,
+                           survey_count_collection_name)
+
+location_units = ['city', 'district', 'ward', 'civil_group']
+
+
+def count_address_codes(addresses: List[dict]) -> Counter:
+    """Count each (level, code) of a list of permanent addresses"""
+    counts = Counter()
+    for address in addresses:
+        for unit in location_units:
+            code = address.get(unit)
+            if(code):
+                counts[(unit, code)] += 1
+    return counts
+
+
+def increment_survey_counts(addresses: List[dict], delta: int, db: MongoClient):
+    """Add `delta` to the count of every location of the given permanent addresses"""
+    counts = count_address_codes(addresses)
+    if(len(counts) == 0):
+        return
+    operations = [
+        UpdateOne(
+            {'_id': code},
+            {'$inc': {'count': delta * n}, '$setOnInsert': {'level': unit}},
+            upsert=True)
+        for (unit, code), n in counts.items()
+    ]
+    db[database_name][survey_count_collection_name].bulk_write(operations, ordered=False)
+
+
+def get_survey_counts(codes: List[str], db: MongoClient) -> List[dict]:
+    data = db[database_name][survey_count_collection_name].find(
+        {'_id': {'$in': codes}, 'count': {'$gt': 0}}, {'count': 1})
+    return list(data)
+
+
+def build_rebuild_survey_counts_pipeline(target_collection: str) -> List[dict]:
+    return [
+        {
+            '$project': {
+                'codes': [
+                    {'level': unit, 'code': f'$permanent_address.{unit}'}
+                    for unit in location_units
+                ]
+            }
+        }, {
+            '$unwind': {
+                'path': '$codes'
+            }
+        }, {
+            '$match': {
+                'codes.code': {
+                    '$type': 'string'
+                }
+            }
+        }, {
+            '$group': {
+                '_id': '$codes.code',
+                'level': {
+                    '$first': '$codes.level'
+                },
+                'count': {
+                    '$sum': 1
+                }
+            }
+        }, {
+            '$out': target_collection
+        }
+    ]
+
+
+def rebuild_survey_counts(db: MongoClient):
+    """
+    Recompute the whole rollup from the survey collection and swap it in,
+    surveys written while the rebuild is running may be missed so run it when the load is low
+    """
+    target_collection = f'{survey_count_collection_name}_rebuild'
+    pipeline = build_rebuild_survey_counts_pipeline(target_collection)
+    list(db[database_name][survey_collection_name].aggregate(pipeline, allowDiskUse=True))
+    db[database_name][target_collection].rename(survey_count_collection_name, dropTarget=True)
@@ -0,0 +1,191 @@
+import csv
+import datetime
+import os
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+import openpyxl
+import xlrd
+from pydantic import ValidationError
+from pymongo import MongoClient
+
+from ..models.survey import SurveyForm
+from .survey import insert_many_data_into_col, SURVEY_ROW_INSERTED
+
+SURVEY_FILE_EXTENSIONS = ['csv', 'xls', 'xlsx']
+
+# header row of the uploaded file, nested fields are written as `permanent_address.city`
+ADDRESS_FIELDS = ['permanent_address', 'temporary_address']
+
+
+def get_file_extension(filename: str) -> str:
+    if('.' not in filename):
+        return ''
+    return filename.rsplit('.', 1)[1].lower()
+
+
+def format_cell_value(value) -> str:
+    """Convert a spreadsheet cell into the string stored in the survey form"""
+    if(value is None):
+        return ''
+    if(isinstance(value, float) and value.is_integer()):
+        # identity numbers and codes are read back as floats by spreadsheet readers
+        return str(int(value))
+    if(isinstance(value, (datetime.datetime, datetime.date))):
+        return value.strftime('%d/%m/%Y')
+    return str(value).strip()
+
+
+def iter_csv_rows(path: str) -> Iterator[list]:
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.reader(f):
+            yield row
+
+
+def iter_xls_rows(path: str) -> Iterator[list]:
+    workbook = xlrd.open_workbook(path, on_demand=True)
+    try:
+        sheet = workbook.sheet_by_index(0)
+        for idx in range(sheet.nrows):
+            row = []
+            for cell in sheet.row(idx):
+                if(cell.ctype == xlrd.XL_CELL_DATE):
+                    row.append(xlrd.xldate_as_datetime(cell.value, workbook.datemode))
+                else:
+                    row.append(cell.value)
+            yield row
+    finally:
+        workbook.release_resources()
+
+
+def iter_xlsx_rows(path: str) -> Iterator[list]:
+    # read only mode streams the sheet instead of loading the whole workbook
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        for row in sheet.iter_rows(values_only=True):
+            yield list(row)
+    finally:
+        workbook.close()
+
+
+def iter_survey_rows(path: str, extension: str) -> Iterator[Tuple[int, dict]]:
+    """Yield (row number, row as dict keyed by header) for each data row of the file"""
+    if(extension == 'csv'):
+        rows = iter_csv_rows(path)
+    elif(extension == 'xls'):
+        rows = iter_xls_rows(path)
+    elif(extension == 'xlsx'):
+        rows = iter_xlsx_rows(path)
+    else:
+        raise ValueError(f"Unsupported file extension: {extension}")
+
+    header = None
+    for row_number, row in enumerate(rows, start=1):
+        values = [format_cell_value(value) for value in row]
+        if(header is None):
+            header = values
+            continue
+        if(not any(values)):
+            continue
+        yield row_number, dict(zip(header, values))
+
+
+def row_to_survey_form(row: dict) -> SurveyForm:
+    """Map a flat spreadsheet row onto the nested survey form"""
+    data = {field: {} for field in ADDRESS_FIELDS}
+    for key, value in row.items():
+        if('.' in key):
+            parent, child = key.split('.', 1)
+            if(parent in data):
+                data[parent][child] = value
+        elif(key):
+            data[key] = value
+    return SurveyForm(**data)
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if(len(chunk) == 0):
+            return
+        yield chunk
+
+
+def format_validation_error(e: ValidationError) -> str:
+    return '; '.join(
+        f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}" for error in e.errors())
+
+
+def import_survey_file(
+        path: str,
+        extension: str,
+        chunk_size: int,
+        max_errors: int,
+        db: MongoClient,
+        progress: Optional[Callable] = None) -> dict:
+    """
+    Stream the rows of an uploaded survey file and bulk insert them chunk by chunk,
+    only one chunk of rows is kept in memory at a time.
+    At most `max_errors` row errors are reported, the others are only counted.
+    """
+    total = 0
+    inserted = 0
+    failed = 0
+    errors: List[dict] = []
+
+    def add_error(error: dict):
+        if(len(errors) < max_errors):
+            errors.append(error)
+
+    for chunk in chunked(iter_survey_rows(path, extension), chunk_size):
+        forms = []
+        form_rows = []
+        for row_number, row in chunk:
+            total += 1
+            try:
+                forms.append(row_to_survey_form(row))
+                form_rows.append(row_number)
+            except ValidationError as e:
+                failed += 1
+                add_error({"row": row_number, "error": format_validation_error(e)})
+
+        if(len(forms) > 0):
+            results = insert_many_data_into_col(forms, db)
+        else:
+            results = []
+        for result in results:
+            if(result["status"] == SURVEY_ROW_INSERTED):
+                inserted += 1
+            else:
+                failed += 1
+                add_error({
+                    "row": form_rows[result["index"]],
+                    "identity_number": result["identity_number"],
+                    "error": result["status"]
+                })
+        if(progress):
+            progress(total)
+
+    errors.sort(key=lambda error: error["row"])
+    return {
+        "total": total,
+        "inserted": inserted,
+        "failed": failed,
+        "errors": errors
+    }
+
+
+def import_uploaded_survey_file(
+        path: str,
+        extension: str,
+        chunk_size: int,
+        max_errors: int,
+        db: MongoClient,
+        progress: Optional[Callable] = None) -> dict:
+    """import_survey_file of an uploaded file, the file is removed once the import ends or fails"""
+    try:
+        return import_survey_file(path, extension, chunk_size, max_errors, db, progress=progress)
+    finally:
+        os.remove(path)
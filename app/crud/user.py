@@ -1,30 +1,70 @@
+import logging
+import time
+from typing import List
+
 import pymongo
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import WriteError
 from odmantic import ObjectId
 from datetime import datetime, timedelta
 from fastapi.encoders import jsonable_encoder
 
 from .location import (get_collection_name_from_location_code,
-                       retrieve_location_info_by_code,
-                       get_collection_field,
+                       get_loc_name_from_parent_code,
                        get_all_childs_of_location)
+from .reference_snapshot import reference_snapshot
+from .role import get_role_hierarchy
+from ..core.cache import TTLCache
+from ..core.metrics import LatencyStats, register_metrics
 from ..models.user import UserInDelete, UserInLogin, User, UserInCreate, UserState, UserInAuthorize
 from ..core.config import (database_name,
                            user_collection_name,
-                           role_collection_name,
-                           country_collection_name,
-                           city_collection_name,
-                           district_collection_name,
-                           ward_collection_name)
-from ..core.security import verify_password, get_password_hash
-
-
-def authenticate_user(user_login: UserInLogin, db: MongoClient):
-    """Check user exists and validate password"""
-    user = get_user_by_username(user_login.username, db)
+                           USER_CACHE_SIZE,
+                           USER_CACHE_TTL,
+                           MANAGE_LOCATION_CACHE_TTL,
+                           USER_SUBTREE_MODE,
+                           USER_SUBTREE_MAX_DEPTH,
+                           MONGODB_MAX_TIME_MS)
+from ..core.security import password_hasher
+from ..db.mongodb import DUPLICATE_KEY_ERROR_CODE, run_query
+from . import user_async
+
+# users resolved by get_current_user, keyed by username
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+register_metrics("user_cache", user_cache.stats)
+# username -> manage_location, filled by get_current_user
+manage_location_cache = TTLCache(USER_CACHE_SIZE, MANAGE_LOCATION_CACHE_TTL)
+
+# values of USER_SUBTREE_MODE
+USER_SUBTREE_ANCESTORS = "ancestors"
+USER_SUBTREE_GRAPH_LOOKUP = "graph_lookup"
+
+user_state_stats = LatencyStats()
+register_metrics("user_state_updates", user_state_stats.to_dict)
+
+BACKFILL_BATCH_SIZE = 1000
+
+# status of each row of POST /user/create/batch
+USER_ROW_INSERTED = 'inserted'
+USER_ROW_DUPLICATE = 'duplicate'
+USER_ROW_FAILED = 'failed'
+
+
+def invalidate_cached_users(usernames):
+    """Drop users written by this worker, the TTL bounds the staleness in the other workers"""
+    for username in usernames:
+        user_cache.invalidate(username)
+        manage_location_cache.invalidate(username)
+
+
+async def authenticate_user(user_login: UserInLogin):
+    """Check user exists and validate password, bcrypt runs on the password pool"""
+    user = await run_query(get_user_by_username,
+                           user_async.get_user_by_username,
+                           user_login.username)
     if(not user):
         return False
-    if(not verify_password(user_login.password, user.password)):
+    if(not await password_hasher.verify(user_login.password, user.password)):
         return False
     return user
 
@@ -56,40 +96,21 @@ def get_user_id_by_username(username: str, db: MongoClient):
 
 def get_child_role(role: str, db: MongoClient):
     """Get all child role of a specific role"""
-    pipeline = [
-        {
-            '$match': {
-                'role_name': role
-            }
-        }, {
-            '$unwind': {
-                'path': '$subordinate'
-            }
-        }, {
-            '$lookup': {
-                'from': 'role',
-                'localField': 'subordinate',
-                'foreignField': '_id',
-                'as': 'child_rolename'
-            }
-        }, {
-            '$project': {
-                'role_name': {
-                    '$first': '$child_rolename.role_name'
-                },
-                '_id': 0
-            }
-        }
-    ]
-
-    data = db[database_name][role_collection_name].aggregate(pipeline)
-    roles = [x["role_name"] for x in list(data)]
-    return roles
+    return list(get_role_hierarchy(db).get_children(role))
 
 
 def get_child_user_from_user_id(id: ObjectId, db: MongoClient):
     data = db[database_name][user_collection_name].find(
-        {"manager_id": id}, {"_id": 0, "manager_id": 0, "password": 0})
+        {"manager_id": id}, {"_id": 0, "manager_id": 0, "password": 0, "ancestors": 0})
+    return list(data)
+
+
+def get_descendant_users(user: User, skip: int, limit: int, db: MongoClient):
+    """Users at any depth below the given user, one query on the ancestors index"""
+    data = db[database_name][user_collection_name].find(
+        {"ancestors": user.id},
+        {"_id": 0, "manager_id": 0, "password": 0, "ancestors": 0}
+    ).sort("username", pymongo.ASCENDING).skip(skip).limit(limit)
     return list(data)
 
 
@@ -99,19 +120,20 @@ def get_child_user_survey_time_from_user_id(id: ObjectId, db: MongoClient):
     return list(data)
 
 
-def get_management_info_by_username(username: str, db: MongoClient):
-    """Get locations and users which is managed by the given username"""
+def get_management_info_of_user(user: User, db: MongoClient):
+    """Get locations and users which is managed by the given user"""
 
     # get data for query
-    user = get_user_by_username(username, db)
-    query_collection = get_collection_name_from_location_code(
-        user.manage_location)
-    location_info = retrieve_location_info_by_code(
-        user.manage_location, query_collection, db)
-    sub_collection = get_collection_field(location_info)
-    # query info
-    child_locations = get_all_childs_of_location(
-        user.manage_location, query_collection, sub_collection, db)
+    child_locations = reference_snapshot.get_children(user.manage_location)
+    if(child_locations is not None):
+        child_locations = [{"code": node.code, "name": node.name} for node in child_locations]
+    else:
+        query_collection = get_collection_name_from_location_code(
+            user.manage_location)
+        sub_collection = get_loc_name_from_parent_code(user.manage_location, db)
+        # query info
+        child_locations = get_all_childs_of_location(
+            user.manage_location, query_collection, sub_collection, db)
     child_users = get_child_user_from_user_id(user.id, db)
     location_has_manager = [k["manage_location"] for k in child_users]
     for obj in child_locations:
@@ -129,39 +151,230 @@ CRUD CREATE
 """
 
 
-def create_new_user(user: UserInCreate, manager_name: str, db: MongoClient):
-    """Create new user and insert into database"""
-    manager_id = get_user_id_by_username(manager_name, db)
-    user.password = get_password_hash(user.password)
+def create_new_user(user: UserInCreate, manager: User, db: MongoClient):
+    """Create new user and insert into database, `user.password` is already hashed (password_hasher)"""
     user_json = jsonable_encoder(user)
-    user_json["manager_id"] = manager_id
+    user_json["manager_id"] = manager.id
+    user_json["ancestors"] = manager.ancestors + [manager.id]
+    user_json["children_count"] = 0
+    user_json["unfinished_children"] = 0
+    unfinished = 0 if user.is_finish else 1
+    # counted before the insert, the manager can not finish while the child is being created
+    increment_children_counters(manager.id, 1, unfinished, db)
     # insert into database
     try:
         db[database_name][user_collection_name].insert_one(user_json)
-    except pymongo.errors.DuplicateKeyError:
-        return False
+    except Exception as e:
+        increment_children_counters(manager.id, -1, -unfinished, db)
+        if(isinstance(e, pymongo.errors.DuplicateKeyError)):
+            return False
+        raise
     return True
 
 
+def create_new_users(users: List[UserInCreate], manager: User, db: MongoClient) -> List[dict]:
+    """
+    Insert the children of a manager with a single unordered insert_many, passwords are already hashed.
+    Taken usernames, in the database or earlier in the batch, are reported from the unique index.
+    """
+    results = [
+        {"index": idx, "username": user.username, "status": USER_ROW_INSERTED}
+        for idx, user in enumerate(users)
+    ]
+    if(len(users) == 0):
+        return results
+    ancestors = manager.ancestors + [manager.id]
+    docs = []
+    for user in users:
+        user_json = jsonable_encoder(user)
+        user_json["manager_id"] = manager.id
+        user_json["ancestors"] = ancestors
+        user_json["children_count"] = 0
+        user_json["unfinished_children"] = 0
+        docs.append(user_json)
+
+    # counted before the insert, the manager can not finish while the children are being created
+    unfinished = [not user.is_finish for user in users]
+    increment_children_counters(manager.id, len(users), sum(unfinished), db)
+    failed_docs = set()
+    try:
+        db[database_name][user_collection_name].insert_many(docs, ordered=False)
+    except pymongo.errors.BulkWriteError as e:
+        for error in e.details.get('writeErrors', []):
+            failed_docs.add(error['index'])
+            if(error.get('code') == DUPLICATE_KEY_ERROR_CODE):
+                results[error['index']]["status"] = USER_ROW_DUPLICATE
+            else:
+                results[error['index']]["status"] = USER_ROW_FAILED
+    except Exception:
+        increment_children_counters(manager.id, -len(users), -sum(unfinished), db)
+        raise
+
+    if(len(failed_docs) > 0):
+        increment_children_counters(
+            manager.id, -len(failed_docs), -len([idx for idx in failed_docs if unfinished[idx]]), db)
+    return results
+
+
+def increment_children_counters(manager_id: ObjectId, children: int, unfinished: int, db: MongoClient):
+    """
+    Keep the counters of the direct children of a manager up to date.
+    The write of the child and this one are not atomic, they are ordered so that a failure
+    in between over counts the unfinished children, the drift is fixed by backfill_children_counters.
+    """
+    # counters that were never backfilled are not started from a partial count
+    db[database_name][user_collection_name].update_one(
+        {"_id": manager_id, "unfinished_children": {"$exists": True}},
+        {"$inc": {"children_count": children, "unfinished_children": unfinished}})
+
+
+def backfill_children_counters(db: MongoClient) -> int:
+    """
+    Recount children_count and unfinished_children (direct children whose task is not finished)
+    of every user, return the number of users fixed. Run periodically by the workers.
+    """
+    collection = db[database_name][user_collection_name]
+    # read before counting, a counter written since then is left for the next run
+    stored = {
+        user["_id"]: (user.get("children_count"), user.get("unfinished_children"))
+        for user in collection.find({}, {"children_count": 1, "unfinished_children": 1},
+                                    batch_size=BACKFILL_BATCH_SIZE)
+    }
+    pipeline = [
+        {
+            '$match': {
+                'manager_id': {'$ne': None}
+            }
+        }, {
+            '$group': {
+                '_id': '$manager_id',
+                'children_count': {'$sum': 1},
+                'unfinished_children': {
+                    '$sum': {'$cond': [{'$eq': ['$is_finish', True]}, 0, 1]}
+                }
+            }
+        }
+    ]
+    counters = {doc["_id"]: doc for doc in collection.aggregate(pipeline, allowDiskUse=True)}
+
+    updated = 0
+    operations = []
+    for user_id, (children_count, unfinished_children) in stored.items():
+        counter = counters.get(user_id, {})
+        values = (counter.get("children_count", 0), counter.get("unfinished_children", 0))
+        if(values == (children_count, unfinished_children)):
+            continue
+        operations.append(UpdateOne(
+            {"_id": user_id, "children_count": children_count, "unfinished_children": unfinished_children},
+            {"$set": {"children_count": values[0], "unfinished_children": values[1]}}))
+        if(len(operations) == BACKFILL_BATCH_SIZE):
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if(len(operations) > 0):
+        updated += collection.bulk_write(operations, ordered=False).modified_count
+    return updated
+
+
 """
 CRUD UPDATE
 """
 
 
 def update_user_state(user_state: UserState, db: MongoClient):
+    """Set `active` on the user and every user of its subtree in one write"""
     user = get_user_by_username(user_state.username, db)
-    child_users = get_child_user_from_user_id(user.id, db)
-    names = [u["username"] for u in list(child_users)] + [user.username]
-    # update active fields in database
-    query = {"username": {"$in": names}}
+    if(user is None):
+        return False
+    start = time.perf_counter()
     newvalues = {"$set": {"active": user_state.is_active}}
-    update_results = db[database_name][user_collection_name].update_many(
-        query, newvalues)
-    if(update_results.modified_count > 0):
+    if(USER_SUBTREE_MODE == USER_SUBTREE_GRAPH_LOOKUP):
+        db[database_name][user_collection_name].aggregate(
+            build_subtree_state_pipeline(user.id, user_state.is_active), maxTimeMS=MONGODB_MAX_TIME_MS)
+        # $merge does not report the number of written documents
+        modified_count = None
+    else:
+        # manager_id keeps the direct children covered until backfill_user_ancestors has run
+        query = {"$or": [{"_id": user.id}, {"ancestors": user.id}, {"manager_id": user.id}]}
+        # the update command, update_many does not take a time limit
+        result = db[database_name].command(
+            "update", user_collection_name,
+            updates=[{"q": query, "u": newvalues, "multi": True}],
+            maxTimeMS=MONGODB_MAX_TIME_MS)
+        if(result.get("writeErrors")):
+            error = result["writeErrors"][0]
+            raise WriteError(error.get("errmsg"), error.get("code"), error)
+        modified_count = result["nModified"]
+    duration_ms = (time.perf_counter() - start) * 1000
+    user_state_stats.add(duration_ms)
+    logging.info(f"Set active={user_state.is_active} on the subtree of {user.username}: "
+                 f"{modified_count} users modified in {duration_ms:.1f}ms")
+    # cached users are tagged with their ancestors
+    user_cache.invalidate_tags([str(user.id)])
+    if(modified_count is None or modified_count > 0):
         return True
     return False
 
 
+def build_subtree_state_pipeline(user_id: ObjectId, is_active: bool) -> list:
+    """
+    Resolve the descendants over manager_id and write `active` back with $merge, in one round trip.
+    The $unwind right after $graphLookup is absorbed by it, so the subtree is never gathered
+    into one document (16MB limit). The user itself is added back with $unionWith.
+    """
+    return [
+        {
+            '$match': {
+                '_id': user_id
+            }
+        }, {
+            '$graphLookup': {
+                'from': user_collection_name,
+                'startWith': '$_id',
+                'connectFromField': '_id',
+                'connectToField': 'manager_id',
+                'as': 'descendants',
+                'maxDepth': USER_SUBTREE_MAX_DEPTH
+            }
+        }, {
+            '$unwind': {
+                'path': '$descendants'
+            }
+        }, {
+            '$project': {
+                '_id': '$descendants._id'
+            }
+        }, {
+            '$unionWith': {
+                'coll': user_collection_name,
+                'pipeline': [
+                    {
+                        '$match': {
+                            '_id': user_id
+                        }
+                    }, {
+                        '$project': {
+                            '_id': 1
+                        }
+                    }
+                ]
+            }
+        }, {
+            '$set': {
+                'active': {
+                    '$literal': is_active
+                }
+            }
+        }, {
+            '$merge': {
+                'into': user_collection_name,
+                'on': '_id',
+                'whenMatched': 'merge',
+                'whenNotMatched': 'discard'
+            }
+        }
+    ]
+
+
 def update_valid_declare_time(user: UserInAuthorize, db: MongoClient):
     """Update the start and end time of the right of declaration"""
 
@@ -185,34 +398,107 @@ def update_valid_declare_time(user: UserInAuthorize, db: MongoClient):
     }
     update_results = db[database_name][user_collection_name].update_many(
         query, data, upsert=True)
+    invalidate_cached_users([user.username])
     if(update_results.modified_count > 0):
         return True
     return False
 
 
 def update_is_finish(user: User, db: MongoClient):
-    child_users = get_child_user_from_user_id(user.id, db)
-    print(child_users)
-    for child_user in child_users:
-        if child_user['is_finish'] == False:
+    """Mark the task of the user as finished, only once every direct child finished theirs"""
+    collection = db[database_name][user_collection_name]
+    update_results = collection.update_one(
+        {"_id": user.id, "is_finish": {"$ne": True}, "unfinished_children": {"$lte": 0}},
+        {"$set": {"is_finish": True}})
+    if(update_results.modified_count == 0):
+        data = collection.find_one({"_id": user.id}, {"is_finish": 1, "unfinished_children": 1})
+        if(data is None):
             return 'child user is not finish tasks'
-
-    try:
-        db[database_name][user_collection_name].update_one({'username': user.username}, {'$set': {'is_finish': False}})
-    except pymongo.errors.DuplicateKeyError:
-        return 'cannot update finish task'
+        if(data.get("is_finish")):
+            return True
+        if("unfinished_children" in data):
+            return 'child user is not finish tasks'
+        # no counters until backfill_children_counters has run, look for an unfinished child
+        if(collection.count_documents({"manager_id": user.id, "is_finish": {"$ne": True}}, limit=1) > 0):
+            return 'child user is not finish tasks'
+        update_results = collection.update_one(
+            {"_id": user.id, "is_finish": {"$ne": True}}, {"$set": {"is_finish": True}})
+        if(update_results.modified_count == 0):
+            return True
+    increment_children_counters(user.manager_id, 0, -1, db)
+    invalidate_cached_users([user.username])
     return True
 
 
+def get_subtree_progress(user: User, db: MongoClient) -> dict:
+    """Finished tasks of the subtree of the user, per direct child, from the children counters"""
+    children = list(db[database_name][user_collection_name].find(
+        {"manager_id": user.id}, {"username": 1, "is_finish": 1}))
+    branches = db[database_name][user_collection_name].aggregate(
+        build_subtree_progress_pipeline(user), maxTimeMS=MONGODB_MAX_TIME_MS)
+    return summarize_subtree_progress(children, list(branches))
+
+
+def build_subtree_progress_pipeline(user: User) -> list:
+    """Sum the children counters of the descendants per branch"""
+    # the branch of a descendant is the direct child of `user` above it
+    return [
+        {
+            '$match': {
+                'ancestors': user.id
+            }
+        }, {
+            '$group': {
+                '_id': {
+                    '$ifNull': [{'$arrayElemAt': ['$ancestors', len(user.ancestors) + 1]}, '$_id']
+                },
+                'total': {
+                    '$sum': {'$ifNull': ['$children_count', 0]}
+                },
+                'unfinished': {
+                    '$sum': {'$ifNull': ['$unfinished_children', 0]}
+                }
+            }
+        }
+    ]
+
+
+def summarize_subtree_progress(children: List[dict], branches: List[dict]) -> dict:
+    branches = {branch["_id"]: branch for branch in branches}
+    data = []
+    for child in children:
+        branch = branches.get(child["_id"], {})
+        data.append(dict(
+            format_progress(branch.get("total", 0), branch.get("unfinished", 0)),
+            username=child["username"],
+            is_finish=bool(child.get("is_finish"))))
+    # direct children are counted here, their subtree in the branches
+    total = len(children) + sum(branch["total"] for branch in branches.values())
+    unfinished = (len([child for child in children if not child.get("is_finish")])
+                  + sum(branch["unfinished"] for branch in branches.values()))
+    return dict(format_progress(total, unfinished), children=data)
+
+
+def format_progress(total: int, unfinished: int) -> dict:
+    return {
+        "total": total,
+        "finished": total - unfinished,
+        "ratio": round((total - unfinished) / total, 4) if total else None
+    }
+
+
 """
 CRUD DELETE
 """
 
 
 def delete_user_by_username(user: UserInDelete, db: MongoClient):
-    delete_user = db[database_name][user_collection_name].delete_one(
-        {'username': user.username})
+    delete_user = db[database_name][user_collection_name].find_one_and_delete(
+        {'username': user.username}, {'manager_id': 1, 'is_finish': 1})
+    invalidate_cached_users([user.username])
     if(not delete_user):
         return False
-    else:
-        return True
+    if(delete_user.get('manager_id') is not None):
+        increment_children_counters(
+            delete_user['manager_id'], -1, 0 if delete_user.get('is_finish') else -1, db)
+    return True
@@ -0,0 +1,15 @@
+"""
+Async (motor) versions of the user read queries, selected with MONGODB_ASYNC
+"""
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from ..models.user import User
+from ..core.config import database_name, user_collection_name
+
+
+async def get_user_by_username(username: str, db: AsyncIOMotorClient) -> User:
+    """Get all user info from database by username"""
+    user_data = await db[database_name][user_collection_name].find_one({"username": username})
+    if(user_data):
+        user_data["id"] = user_data.pop("_id")
+        return User(**user_data)
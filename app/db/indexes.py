@@ -0,0 +1,125 @@
+import logging
+from typing import Dict, List, Tuple
+
+from bson import ObjectId
+from pymongo import ASCENDING, GEOSPHERE, TEXT, IndexModel, MongoClient
+from pymongo.errors import OperationFailure
+
+from ..core.config import (database_name,
+                           user_collection_name,
+                           country_collection_name,
+                           city_collection_name,
+                           district_collection_name,
+                           ward_collection_name,
+                           civil_group_collection_name,
+                           survey_collection_name,
+                           job_collection_name)
+
+location_collection_names = [
+    country_collection_name,
+    city_collection_name,
+    district_collection_name,
+    ward_collection_name,
+    civil_group_collection_name
+]
+
+location_units = ['city', 'district', 'ward', 'civil_group']
+
+"""
+Index registry, applied by connect_to_mongo on startup
+"""
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    survey_collection_name: [
+        # insert paths rely on DuplicateKeyError for identity numbers
+        IndexModel([("identity_number", ASCENDING)], unique=True),
+        # full text search of retrieve_doc_in_survey
+        IndexModel([("fullname", TEXT)]),
+    ] + [
+        # location filters, the age distribution is answered from the index only
+        IndexModel([
+            (f"permanent_address.{unit}", ASCENDING),
+            ("gender", ASCENDING),
+            ("birth_year", ASCENDING)
+        ])
+        for unit in location_units
+    ],
+    user_collection_name: [
+        # create_new_user relies on DuplicateKeyError for usernames
+        IndexModel([("username", ASCENDING)], unique=True),
+        IndexModel([("manager_id", ASCENDING)]),
+        # subtree authorization and listings, multikey index on the managers of the user
+        IndexModel([("ancestors", ASCENDING)]),
+    ],
+    job_collection_name: [
+        IndexModel([("hostname", ASCENDING), ("status", ASCENDING)]),
+    ],
+}
+
+for collection_name in location_collection_names:
+    INDEXES[collection_name] = [
+        IndexModel([("code", ASCENDING)]),
+        IndexModel([("parents_code", ASCENDING)]),
+        # viewport queries of GET /location/within, locations without point are not indexed
+        IndexModel([("point", GEOSPHERE)]),
+    ]
+
+"""
+Query shapes of the hot paths, checked with explain() on startup
+"""
+
+QUERY_SHAPES: List[Tuple[str, dict]] = [
+    (survey_collection_name, {"identity_number": ""}),
+    (user_collection_name, {"username": ""}),
+    (user_collection_name, {"manager_id": ObjectId()}),
+    (user_collection_name, {"ancestors": ObjectId()}),
+] + [
+    (survey_collection_name, {f"permanent_address.{unit}": {"$in": [""]}})
+    for unit in location_units
+] + [
+    (survey_collection_name, {f"permanent_address.{unit}": {"$in": [""]}, "gender": "", "birth_year": {"$type": "number"}})
+    for unit in location_units
+] + [
+    (collection_name, {"code": ""}) for collection_name in location_collection_names
+] + [
+    (collection_name, {"parents_code": ""}) for collection_name in location_collection_names
+] + [
+    (collection_name, {"point": {"$geoWithin": {"$geometry": {
+        "type": "Polygon", "coordinates": [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]]}}}})
+    for collection_name in location_collection_names
+]
+
+
+def ensure_indexes(client: MongoClient):
+    """Create every registered index, existing indexes are left untouched"""
+    for collection_name, indexes in INDEXES.items():
+        try:
+            client[database_name][collection_name].create_indexes(indexes)
+        except OperationFailure as e:
+            # e.g. a conflicting index already exists or unique data is duplicated
+            logging.warning(f"Could not create indexes on {collection_name}: {e}")
+
+
+def get_plan_stages(plan: dict) -> List[str]:
+    """List stage names of a query plan tree"""
+    stages = [plan.get("stage")]
+    for key in ("inputStage", "outerStage", "innerStage"):
+        if(key in plan):
+            stages += get_plan_stages(plan[key])
+    for sub_plan in plan.get("inputStages", []):
+        stages += get_plan_stages(sub_plan)
+    return stages
+
+
+def check_query_plans(client: MongoClient):
+    """Log a warning for every registered query shape that runs a COLLSCAN"""
+    for collection_name, query in QUERY_SHAPES:
+        try:
+            explain = client[database_name].command(
+                "explain", {"find": collection_name, "filter": query}, verbosity="queryPlanner")
+        except OperationFailure as e:
+            logging.warning(f"Could not explain query {query} on {collection_name}: {e}")
+            continue
+        winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+        if("COLLSCAN" in get_plan_stages(winning_plan)):
+            logging.warning(f"Query {query} on {collection_name} runs a COLLSCAN")
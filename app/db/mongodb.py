@@ -1,9 +1,30 @@
+from typing import Callable
+
+from motor.motor_asyncio import AsyncIOMotorClient
 from pymongo import MongoClient
+from starlette.concurrency import run_in_threadpool
 
 class DataBase:
     client: MongoClient = None
+    # only set when MONGODB_ASYNC is enabled
+    async_client: AsyncIOMotorClient = None
 
 db = DataBase()
 
+DUPLICATE_KEY_ERROR_CODE = 11000
+
 def get_database() -> MongoClient:
     return db.client
+
+def get_async_database() -> AsyncIOMotorClient:
+    return db.async_client
+
+async def run_query(sync_fn: Callable, async_fn: Callable, *args):
+    """
+    Run a query with the async driver when MONGODB_ASYNC is enabled,
+    otherwise run its blocking version in the threadpool.
+    Both functions take the database client as last argument.
+    """
+    if(db.async_client is not None):
+        return await async_fn(*args, db.async_client)
+    return await run_in_threadpool(sync_fn, *args, db.client)
@@ -1,15 +1,42 @@
 import logging
 
+from motor.motor_asyncio import AsyncIOMotorClient
 from pymongo import MongoClient
-from ..core.config import MONGODB_URI
+from ..core.config import (MONGODB_URI,
+                           MONGODB_ASYNC,
+                           MONGODB_CHECK_QUERY_PLANS,
+                           MONGODB_MAX_POOL_SIZE,
+                           MONGODB_MIN_POOL_SIZE,
+                           MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+                           MONGODB_SOCKET_TIMEOUT_MS)
 from .mongodb import db
+from .indexes import ensure_indexes, check_query_plans
+from .monitoring import pool_listener, command_listener
+
+
+def get_client_options() -> dict:
+    return {
+        "maxPoolSize": MONGODB_MAX_POOL_SIZE,
+        "minPoolSize": MONGODB_MIN_POOL_SIZE,
+        "waitQueueTimeoutMS": MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+        "socketTimeoutMS": MONGODB_SOCKET_TIMEOUT_MS,
+        "event_listeners": [pool_listener, command_listener]
+    }
+
 
 def connect_to_mongo():
     logging.info("Connecting to database.....")
-    db.client = MongoClient(str(MONGODB_URI))
+    db.client = MongoClient(str(MONGODB_URI), **get_client_options())
+    if(MONGODB_ASYNC):
+        db.async_client = AsyncIOMotorClient(str(MONGODB_URI), **get_client_options())
     logging.info("Connected to database!")
+    ensure_indexes(db.client)
+    if(MONGODB_CHECK_QUERY_PLANS):
+        check_query_plans(db.client)
 
 def close_mongo_connection():
     logging.info("Closing database.....")
     db.client.close()
+    if(db.async_client is not None):
+        db.async_client.close()
     logging.info("Closed database!")
\ No newline at end of file
@@ -0,0 +1,132 @@
+import threading
+import time
+from typing import Dict, Tuple
+
+from pymongo import monitoring
+
+from ..core.metrics import LatencyStats, register_metrics
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Connection pool saturation: checkout wait time and connections in use"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # checkouts are synchronous, the start time is kept per thread
+        self.local = threading.local()
+        self.checkout_wait = LatencyStats()
+        self.checkout_failures = 0
+        self.in_use = 0
+        self.max_in_use = 0
+        self.open_connections = 0
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "checkout_wait": self.checkout_wait.to_dict(),
+                "checkout_failures": self.checkout_failures,
+                "in_use": self.in_use,
+                "max_in_use": self.max_in_use,
+                "open_connections": self.open_connections
+            }
+
+    def _checkout_duration_ms(self) -> float:
+        started = getattr(self.local, "checkout_started", None)
+        self.local.checkout_started = None
+        if(started is None):
+            return 0.0
+        return (time.perf_counter() - started) * 1000
+
+    def connection_check_out_started(self, event):
+        self.local.checkout_started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        duration_ms = self._checkout_duration_ms()
+        with self.lock:
+            self.checkout_wait.add(duration_ms)
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+
+    def connection_check_out_failed(self, event):
+        duration_ms = self._checkout_duration_ms()
+        with self.lock:
+            self.checkout_wait.add(duration_ms)
+            self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        with self.lock:
+            self.in_use -= 1
+
+    def connection_created(self, event):
+        with self.lock:
+            self.open_connections += 1
+
+    def connection_closed(self, event):
+        with self.lock:
+            self.open_connections -= 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """Server side command latency per collection and command"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending: Dict[Tuple[int, int], str] = {}
+        self.latency: Dict[Tuple[str, str], LatencyStats] = {}
+        self.failures: Dict[Tuple[str, str], int] = {}
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            data = {}
+            for (collection, command), stats in self.latency.items():
+                data[f"{collection}.{command}"] = {
+                    **stats.to_dict(),
+                    "failures": self.failures.get((collection, command), 0)
+                }
+            return data
+
+    def _finish(self, event, failed: bool):
+        with self.lock:
+            collection = self.pending.pop((event.request_id, event.operation_id), "")
+            key = (collection, event.command_name)
+            if(key not in self.latency):
+                self.latency[key] = LatencyStats()
+            self.latency[key].add(event.duration_micros / 1000)
+            if(failed):
+                self.failures[key] = self.failures.get(key, 0) + 1
+
+    def started(self, event):
+        if(event.command_name == "getMore"):
+            collection = event.command.get("collection")
+        else:
+            collection = event.command.get(event.command_name)
+        if(not isinstance(collection, str)):
+            # e.g. aggregate: 1 for database level commands
+            collection = event.database_name
+        with self.lock:
+            self.pending[(event.request_id, event.operation_id)] = collection
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+
+pool_listener = PoolMetricsListener()
+command_listener = CommandMetricsListener()
+
+register_metrics("mongo_pool", pool_listener.to_dict)
+register_metrics("mongo_commands", command_listener.to_dict)
@@ -3,6 +3,10 @@ from fastapi.middleware.cors import CORSMiddleware
 
 from .api.v1.api import router as api_router
 from .core.config import PROJECT_NAME, API_V1_STR
+from .core.jobs import start_job_runner, start_periodic_tasks, stop_job_runner, stop_periodic_tasks
+from .core.security import start_password_hasher, stop_password_hasher
+from .crud.reference_snapshot import load_reference_snapshot
+from .crud.role import load_role_hierarchy
 from .db.mongodb_utils import close_mongo_connection, connect_to_mongo
 
 app = FastAPI(
@@ -22,6 +26,14 @@ app.add_middleware(
 
 
 app.add_event_handler("startup", connect_to_mongo)
+app.add_event_handler("startup", load_reference_snapshot)
+app.add_event_handler("startup", load_role_hierarchy)
+app.add_event_handler("startup", start_job_runner)
+app.add_event_handler("startup", start_password_hasher)
+app.add_event_handler("startup", start_periodic_tasks)
+app.add_event_handler("shutdown", stop_periodic_tasks)
+app.add_event_handler("shutdown", stop_password_hasher)
+app.add_event_handler("shutdown", stop_job_runner)
 app.add_event_handler("shutdown", close_mongo_connection)
 
 app.include_router(api_router, prefix=API_V1_STR)
\ No newline at end of file
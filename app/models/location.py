@@ -28,4 +28,49 @@ class LocationListInSurvey(BaseModel):
                 "codes": ["01", "02", "03"],
             }
         }
-    
+
+
+class LocationDashboardInSurvey(BaseModel):
+    codes: List[str]
+    # optional series among edu_level, religion, hometown
+    facets: List[str] = []
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "codes": ["01", "02", "03"],
+                "facets": ["edu_level"]
+            }
+        }
+
+
+class LocationListInResolve(BaseModel):
+    # codes of any level, e.g. the raw codes of survey documents
+    codes: List[str]
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "codes": ["01", "0101", "010101"],
+            }
+        }
+
+
+class LocationInBulk(BaseModel):
+    code: str
+    name: str
+    # derived from the code when omitted, except for cities
+    parents_code: Optional[str] = None
+    lat: Optional[float] = None
+    lng: Optional[float] = None
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "code": "0101",
+                "name": "Ba Đình",
+                "parents_code": "01",
+                "lat": 21.0341,
+                "lng": 105.8142
+            }
+        }
@@ -1,6 +1,6 @@
 import datetime
 from pydantic import EmailStr, BaseModel
-from typing import Optional
+from typing import List, Optional
 from odmantic import ObjectId
 from bson.timestamp import Timestamp
 
@@ -12,6 +12,8 @@ class User(BaseModel):
     password: str
     manage_location: str
     manager_id: ObjectId
+    # managers from the root down to the direct manager
+    ancestors: List[ObjectId] = []
     role: str
     active: bool
     avtConfig: Optional[dict] = {}
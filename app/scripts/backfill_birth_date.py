@@ -0,0 +1,53 @@
+"""
+Parse the dob of surveys inserted before birth_date/birth_year existed.
+
+    python -m app.scripts.backfill_birth_date
+"""
+import logging
+
+from pymongo import MongoClient, UpdateOne
+
+from ..core.config import MONGODB_URI, database_name, survey_collection_name
+from ..crud.survey import parse_dob
+
+BATCH_SIZE = 1000
+
+
+def backfill_birth_date(client: MongoClient):
+    collection = client[database_name][survey_collection_name]
+    # older documents stored the date of birth as `birthday`
+    cursor = collection.find(
+        {"birth_year": {"$exists": False}}, {"dob": 1, "birthday": 1}, batch_size=BATCH_SIZE)
+
+    updated = 0
+    invalid = 0
+    operations = []
+    for doc in cursor:
+        dob = doc.get("dob") or doc.get("birthday")
+        birth_date = parse_dob(dob) if isinstance(dob, str) else None
+        if birth_date is None:
+            invalid += 1
+            continue
+        operations.append(UpdateOne(
+            {"_id": doc["_id"]},
+            {"$set": {"birth_date": birth_date, "birth_year": birth_date.year}}))
+        if len(operations) == BATCH_SIZE:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if len(operations) > 0:
+        updated += collection.bulk_write(operations, ordered=False).modified_count
+    return updated, invalid
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    client = MongoClient(str(MONGODB_URI))
+    try:
+        updated, invalid = backfill_birth_date(client)
+        logging.info(f"Backfilled {updated} surveys, {invalid} surveys have an invalid date of birth")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
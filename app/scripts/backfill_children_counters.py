@@ -0,0 +1,27 @@
+"""
+Recount children_count and unfinished_children (direct children whose task is not finished)
+of every user, fixes users created before the counters existed and any drift. Safe to re-run,
+the workers also run it every CHILDREN_COUNTERS_BACKFILL_INTERVAL seconds.
+
+    python -m app.scripts.backfill_children_counters
+"""
+import logging
+
+from pymongo import MongoClient
+
+from ..core.config import MONGODB_URI
+from ..crud.user import backfill_children_counters
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    client = MongoClient(str(MONGODB_URI))
+    try:
+        updated = backfill_children_counters(client)
+        logging.info(f"Recounted the children of {updated} users")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
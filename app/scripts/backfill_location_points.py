@@ -0,0 +1,36 @@
+"""
+Set the GeoJSON point of locations from their lat/lng, used by GET /location/within.
+
+    python -m app.scripts.backfill_location_points
+"""
+import logging
+
+from pymongo import MongoClient
+
+from ..core.config import MONGODB_URI, database_name
+from ..crud.location_tree import location_levels
+
+
+def backfill_location_points(client: MongoClient) -> int:
+    updated = 0
+    for level in location_levels:
+        # update with an aggregation pipeline, the point is computed by the server
+        result = client[database_name][level].update_many(
+            {"lat": {"$type": "number"}, "lng": {"$type": "number"}},
+            [{"$set": {"point": {"type": "Point", "coordinates": ["$lng", "$lat"]}}}])
+        updated += result.modified_count
+    return updated
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    client = MongoClient(str(MONGODB_URI))
+    try:
+        updated = backfill_location_points(client)
+        logging.info(f"Set the point of {updated} locations")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
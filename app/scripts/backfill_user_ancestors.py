@@ -0,0 +1,67 @@
+"""
+Set the ancestors (managers from the root down to the direct manager) of every user
+from manager_id, needed by subtree authorization and listings. Safe to re-run.
+
+    python -m app.scripts.backfill_user_ancestors
+"""
+import logging
+
+from pymongo import MongoClient, UpdateOne
+
+from ..core.config import MONGODB_URI, database_name, user_collection_name
+
+BATCH_SIZE = 1000
+
+
+def compute_ancestors(managers: dict) -> dict:
+    """{user id: manager id} to {user id: [ancestor ids, root first]}, users reaching a cycle are skipped"""
+    ancestors = {}
+    for user_id in managers:
+        # walk up to a resolved user or above the root
+        chain = []
+        current = user_id
+        while(current in managers and current not in ancestors and current not in chain):
+            chain.append(current)
+            current = managers[current]
+        if(current in chain):
+            logging.warning(f"Users {chain} reach a manager cycle")
+            continue
+        path = ancestors[current] + [current] if current in ancestors else []
+        for member in reversed(chain):
+            ancestors[member] = path
+            path = path + [member]
+    return ancestors
+
+
+def backfill_user_ancestors(client: MongoClient) -> int:
+    collection = client[database_name][user_collection_name]
+    users = list(collection.find({}, {"manager_id": 1, "ancestors": 1}))
+    managers = {user["_id"]: user.get("manager_id") for user in users}
+    current = {user["_id"]: user.get("ancestors") for user in users}
+
+    updated = 0
+    operations = []
+    for user_id, ancestors in compute_ancestors(managers).items():
+        if(current[user_id] == ancestors):
+            continue
+        operations.append(UpdateOne({"_id": user_id}, {"$set": {"ancestors": ancestors}}))
+        if(len(operations) == BATCH_SIZE):
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if(len(operations) > 0):
+        updated += collection.bulk_write(operations, ordered=False).modified_count
+    return updated
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    client = MongoClient(str(MONGODB_URI))
+    try:
+        updated = backfill_user_ancestors(client)
+        logging.info(f"Set the ancestors of {updated} users")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
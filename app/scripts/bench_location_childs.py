@@ -0,0 +1,86 @@
+"""
+Compare the two child listing paths (ObjectId arrays + $lookup vs indexed find on parents_code)
+on a generated hierarchy, in a scratch database that is dropped afterwards.
+
+    python -m app.scripts.bench_location_childs [--wards 10000] [--districts 100] [--rounds 5]
+"""
+import argparse
+import logging
+import time
+
+from pymongo import MongoClient
+
+from ..core.config import (MONGODB_URI,
+                           database_name,
+                           city_collection_name,
+                           district_collection_name,
+                           ward_collection_name)
+from ..core.metrics import LatencyStats
+from ..crud.location import query_childs_of_location
+from ..crud.location_tree import CHILD_QUERY_ARRAY, CHILD_QUERY_PARENTS_CODE
+from ..db.indexes import INDEXES
+
+
+def seed_locations(database, districts: int, wards: int):
+    """One city, `districts` districts sharing `wards` wards, linked both ways"""
+    for collection_name in (city_collection_name, district_collection_name, ward_collection_name):
+        database[collection_name].create_indexes(INDEXES[collection_name])
+
+    city_code = "01"
+    district_codes = [f"{city_code}{idx:02d}" for idx in range(districts)]
+    district_ids = database[district_collection_name].insert_many([
+        {"code": code, "name": f"District {code}", "parents_code": city_code} for code in district_codes
+    ]).inserted_ids
+    database[city_collection_name].insert_one(
+        {"code": city_code, "name": "City", district_collection_name: district_ids})
+
+    per_district = wards // districts
+    for code in district_codes:
+        ward_ids = database[ward_collection_name].insert_many([
+            {"code": f"{code}{idx:02d}", "name": f"Ward {code}{idx:02d}", "parents_code": code}
+            for idx in range(per_district)
+        ]).inserted_ids
+        database[district_collection_name].update_one(
+            {"code": code}, {"$set": {ward_collection_name: ward_ids}})
+    return district_codes
+
+
+def bench(database, district_codes, rounds: int) -> dict:
+    results = {}
+    for mode in (CHILD_QUERY_ARRAY, CHILD_QUERY_PARENTS_CODE):
+        stats = LatencyStats()
+        for _ in range(rounds):
+            for code in district_codes:
+                start = time.perf_counter()
+                query_childs_of_location(
+                    database, code, district_collection_name, ward_collection_name, mode)
+                stats.add((time.perf_counter() - start) * 1000)
+        results[mode] = stats.to_dict()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the child location queries")
+    parser.add_argument("--wards", type=int, default=10000)
+    parser.add_argument("--districts", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--database", default=f"{database_name}_bench")
+    args = parser.parse_args()
+    if(args.database == database_name):
+        parser.error("the benchmark drops its database, use a scratch database")
+
+    logging.basicConfig(level=logging.INFO)
+    client = MongoClient(str(MONGODB_URI))
+    try:
+        client.drop_database(args.database)
+        database = client[args.database]
+        district_codes = seed_locations(database, args.districts, args.wards)
+        for mode, stats in bench(database, district_codes, args.rounds).items():
+            logging.info(f"{mode}: {stats}")
+    finally:
+        client.drop_database(args.database)
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Create or update administrative units from a csv (header: code,name,parents_code,lat,lng)
+or a json list of units, units are matched by code so the import can be re-run.
+
+    python -m app.scripts.import_locations units.csv
+"""
+import argparse
+import logging
+
+from pymongo import MongoClient
+
+from ..core.config import MONGODB_URI
+from ..crud.location_import import LOCATION_FILE_EXTENSIONS, import_location_file
+from ..crud.reference_snapshot import reference_snapshot
+from ..crud.survey_import import get_file_extension
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk upsert administrative units")
+    parser.add_argument("path", help=f"{' or '.join(LOCATION_FILE_EXTENSIONS)} file")
+    args = parser.parse_args()
+    extension = get_file_extension(args.path)
+    if(extension not in LOCATION_FILE_EXTENSIONS):
+        parser.error(f"File extension must be one of {', '.join(LOCATION_FILE_EXTENSIONS)}")
+
+    logging.basicConfig(level=logging.INFO)
+    client = MongoClient(str(MONGODB_URI))
+    try:
+        result = import_location_file(args.path, extension, client)
+        for error in result["errors"]:
+            logging.warning(f"Row {error['row']}: {error['error']}")
+        logging.info(
+            f"{result['total']} units: {result['inserted']} inserted, "
+            f"{result['updated']} updated, {result['failed']} failed")
+        if(result["inserted"] > 0 or result["updated"] > 0):
+            # the background rebuild of the import would not run before the script exits
+            reference_snapshot.load(client, rebuild=True)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Set parents_code on every location linked by the legacy ObjectId child arrays,
+child listings then run as one indexed find on parents_code (LOCATION_CHILD_QUERY_MODE=parents_code).
+
+    python -m app.scripts.migrate_location_parents_code [--drop-arrays]
+
+--drop-arrays removes the arrays once they are copied, only use it when every worker
+runs with LOCATION_CHILD_QUERY_MODE=parents_code.
+"""
+import argparse
+import logging
+
+from pymongo import MongoClient, UpdateMany
+
+from ..core.config import MONGODB_URI, database_name
+from ..crud.location_tree import location_levels
+
+BATCH_SIZE = 500
+
+
+def migrate_parents_code(client: MongoClient, drop_arrays: bool = False):
+    database = client[database_name]
+    updated = 0
+    for level, sub_level in zip(location_levels, location_levels[1:]):
+        cursor = database[level].find(
+            {sub_level: {"$type": "array"}}, {"code": 1, sub_level: 1}, batch_size=BATCH_SIZE)
+        operations = []
+        for parent in cursor:
+            if(parent.get("code") is None or len(parent[sub_level]) == 0):
+                continue
+            operations.append(UpdateMany(
+                {"_id": {"$in": parent[sub_level]}, "parents_code": {"$ne": parent["code"]}},
+                {"$set": {"parents_code": parent["code"]}}))
+            if(len(operations) == BATCH_SIZE):
+                updated += database[sub_level].bulk_write(operations, ordered=False).modified_count
+                operations = []
+        if(len(operations) > 0):
+            updated += database[sub_level].bulk_write(operations, ordered=False).modified_count
+        if(drop_arrays):
+            database[level].update_many({sub_level: {"$exists": True}}, {"$unset": {sub_level: ""}})
+    return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy the location child arrays to parents_code")
+    parser.add_argument("--drop-arrays", action="store_true", help="remove the child arrays afterwards")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    client = MongoClient(str(MONGODB_URI))
+    try:
+        updated = migrate_parents_code(client, args.drop_arrays)
+        logging.info(f"Set parents_code of {updated} locations")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
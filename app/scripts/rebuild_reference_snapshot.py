@@ -0,0 +1,27 @@
+"""
+Rebuild the reference snapshot of this host after locations or roles were changed
+outside of the API, every worker swaps it in within REFERENCE_SNAPSHOT_CHECK_INTERVAL
+and rebuilds its role hierarchy.
+
+    python -m app.scripts.rebuild_reference_snapshot
+"""
+import logging
+
+from pymongo import MongoClient
+
+from ..core.config import MONGODB_URI
+from ..crud.role import reload_role_hierarchy
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    client = MongoClient(str(MONGODB_URI))
+    try:
+        # rebuilds the snapshot with the locations and the roles
+        reload_role_hierarchy(client)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
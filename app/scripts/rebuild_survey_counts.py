@@ -0,0 +1,27 @@
+"""
+Rebuild the survey count rollup from the survey collection, fixes drift of the counters.
+
+    python -m app.scripts.rebuild_survey_counts
+"""
+import logging
+import time
+
+from pymongo import MongoClient
+
+from ..core.config import MONGODB_URI
+from ..crud.survey_count import rebuild_survey_counts
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    client = MongoClient(str(MONGODB_URI))
+    try:
+        start = time.perf_counter()
+        rebuild_survey_counts(client)
+        logging.info(f"Rebuilt survey counts in {time.perf_counter() - start:.2f}s")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# app.core.config reads these at import time, the tests never connect to mongo
+os.environ.setdefault("PROJECT_NAME", "test")
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("REFERENCE_SNAPSHOT_PATH", os.path.join(tempfile.mkdtemp(), "reference.snap"))
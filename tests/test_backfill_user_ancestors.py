@@ -0,0 +1,21 @@
+from app.scripts.backfill_user_ancestors import compute_ancestors
+
+
+def test_ancestors_root_first():
+    managers = {"b2": "b1", "root": None, "a": "root", "b1": "a", "c": "root"}
+    assert compute_ancestors(managers) == {
+        "root": [],
+        "a": ["root"],
+        "b1": ["root", "a"],
+        "b2": ["root", "a", "b1"],
+        "c": ["root"],
+    }
+
+
+def test_manager_outside_the_users_is_the_root():
+    assert compute_ancestors({"a": "gone", "b": "a"}) == {"a": [], "b": ["a"]}
+
+
+def test_users_reaching_a_cycle_are_skipped():
+    managers = {"root": None, "a": "root", "x": "y", "y": "x", "z": "x"}
+    assert compute_ancestors(managers) == {"root": [], "a": ["root"]}
@@ -0,0 +1,77 @@
+import time
+
+from app.core.cache import TTLCache, cached_by_location
+from app.models.location import LocationListInSurvey
+
+
+def test_get_set_and_expiry():
+    cache = TTLCache(10, 60)
+    cache.set("a", 1)
+    cache.set("b", 2, expires_at=time.monotonic() - 1)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c", "default") == "default"
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(2, 60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_invalidate_tags():
+    cache = TTLCache(10, 60)
+    cache.set("a", 1, tags=["01", "02"])
+    cache.set("b", 2, tags=["02"])
+    cache.set("c", 3, tags=["03"])
+    cache.invalidate_tags(["02"])
+    assert cache.get("a") is None
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    # the tag index of removed entries is cleaned up
+    assert "01" not in cache.tags
+
+
+def test_set_is_skipped_after_an_invalidation_of_its_tags():
+    cache = TTLCache(10, 60)
+    generation = cache.get_generation(["01"])
+    cache.invalidate_tags(["01"])
+    cache.set("a", 1, tags=["01"], generation=generation)
+    assert cache.get("a") is None
+
+    generation = cache.get_generation(["01"])
+    cache.invalidate_tags(["02"])
+    cache.set("a", 1, tags=["01"], generation=generation)
+    assert cache.get("a") == 1
+
+    generation = cache.get_generation(["01"])
+    cache.clear()
+    cache.set("a", 1, tags=["01"], generation=generation)
+    assert cache.get("a") is None
+
+
+def test_cached_by_location_does_not_keep_a_value_read_before_a_write():
+    cache = TTLCache(10, 60)
+    calls = []
+
+    @cached_by_location(cache)
+    def count(location, db):
+        calls.append(location.codes)
+        if(len(calls) == 1):
+            # a write of the same location lands while the query runs
+            cache.invalidate_tags(["01"])
+        return len(calls)
+
+    location = LocationListInSurvey(codes=["02", "01"])
+    assert count(location, None) == 1
+    assert count(location, None) == 2
+    assert count(LocationListInSurvey(codes=["01", "02"]), None) == 2
+    assert len(calls) == 2
@@ -0,0 +1,36 @@
+import fcntl
+
+from app.core.jobs import PeriodicTask
+
+
+def make_task(tmp_path, runs, interval=60):
+    return PeriodicTask("recount", lambda db: runs.append(db) or len(runs), interval, str(tmp_path / "recount.stamp"))
+
+
+def test_periodic_task_runs_once_per_interval(tmp_path):
+    runs = []
+    # two workers of the same host
+    first, second = make_task(tmp_path, runs), make_task(tmp_path, runs)
+    assert first.run_if_due("db")
+    assert not second.run_if_due("db")
+    assert not first.run_if_due("db")
+    assert runs == ["db"]
+
+    (tmp_path / "recount.stamp").write_text("0")
+    assert second.run_if_due("db")
+    assert runs == ["db", "db"]
+
+
+def test_periodic_task_is_skipped_while_running_elsewhere(tmp_path):
+    runs = []
+    task = make_task(tmp_path, runs)
+    with open(task.stamp_path, "a") as stamp_file:
+        fcntl.flock(stamp_file, fcntl.LOCK_EX)
+        assert not task.run_if_due("db")
+    assert runs == []
+
+
+def test_disabled_periodic_task_does_not_start(tmp_path):
+    task = make_task(tmp_path, [], interval=0)
+    task.start("db")
+    assert task.thread is None
@@ -0,0 +1,43 @@
+import pytest
+from fastapi.exceptions import HTTPException
+
+from app.crud.location_geo import (MAX_LATITUDE,
+                                   build_viewport_match,
+                                   build_viewport_polygons,
+                                   parse_bbox)
+
+
+def test_parse_bbox():
+    assert parse_bbox("105.7,20.9,106,21.1") == (105.7, 20.9, 106, 21.1)
+    # the poles are clamped to the edge of the map
+    assert parse_bbox("-180,-90,180,90") == (-180, -MAX_LATITUDE, 180, MAX_LATITUDE)
+    for bbox in ["1,2,3", "a,b,c,d", "106,20,105,21", "-181,20,105,21", "105,86,106,90"]:
+        with pytest.raises(HTTPException) as error:
+            parse_bbox(bbox)
+        assert error.value.status_code == 400
+
+
+def test_small_viewport_is_one_rectangle():
+    assert build_viewport_match((105, 20, 105.5, 21)) == {
+        'point': {
+            '$geoWithin': {
+                '$geometry': {
+                    'type': 'Polygon',
+                    'coordinates': [[[105, 20], [105.5, 20], [105.5, 21], [105, 21], [105, 20]]]
+                }
+            }
+        }
+    }
+
+
+def test_wide_viewport_is_split():
+    rings = build_viewport_polygons(parse_bbox("-180,-90,180,90"))
+    assert len(rings) == 4
+    for idx, ring in enumerate(rings):
+        west, east = -180 + 90 * idx, -90 + 90 * idx
+        assert ring[0] == ring[-1] == [west, -MAX_LATITUDE]
+        # the parallels get a vertex every degree, the meridians are the two other edges
+        assert len(ring) == 2 * 91 + 1
+        assert {lng for lng, _ in ring} == set(range(west, east + 1))
+        assert {lat for _, lat in ring} == {-MAX_LATITUDE, MAX_LATITUDE}
+    assert len(build_viewport_match((0, 0, 100, 10))['$or']) == 2
@@ -0,0 +1,35 @@
+from app.crud.location_import import validate_location
+from app.models.location import LocationInBulk
+
+
+def validate(code, parents_code=None, country_code=None):
+    location = LocationInBulk(code=code, name="x", parents_code=parents_code)
+    return validate_location(location, country_code), location.parents_code
+
+
+def test_parents_code_is_derived_from_the_code():
+    assert validate("0101") == (None, "01")
+    assert validate("010101") == (None, "0101")
+    assert validate("01010101") == (None, "010101")
+
+
+def test_parents_code_must_match_the_code():
+    assert validate("0101", "02") == ("parents_code must be 01", "02")
+
+
+def test_a_city_belongs_to_the_country():
+    assert validate("01", country_code="0") == (None, "0")
+    assert validate("01", "0") == (None, "0")
+    error, _ = validate("01")
+    assert error == "parents_code of a city is required when there is not exactly one country"
+    assert validate("01", "0101") == ("parents_code is not of the parent level", "0101")
+
+
+def test_a_country_has_no_parent():
+    assert validate("0") == (None, None)
+    assert validate("0", "1") == ("a country has no parent", "1")
+
+
+def test_invalid_codes():
+    for code in ["012", "0a", "", "0123456789"]:
+        assert validate(code)[0] == "code must be 1, 2, 4, 6 or 8 digits"
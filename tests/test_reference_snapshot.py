@@ -0,0 +1,176 @@
+import time
+
+import pytest
+
+from app.crud import reference_snapshot as reference_snapshot_module
+from app.crud.location_tree import LocationNode
+from app.crud.reference_snapshot import ReferenceSnapshot, SnapshotView, serialize_snapshot, write_snapshot
+from app.core.config import (country_collection_name,
+                             city_collection_name,
+                             district_collection_name,
+                             ward_collection_name,
+                             civil_group_collection_name)
+
+ROLES = {"A1": ["A2"], "A2": ["A3"], "A3": []}
+
+
+def make_tree(ward_name="Phúc Xá"):
+    country = LocationNode("0", "Việt Nam", country_collection_name)
+    city = LocationNode("01", "Hà Nội", city_collection_name, "0", 21.03, 105.85)
+    district = LocationNode("0101", "Ba Đình", district_collection_name, "01")
+    wards = [
+        LocationNode("010101", ward_name, ward_collection_name, "0101", 21.04, 105.84),
+        LocationNode("010102", "Trúc Bạch", ward_collection_name, "0101"),
+    ]
+    # a city of another country, not linked to any parent
+    orphan = LocationNode("02", "Hà Giang", city_collection_name)
+    # a location without code
+    group = LocationNode(None, "Tổ 1", civil_group_collection_name)
+    country.children.append(city)
+    city.children.append(district)
+    district.children.extend(wards)
+    wards[0].children.append(group)
+    roots = {
+        country_collection_name: [country],
+        city_collection_name: [orphan],
+        district_collection_name: [],
+        ward_collection_name: [],
+        civil_group_collection_name: []
+    }
+    return roots
+
+
+def write(tmp_path, roots, name="reference.snap", generation=1):
+    path = str(tmp_path / name)
+    write_snapshot(path, serialize_snapshot(roots, ROLES, generation))
+    return path
+
+
+def load(path):
+    snapshot = ReferenceSnapshot(path, max_age=3600, check_interval=3600, rebuild_delay=0)
+    # the snapshot is fresh, load does not touch the database
+    snapshot.load(None)
+    return snapshot
+
+
+def test_round_trip(tmp_path):
+    view = SnapshotView(write(tmp_path, make_tree(), generation=42))
+    assert view.generation == 42
+    assert view.roles == ROLES
+    assert view.record_count == 7
+    assert view.find("99") is None
+
+    ward = view.node(view.find("010101"))
+    assert (ward.code, ward.name, ward.level, ward.parents_code) == (
+        "010101", "Phúc Xá", ward_collection_name, "0101")
+    assert (ward.lat, ward.lng) == (21.04, 105.84)
+    children = view.children(view.find("010101"))
+    assert [child.name for child in children] == ["Tổ 1"]
+    assert (children[0].code, children[0].parents_code) == (None, "010101")
+    other_ward = view.node(view.find("010102"))
+    assert (other_ward.lat, other_ward.lng) == (None, None)
+    assert view.node(view.find("02")).parents_code is None
+
+
+def test_code_index(tmp_path):
+    district = LocationNode("0101", "Ba Đình", district_collection_name)
+    district.children = [
+        LocationNode(f"0101{idx:04}", f"Phường {idx}", ward_collection_name, "0101") for idx in range(1000)
+    ]
+    roots = {level: [] for level in make_tree()}
+    roots[district_collection_name] = [district]
+    view = SnapshotView(write(tmp_path, roots))
+    # at most half full, colliding codes are probed past
+    assert view.slot_count == 2048
+    for idx in range(1000):
+        assert view.node(view.find(f"0101{idx:04}")).name == f"Phường {idx}"
+    assert view.find("01011000") is None
+    assert view.find("") is None
+
+    empty = SnapshotView(write(tmp_path, {level: [] for level in make_tree()}, name="empty.snap"))
+    assert empty.find("01") is None
+
+
+def test_lookups(tmp_path):
+    snapshot = load(write(tmp_path, make_tree()))
+    assert snapshot.loaded
+    assert snapshot.get("0101").name == "Ba Đình"
+    assert snapshot.get("99") is None
+    assert [node.code for node in snapshot.get_children("0101")] == ["010101", "010102"]
+    assert snapshot.get_children("010102") == []
+    assert snapshot.get_children("99") is None
+    assert [node.code for node in snapshot.get_lineage("010101")] == ["0", "01", "0101", "010101"]
+    assert snapshot.get_lineage("99") is None
+    # linked and unlinked cities
+    assert [node.code for node in snapshot.get_level(city_collection_name)] == ["01", "02"]
+    assert snapshot.get_role_graph() == ROLES
+
+
+def test_subtree_versions(tmp_path):
+    before = load(write(tmp_path, make_tree(), name="before.snap"))
+    after = load(write(tmp_path, make_tree(ward_name="Quán Thánh"), name="after.snap"))
+    # every ancestor of the changed ward gets a new version, the other branches keep theirs
+    for code in ["0", "01", "0101", "010101"]:
+        assert before.get_version(code) != after.get_version(code)
+    for code in ["010102", "02"]:
+        assert before.get_version(code) == after.get_version(code)
+    assert before.get_version("99") is None
+    assert before.get_roles_version() == after.get_roles_version()
+
+
+def test_invalid_file(tmp_path):
+    path = tmp_path / "reference.snap"
+    path.write_bytes(b"not a snapshot")
+    with pytest.raises(ValueError):
+        SnapshotView(str(path))
+    assert not ReferenceSnapshot(str(path), max_age=3600, check_interval=1, rebuild_delay=0).is_fresh()
+
+
+def test_no_snapshot_loaded(tmp_path):
+    snapshot = ReferenceSnapshot(str(tmp_path / "reference.snap"), max_age=3600, check_interval=1, rebuild_delay=0)
+    assert not snapshot.loaded
+    assert snapshot.get("01") is None
+    assert snapshot.get_children("01") is None
+    assert snapshot.get_level(city_collection_name) == []
+    assert snapshot.get_roles_version() is None
+
+
+def test_writes_share_one_background_rebuild(tmp_path, monkeypatch):
+    path = write(tmp_path, make_tree())
+    snapshot = ReferenceSnapshot(path, max_age=3600, check_interval=3600, rebuild_delay=0.05)
+    snapshot.load(None)
+    builds = []
+
+    def build_snapshot(db, path):
+        builds.append(db)
+        write_snapshot(path, serialize_snapshot(make_tree(ward_name="Quán Thánh"), ROLES, time.time_ns()))
+
+    monkeypatch.setattr(reference_snapshot_module, "build_snapshot", build_snapshot)
+    snapshot.request_rebuild("db")
+    snapshot.request_rebuild("db")
+    # the request does not wait for the rebuild
+    assert snapshot.get("010101").name == "Phúc Xá"
+    deadline = time.monotonic() + 5
+    while(snapshot.rebuild_scheduled and time.monotonic() < deadline):
+        time.sleep(0.01)
+    assert builds == ["db"]
+    assert snapshot.get("010101").name == "Quán Thánh"
+
+
+def test_snapshot_older_than_max_age_is_rebuilt(tmp_path, monkeypatch):
+    path = write(tmp_path, make_tree(), generation=time.time_ns() - 60 * 10 ** 9)
+    snapshot = ReferenceSnapshot(path, max_age=30, check_interval=0, rebuild_delay=0)
+    builds = []
+
+    def build_snapshot(db, path):
+        builds.append(db)
+        write_snapshot(path, serialize_snapshot(make_tree(ward_name="Quán Thánh"), ROLES, time.time_ns()))
+
+    monkeypatch.setattr(reference_snapshot_module, "build_snapshot", build_snapshot)
+    snapshot.load("db")
+    assert snapshot.get("010101").name == "Phúc Xá"
+    deadline = time.monotonic() + 5
+    while((len(builds) == 0 or snapshot.rebuild_scheduled) and time.monotonic() < deadline):
+        time.sleep(0.01)
+    assert builds == ["db"]
+    assert snapshot.get("010101").name == "Quán Thánh"
@@ -0,0 +1,46 @@
+from app.crud import reference_snapshot as reference_snapshot_module
+from app.crud import role as role_module
+from app.crud.location_tree import location_levels
+from app.crud.reference_snapshot import ReferenceSnapshot, serialize_snapshot, write_snapshot
+from app.crud.role import RoleHierarchy, get_role_hierarchy, reload_role_hierarchy
+
+ROLES = {"A1": ["A2"], "A2": ["A3"], "A3": ["B1"], "B1": ["B2"], "B2": []}
+
+
+def test_descendants():
+    hierarchy = RoleHierarchy(ROLES)
+    assert hierarchy.get_children("A2") == ("A3",)
+    assert hierarchy.get_descendants("A2") == {"A3", "B1", "B2"}
+    assert hierarchy.get_descendants("B2") == frozenset()
+    assert hierarchy.get_descendants("C1") == frozenset()
+    assert hierarchy.is_child("A1", "A2") and not hierarchy.is_child("A1", "A3")
+    assert hierarchy.is_descendant("A1", "B2")
+    assert not hierarchy.is_descendant("A3", "A2")
+    assert not hierarchy.is_descendant("A3", "A3")
+
+
+def test_cyclic_graph():
+    hierarchy = RoleHierarchy({"A1": ["A2"], "A2": ["A1", "A3"], "A3": []})
+    assert hierarchy.get_descendants("A1") == {"A2", "A3"}
+    assert hierarchy.get_descendants("A2") == {"A1", "A3"}
+
+
+def test_reload_rebuilds_the_snapshot(tmp_path, monkeypatch):
+    roots = {level: [] for level in location_levels}
+    path = str(tmp_path / "reference.snap")
+    write_snapshot(path, serialize_snapshot(roots, ROLES, 1))
+    snapshot = ReferenceSnapshot(path, max_age=3600, check_interval=3600, rebuild_delay=0)
+    snapshot.load(None)
+    monkeypatch.setattr(role_module, "reference_snapshot", snapshot)
+    monkeypatch.setattr(role_module, "_current", (None, None))
+    assert get_role_hierarchy(None).is_descendant("A1", "B2")
+
+    roles = dict(ROLES, A3=[])
+    monkeypatch.setattr(
+        reference_snapshot_module, "build_snapshot",
+        lambda db, path: write_snapshot(path, serialize_snapshot(roots, roles, 2)))
+    # the snapshot is fresh, only the reload rebuilds it
+    hierarchy = reload_role_hierarchy("db")
+    assert snapshot.get_generation() == 2
+    assert not hierarchy.is_descendant("A1", "B2")
+    assert get_role_hierarchy(None) is hierarchy
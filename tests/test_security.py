@@ -0,0 +1,81 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.core import security
+from app.core.security import PasswordHasher, PasswordPoolBrokenError, PasswordPoolFullError
+
+
+@pytest.fixture
+def hasher(monkeypatch):
+    hashed = []
+
+    def get_password_hash(password):
+        hashed.append(password)
+        return f"hash:{password}"
+
+    monkeypatch.setattr(security, "get_password_hash", get_password_hash)
+    hasher = PasswordHasher(max_workers=2, queue_size=2)
+    # threads instead of processes, the fake hash is not importable by a pool process
+    hasher.executor = ThreadPoolExecutor(max_workers=2)
+    hasher.hashed = hashed
+    yield hasher
+    hasher.stop()
+
+
+def test_hash_many_keeps_the_order(hasher):
+    passwords = [str(idx) for idx in range(5)]
+    assert asyncio.run(hasher.hash_many(passwords)) == [f"hash:{password}" for password in passwords]
+    assert asyncio.run(hasher.hash_many([])) == []
+    assert hasher.in_flight == 0
+    assert hasher.stats()["hash"]["count"] == 5
+
+
+def test_hash_many_is_rejected_before_hashing(hasher):
+    # three single hashes in flight, the batch needs two slots
+    hasher.in_flight = 3
+    with pytest.raises(PasswordPoolFullError):
+        asyncio.run(hasher.hash_many(["a", "b", "c"]))
+    assert hasher.hashed == []
+    assert hasher.in_flight == 3
+    assert hasher.stats()["rejected"] == 1
+
+
+def test_hash_many_fails_as_a_whole(hasher, monkeypatch):
+    def get_password_hash(password):
+        if(password == "b"):
+            raise ValueError(password)
+        return password
+
+    monkeypatch.setattr(security, "get_password_hash", get_password_hash)
+    with pytest.raises(ValueError):
+        asyncio.run(hasher.hash_many(["a", "b", "c"]))
+    assert hasher.in_flight == 0
+
+
+def test_hash_is_rejected_when_the_pool_is_full(hasher):
+    hasher.in_flight = 4
+    with pytest.raises(PasswordPoolFullError):
+        asyncio.run(hasher.hash("a"))
+    hasher.in_flight = 3
+    assert asyncio.run(hasher.hash("a")) == "hash:a"
+    assert hasher.in_flight == 3
+    assert hasher.stats()["rejected"] == 1
+
+
+def test_broken_pool_is_restarted():
+    hasher = PasswordHasher(max_workers=1, queue_size=1)
+    hasher.warm_up()
+    try:
+        broken = hasher.executor
+        # the pool process exits in the middle of the call
+        with pytest.raises(PasswordPoolBrokenError):
+            asyncio.run(hasher.run("hash", os._exit, 1))
+        assert hasher.in_flight == 0
+        assert hasher.stats()["restarts"] == 1
+        assert hasher.executor is not broken
+        assert asyncio.run(hasher.run("hash", os.getpid)) != os.getpid()
+    finally:
+        hasher.stop()
@@ -0,0 +1,52 @@
+from bson import ObjectId
+
+from app.crud.user import (build_subtree_progress_pipeline,
+                           build_subtree_state_pipeline,
+                           summarize_subtree_progress)
+from app.models.user import User
+
+
+def test_subtree_state_pipeline_streams_the_descendants():
+    user_id = ObjectId()
+    pipeline = build_subtree_state_pipeline(user_id, False)
+    stages = [next(iter(stage)) for stage in pipeline]
+    # $unwind right after $graphLookup, the subtree is never gathered in one document
+    assert stages == ['$match', '$graphLookup', '$unwind', '$project', '$unionWith', '$set', '$merge']
+    assert pipeline[0]['$match'] == {'_id': user_id}
+    assert pipeline[2]['$unwind']['path'] == '$' + pipeline[1]['$graphLookup']['as']
+    assert pipeline[3]['$project'] == {'_id': '$descendants._id'}
+    # the user itself is written by the same pipeline
+    assert pipeline[4]['$unionWith']['pipeline'][0] == {'$match': {'_id': user_id}}
+    assert pipeline[5]['$set'] == {'active': {'$literal': False}}
+    assert pipeline[6]['$merge']['whenNotMatched'] == 'discard'
+
+
+def test_subtree_progress_pipeline_groups_by_branch():
+    root, manager = ObjectId(), ObjectId()
+    user = User(id=manager, username="01", password="x", manage_location="01", manager_id=root,
+                role="A2", active=True, ancestors=[root])
+    pipeline = build_subtree_progress_pipeline(user)
+    assert pipeline[0]['$match'] == {'ancestors': manager}
+    # ancestors of a descendant are [root, manager, branch, ...]
+    assert pipeline[1]['$group']['_id']['$ifNull'][0] == {'$arrayElemAt': ['$ancestors', 2]}
+
+
+def test_summarize_subtree_progress():
+    a, b = ObjectId(), ObjectId()
+    children = [
+        {"_id": a, "username": "0101", "is_finish": True},
+        {"_id": b, "username": "0102"},
+    ]
+    # the children of `a` finished 3 of 4 tasks, the children of their children 1 of 2
+    branches = [{"_id": a, "total": 6, "unfinished": 2}]
+    progress = summarize_subtree_progress(children, branches)
+    assert {key: progress[key] for key in ("total", "finished", "ratio")} == {
+        "total": 8, "finished": 5, "ratio": 0.625}
+    assert progress["children"] == [
+        {"total": 6, "finished": 4, "ratio": 0.6667, "username": "0101", "is_finish": True},
+        {"total": 0, "finished": 0, "ratio": None, "username": "0102", "is_finish": False},
+    ]
+
+
+def test_progress_without_children():
+    assert summarize_subtree_progress([], []) == {"total": 0, "finished": 0, "ratio": None, "children": []}